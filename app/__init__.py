@@ -23,6 +23,11 @@ bcrypt = Bcrypt(app)
 # Initialize Flask Sql Alchemy
 db = SQLAlchemy(app)
 
+# Compress responses
+from app.compression import init_compression
+
+init_compression(app)
+
 # Import the application views
 from app import views
 
@@ -42,3 +47,8 @@ app.register_blueprint(storeitems, url_prefix='/v1')
 from app.docs.views import docs
 
 app.register_blueprint(docs)
+
+# Background maintenance
+from app.auth.tasks import start_blacklist_purge_task
+
+start_blacklist_purge_task(app)
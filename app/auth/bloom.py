@@ -0,0 +1,172 @@
+from app import app
+import hashlib
+import math
+import threading
+import time
+
+
+class BloomFilter:
+    """
+    Fixed size Bloom filter. Answers "definitely absent" or "possibly present".
+    """
+
+    def __init__(self, capacity, error_rate):
+        capacity = max(capacity, 1)
+        self.size = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(int(round(self.size / capacity * math.log(2))), 1)
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.sha256(key.encode('utf-8')).digest()
+        first = int.from_bytes(digest[:8], 'big')
+        second = int.from_bytes(digest[8:16], 'big') | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, key):
+        """
+        Add a key to the filter
+        :param key: String key
+        :return:
+        """
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def estimated_false_positive_rate(self):
+        """
+        Theoretical false positive rate for the number of keys added so far.
+        :return: float
+        """
+        return (1 - math.exp(-self.hash_count * self.count / self.size)) ** self.hash_count
+
+
+class BlacklistFilter:
+    """
+    In memory front for the token blacklist table.
+    The filter is built from the table on first use and rebuilt periodically so that tokens
+    blacklisted by other worker processes are picked up.
+    """
+
+    def __init__(self, capacity, error_rate, rebuild_interval):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.rebuild_interval = rebuild_interval
+        self.loader = None
+        self.lookups = 0
+        self.positives = 0
+        self.false_positives = 0
+        self._filter = None
+        self._built_at = 0
+        self._added = []
+        self._lock = threading.Lock()
+        # Held by the one thread reloading the table, the others keep using the current filter
+        self._rebuild_lock = threading.Lock()
+
+    def might_contain(self, token):
+        """
+        Check whether the token may have been blacklisted.
+        A False answer is final, a True answer must be confirmed against the database.
+        :param token: Blacklist key of the token
+        :return: bool
+        """
+        bloom = self._filter
+        if bloom is None:
+            # Nothing to answer with yet, wait for the first build
+            with self._rebuild_lock:
+                bloom = self._filter if self._filter is not None else self._load()
+        elif self._stale() and self._rebuild_lock.acquire(blocking=False):
+            try:
+                if self._stale():
+                    bloom = self._load()
+            finally:
+                self._rebuild_lock.release()
+        with self._lock:
+            self.lookups += 1
+        return token in bloom
+
+    def add(self, token):
+        """
+        Record a newly blacklisted token.
+        :param token: Blacklist key of the token
+        :return:
+        """
+        with self._lock:
+            if self._filter is not None:
+                self._filter.add(token)
+            # Tokens added while a rebuild is loading the table must survive the swap
+            self._added.append(token)
+
+    def record(self, confirmed):
+        """
+        Record the database answer for a possible hit.
+        :param confirmed: True when the token really was blacklisted
+        :return:
+        """
+        with self._lock:
+            self.positives += 1
+            if not confirmed:
+                self.false_positives += 1
+
+    def _stale(self):
+        return time.time() - self._built_at > self.rebuild_interval
+
+    def rebuild(self):
+        """
+        Build a fresh filter from the blacklist table and swap it in.
+        :return: BloomFilter
+        """
+        with self._rebuild_lock:
+            return self._load()
+
+    def _load(self):
+        # Callers hold _rebuild_lock
+        with self._lock:
+            self._added = []
+        tokens = list(self.loader())
+        bloom = BloomFilter(max(self.capacity, 2 * len(tokens)), self.error_rate)
+        for token in tokens:
+            bloom.add(token)
+        with self._lock:
+            for token in self._added:
+                bloom.add(token)
+            self._added = []
+            self._filter = bloom
+            self._built_at = time.time()
+        return bloom
+
+    def reset(self):
+        """
+        Drop the filter so that it is rebuilt on the next lookup.
+        :return:
+        """
+        with self._lock:
+            self._filter = None
+            self._added = []
+            self.lookups = self.positives = self.false_positives = 0
+
+    def stats(self):
+        """
+        Filter size and false positive figures.
+        :return: dict
+        """
+        with self._lock:
+            bloom = self._filter
+            negatives = self.lookups - (self.positives - self.false_positives)
+            return {
+                'keys': bloom.count if bloom else 0,
+                'bits': bloom.size if bloom else 0,
+                'hashes': bloom.hash_count if bloom else 0,
+                'estimatedFalsePositiveRate': bloom.estimated_false_positive_rate() if bloom else 0.0,
+                'lookups': self.lookups,
+                'positives': self.positives,
+                'falsePositives': self.false_positives,
+                'observedFalsePositiveRate': self.false_positives / negatives if negatives else 0.0
+            }
+
+
+blacklist_filter = BlacklistFilter(app.config['BLACKLIST_FILTER_CAPACITY'], app.config['BLACKLIST_FILTER_ERROR_RATE'],
+                                   app.config['BLACKLIST_FILTER_REBUILD_SECONDS'])
@@ -0,0 +1,190 @@
+from app import app
+from collections import OrderedDict, namedtuple
+import threading
+import time
+
+# Minimal snapshot of the authenticated user handed to the views by token_required, with the
+# token version the token was issued under
+CurrentUser = namedtuple('CurrentUser', ['id', 'email', 'token_version'])
+
+
+class TokenCache:
+    """
+    Bounded LRU cache of verified auth tokens with a time to live.
+    Each token maps to the snapshot of the user it belongs to. Entries never outlive the
+    expiry of the token itself.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._tokens_by_user = {}
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        """
+        Return the cached user snapshot for the token or None if it is missing or stale.
+        :param token: Auth token
+        :return: CurrentUser or None
+        """
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                self.misses += 1
+                return None
+            user, expires_at = entry
+            if expires_at <= time.time():
+                self._remove(token)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return user
+
+    def set(self, token, user, token_expiry):
+        """
+        Cache a verified token.
+        :param token: Auth token
+        :param user: CurrentUser snapshot
+        :param token_expiry: Unix timestamp at which the token expires
+        :return:
+        """
+        if self.max_size <= 0:
+            return
+        expires_at = min(time.time() + self.ttl, token_expiry)
+        with self._lock:
+            if token in self._entries:
+                self._remove(token)
+            self._entries[token] = (user, expires_at)
+            self._tokens_by_user.setdefault(user.id, set()).add(token)
+            while len(self._entries) > self.max_size:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, token):
+        """
+        Drop a single token from the cache.
+        :param token: Auth token
+        :return:
+        """
+        with self._lock:
+            if token in self._entries:
+                self._remove(token)
+
+    def invalidate_user(self, user_id):
+        """
+        Drop every cached token belonging to a user.
+        :param user_id: User Id
+        :return:
+        """
+        with self._lock:
+            for token in list(self._tokens_by_user.get(user_id, ())):
+                self._remove(token)
+
+    def clear(self):
+        """
+        Empty the cache and reset the counters.
+        :return:
+        """
+        with self._lock:
+            self._entries.clear()
+            self._tokens_by_user.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """
+        Cache counters.
+        :return: dict
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxSize': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hitRatio': self.hits / lookups if lookups else 0.0
+            }
+
+    def _remove(self, token):
+        user, _ = self._entries.pop(token)
+        tokens = self._tokens_by_user.get(user.id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[user.id]
+
+
+class VersionCache:
+    """
+    Bounded LRU cache of user Id to token version with a time to live.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """
+        Return the cached token version of a user or None.
+        :param user_id: User Id
+        :return: int or None
+        """
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[1] <= time.time():
+                self._entries.pop(user_id, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, user_id, version):
+        """
+        Cache the token version of a user.
+        :param user_id: User Id
+        :param version: Token version
+        :return:
+        """
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._entries[user_id] = (version, time.time() + self.ttl)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Empty the cache and reset the counters.
+        :return:
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        """
+        Cache counters.
+        :return: dict
+        """
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxSize': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+token_cache = TokenCache(app.config['AUTH_TOKEN_CACHE_SIZE'], app.config['AUTH_TOKEN_CACHE_TTL'])
+version_cache = VersionCache(app.config['AUTH_TOKEN_CACHE_SIZE'], app.config['AUTH_TOKEN_CACHE_TTL'])
@@ -0,0 +1,148 @@
+from app import app, bcrypt
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import threading
+import time
+
+
+class HasherBusy(Exception):
+    """
+    Raised when the password hasher cannot take or finish more work in time.
+    """
+    pass
+
+
+class PasswordHasher:
+    """
+    Bounded worker pool for bcrypt hashing and verification.
+    At most `workers` hashes run at once and at most `queue_size` more wait for a worker,
+    anything beyond that is rejected straight away with HasherBusy.
+    """
+
+    def __init__(self, workers, queue_size, timeout):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.queued = 0
+        self.running = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._lock = threading.Lock()
+
+    def generate_password_hash(self, password, rounds=None):
+        """
+        Hash a password on the worker pool.
+        :param password: Plain text password
+        :param rounds: bcrypt log rounds
+        :return: Password hash
+        """
+        return self._run(bcrypt.generate_password_hash, password, rounds)
+
+    def check_password_hash(self, pw_hash, password):
+        """
+        Verify a password against its hash on the worker pool.
+        :param pw_hash: Stored password hash
+        :param password: Plain text password
+        :return: bool
+        """
+        return self._run(bcrypt.check_password_hash, pw_hash, password)
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise HasherBusy()
+        with self._lock:
+            self.queued += 1
+        future = self._executor.submit(self._timed, fn, *args)
+        future.add_done_callback(self._release)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            with self._lock:
+                self.timed_out += 1
+            future.cancel()
+            raise HasherBusy()
+
+    def _timed(self, fn, *args):
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+        started = time.time()
+        try:
+            return fn(*args)
+        finally:
+            latency = time.time() - started
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+                self.total_latency += latency
+                self.max_latency = max(self.max_latency, latency)
+
+    def _release(self, future):
+        if future.cancelled():
+            with self._lock:
+                self.queued -= 1
+        self._slots.release()
+
+    def stats(self):
+        """
+        Queue depth and hash latency figures.
+        :return: dict
+        """
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queueSize': self.queue_size,
+                'queued': self.queued,
+                'running': self.running,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'timedOut': self.timed_out,
+                'averageLatency': self.total_latency / self.completed if self.completed else 0.0,
+                'maxLatency': self.max_latency
+            }
+
+
+def hash_log_rounds(pw_hash):
+    """
+    Read the cost a bcrypt hash was made with.
+    :param pw_hash: bcrypt hash such as $2b$12$...
+    :return: int
+    """
+    return int(pw_hash.split('$')[2])
+
+
+def calibrate_log_rounds(target_ms, min_rounds=4, max_rounds=16, samples=3):
+    """
+    Benchmark bcrypt on this machine and pick the highest cost whose verification
+    stays within the target latency.
+    :param target_ms: Target verify latency in milliseconds
+    :param min_rounds: Lowest cost considered
+    :param max_rounds: Highest cost considered
+    :param samples: Verifications timed per cost, the median is kept
+    :return: Chosen cost and a list of (cost, median milliseconds) pairs
+    """
+    chosen = min_rounds
+    timings = []
+    for rounds in range(min_rounds, max_rounds + 1):
+        pw_hash = bcrypt.generate_password_hash('calibration-password', rounds)
+        durations = []
+        for _ in range(samples):
+            started = time.time()
+            bcrypt.check_password_hash(pw_hash, 'calibration-password')
+            durations.append((time.time() - started) * 1000)
+        median = sorted(durations)[len(durations) // 2]
+        timings.append((rounds, median))
+        if median > target_ms:
+            break
+        chosen = rounds
+    return chosen, timings
+
+
+password_hasher = PasswordHasher(app.config['PASSWORD_HASHER_WORKERS'], app.config['PASSWORD_HASHER_QUEUE_SIZE'],
+                                 app.config['PASSWORD_HASHER_TIMEOUT_SECONDS'])
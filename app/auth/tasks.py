@@ -0,0 +1,45 @@
+from app import db
+from app.models import BlackListToken, RefreshToken
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def purge_blacklist_forever(app, interval, batch_size):
+    """
+    Periodically delete expired tokens from the blacklist and the refresh token table.
+    :param app: Flask application
+    :param interval: Seconds between two purges
+    :param batch_size: Rows deleted per transaction
+    :return:
+    """
+    while True:
+        time.sleep(interval)
+        with app.app_context():
+            try:
+                deleted = BlackListToken.purge_expired(batch_size)
+                logger.info('Purged %s expired blacklisted tokens', deleted)
+                deleted = RefreshToken.purge_expired(batch_size)
+                logger.info('Purged %s expired refresh tokens', deleted)
+            except Exception:
+                logger.exception('Purging the token blacklist failed')
+            finally:
+                db.session.remove()
+
+
+def start_blacklist_purge_task(app):
+    """
+    Start the background blacklist purge if BLACKLIST_PURGE_INTERVAL_SECONDS is configured.
+    :param app: Flask application
+    :return: The started thread or None
+    """
+    interval = app.config.get('BLACKLIST_PURGE_INTERVAL_SECONDS')
+    if not interval:
+        return None
+    thread = threading.Thread(target=purge_blacklist_forever, name='blacklist-purge',
+                              args=(app, interval, app.config['BLACKLIST_PURGE_BATCH_SIZE']))
+    thread.daemon = True
+    thread.start()
+    return thread
@@ -1,5 +1,7 @@
-from flask import request, make_response, jsonify
+from flask import request
+from app.encoding import json_response
 from app.models import User
+from app.auth.cache import token_cache, CurrentUser
 from functools import wraps
 
 
@@ -20,28 +22,36 @@ def token_required(f):
             try:
                 token = auth_header.split(" ")[1]
             except IndexError:
-                return make_response(jsonify({
+                return json_response({
                     'status': 'failed',
                     'message': 'Provide a valid auth token'
-                })), 403
+                }), 403
 
         if not token:
-            return make_response(jsonify({
+            return json_response({
                 'status': 'failed',
                 'message': 'Token is missing'
-            })), 401
+            }), 401
 
-        try:
-            decode_response = User.decode_auth_token(token)
-            current_user = User.query.filter_by(id=decode_response).first()
-        except:
-            message = 'Invalid token'
-            if isinstance(decode_response, str):
-                message = decode_response
-            return make_response(jsonify({
-                'status': 'failed',
-                'message': message
-            })), 401
+        current_user = token_cache.get(token)
+        # A cached token is still checked against the token version, so a revocation seen by this
+        # process through the version cache is honoured without waiting for the token cache
+        if current_user is not None and current_user.token_version != User.current_token_version(current_user.id):
+            token_cache.invalidate(token)
+            current_user = None
+        if current_user is None:
+            payload = User.decode_auth_payload(token)
+            user = None
+            if not isinstance(payload, str):
+                user = User.get_by_id(payload['sub'])
+            if user is None:
+                message = payload if isinstance(payload, str) else 'Invalid token'
+                return json_response({
+                    'status': 'failed',
+                    'message': message
+                }), 401
+            current_user = CurrentUser(user.id, user.email, payload.get('ver', 0))
+            token_cache.set(token, current_user, payload['exp'])
 
         return f(current_user, *args, **kwargs)
 
@@ -56,23 +66,35 @@ def response(status, message, status_code):
     :param status_code: Http status code
     :return:
     """
-    return make_response(jsonify({
+    return json_response({
         'status': status,
         'message': message
-    })), status_code
+    }), status_code
+
+
+def response_busy():
+    """
+    Http response for when the password hasher is saturated.
+    :return: Http Json response
+    """
+    return response('failed', 'The server is busy, please try again later', 503)
 
 
-def response_auth(status, message, token, status_code):
+def response_auth(status, message, token, status_code, refresh_token=None):
     """
     Make a Http response to send the auth token
     :param status: Status
     :param message: Message
     :param token: Authorization Token
     :param status_code: Http status code
+    :param refresh_token: Refresh Token
     :return: Http Json response
     """
-    return make_response(jsonify({
+    data = {
         'status': status,
         'message': message,
         'auth_token': token.decode("utf-8")
-    })), status_code
+    }
+    if refresh_token:
+        data['refresh_token'] = refresh_token
+    return json_response(data), status_code
@@ -1,10 +1,12 @@
-from app import bcrypt
 from flask import Blueprint, request
+from app.encoding import request_json
 from flask.views import MethodView
-from app.models import User, BlackListToken
-from app.auth.utils import response, response_auth
+from app.models import User, BlackListToken, RefreshToken
+from app.auth.utils import response, response_auth, response_busy
 from sqlalchemy import exc
 from app.auth.utils import token_required
+from app.auth.cache import token_cache
+from app.auth.hashing import password_hasher, HasherBusy
 import re
 
 auth = Blueprint('auth', __name__)
@@ -21,14 +23,19 @@ class RegisterUser(MethodView):
         :return: Json Response with the user`s token
         """
         if request.content_type == 'application/json':
-            post_data = request.get_json()
+            post_data = request_json()
             email = post_data.get('email')
             password = post_data.get('password')
             if re.match(r"[^@]+@[^@]+\.[^@]+", email) and len(password) > 4:
                 user = User.get_by_email(email)
                 if not user:
-                    token = User(email=email, password=password).save()
-                    return response_auth('success', 'Successfully registered', token, 201)
+                    try:
+                        user = User(email=email, password=password)
+                    except HasherBusy:
+                        return response_busy()
+                    user.save()
+                    token, refresh_token = user.create_session()
+                    return response_auth('success', 'Successfully registered', token, 201, refresh_token)
                 else:
                     return response('failed', 'Failed, User already exists, Please sign In', 400)
             return response('failed', 'Missing or wrong email format or password is less than four characters', 400)
@@ -42,13 +49,23 @@ class LoginUser(MethodView):
         :return: Http Json response
         """
         if request.content_type == 'application/json':
-            post_data = request.get_json()
+            post_data = request_json()
             email = post_data.get('email')
             password = post_data.get('password')
             if re.match(r"[^@]+@[^@]+\.[^@]+", email) and len(password) > 4:
                 user = User.query.filter_by(email=email).first()
-                if user and bcrypt.check_password_hash(user.password, password):
-                    return response_auth('success', 'Successfully logged In', user.encode_auth_token(user.id), 200)
+                try:
+                    password_matches = user and password_hasher.check_password_hash(user.password, password)
+                except HasherBusy:
+                    return response_busy()
+                if password_matches:
+                    if user.password_needs_rehash():
+                        try:
+                            user.rehash_password(password)
+                        except HasherBusy:
+                            pass
+                    token, refresh_token = user.create_session()
+                    return response_auth('success', 'Successfully logged In', token, 200, refresh_token)
                 return response('failed', 'User does not exist or password is incorrect', 401)
             return response('failed', 'Missing or wrong email format or password is less than four characters', 401)
         return response('failed', 'Content-type must be json', 202)
@@ -71,42 +88,99 @@ class LogOutUser(MethodView):
             except IndexError:
                 return response('failed', 'Provide a valid auth token', 403)
             else:
-                decoded_token_response = User.decode_auth_token(auth_token)
+                decoded_token_response = User.decode_auth_payload(auth_token)
                 if not isinstance(decoded_token_response, str):
-                    token = BlackListToken(auth_token)
-                    token.blacklist()
+                    session_id = decoded_token_response.get('sid')
+                    if decoded_token_response.get('typ') == 'access' and session_id is not None:
+                        # The access token runs out on its own, ending the session stops it being renewed.
+                        # Logging out of a session that already ended is refused like a blacklisted token.
+                        if not RefreshToken.revoke(session_id):
+                            return response('failed', 'Token was Blacklisted, Please login In', 401)
+                    else:
+                        # Tokens without a session are blacklisted, they are checked against the blacklist on use
+                        if BlackListToken.check_blacklist(auth_token):
+                            return response('failed', 'Token was Blacklisted, Please login In', 401)
+                        token = BlackListToken(auth_token)
+                        token.blacklist()
+                    token_cache.invalidate(auth_token)
                     return response('success', 'Successfully logged out', 200)
                 return response('failed', decoded_token_response, 401)
         return response('failed', 'Provide an authorization header', 403)
 
 
+class RefreshAccessToken(MethodView):
+    """
+    Class to renew the access token of a session
+    """
+
+    def post(self):
+        """
+        Exchange a valid refresh token for a new access token and a new refresh token.
+        The refresh token sent is revoked.
+        :return: Http Json response
+        """
+        if request.content_type == 'application/json':
+            post_data = request_json()
+            refresh_token = post_data.get('refresh_token')
+            if not refresh_token:
+                return response('failed', 'Provide a refresh token', 400)
+            session = RefreshToken.get_active(refresh_token)
+            if not session:
+                return response('failed', 'Invalid or expired refresh token, Please sign in again', 401)
+            session = session.rotate()
+            if not session:
+                return response('failed', 'Invalid or expired refresh token, Please sign in again', 401)
+            token = User.get_by_id(session.user_id).encode_auth_token(session.user_id, session.id)
+            return response_auth('success', 'Successfully refreshed', token, 200, session.token)
+        return response('failed', 'Content-type must be json', 400)
+
+
 @auth.route('/auth/reset/password', methods=['POST'])
 @token_required
 def reset_password(current_user):
     if request.content_type == "application/json":
-        data = request.get_json()
+        data = request_json()
         old_password = data.get('oldPassword')
         new_password = data.get('newPassword')
         password_confirmation = data.get('passwordConfirmation')
         if not old_password or not new_password or not password_confirmation:
             return response('failed', "Missing required attributes", 400)
-        if bcrypt.check_password_hash(current_user.password, old_password.encode('utf-8')):
-            if not new_password == password_confirmation:
-                return response('failed', 'New Passwords do not match', 400)
-            if not len(new_password) > 4:
-                return response('failed', 'New password should be greater than four characters long', 400)
-            current_user.reset_password(new_password)
-            return response('success', 'Password reset successfully', 200)
+        user = User.get_by_id(current_user.id)
+        try:
+            password_matches = password_hasher.check_password_hash(user.password, old_password.encode('utf-8'))
+            if password_matches:
+                if not new_password == password_confirmation:
+                    return response('failed', 'New Passwords do not match', 400)
+                if not len(new_password) > 4:
+                    return response('failed', 'New password should be greater than four characters long', 400)
+                user.reset_password(new_password)
+                return response('success', 'Password reset successfully', 200)
+        except HasherBusy:
+            return response_busy()
         return response('failed', "Incorrect password", 401)
     return response('failed', 'Content type must be json', 400)
 
 
+@auth.route('/auth/logout/all', methods=['POST'])
+@token_required
+def logout_all_sessions(current_user):
+    """
+    Revoke every token and session of the user.
+    :param current_user: User
+    :return: Http Json response
+    """
+    User.get_by_id(current_user.id).logout_everywhere()
+    return response('success', 'Successfully logged out of all sessions', 200)
+
+
 # Register classes as views
 registration_view = RegisterUser.as_view('register')
 login_view = LoginUser.as_view('login')
 logout_view = LogOutUser.as_view('logout')
+refresh_view = RefreshAccessToken.as_view('refresh')
 
 # Add rules for the api Endpoints
 auth.add_url_rule('/auth/register', view_func=registration_view, methods=['POST'])
 auth.add_url_rule('/auth/login', view_func=login_view, methods=['POST'])
 auth.add_url_rule('/auth/logout', view_func=logout_view, methods=['POST'])
+auth.add_url_rule('/auth/refresh', view_func=refresh_view, methods=['POST'])
@@ -0,0 +1,483 @@
+from app import app
+from collections import OrderedDict
+from flask import make_response, request
+from functools import wraps
+import os
+import sqlite3
+import stat
+import threading
+import time
+
+
+class MemoryBackend:
+    """
+    Per process LRU store of cache entries. Evictions made by one worker process do not
+    reach the others, their entries go stale for at most the cache TTL.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._keys_by_tag = {}
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return the stored entry or None if it is missing or expired.
+        :param key: Cache key
+        :return: (body, etag) or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            body, etag, expires_at, _ = entry
+            if expires_at <= time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return body, etag
+
+    def versions(self, tags):
+        """
+        Current versions of the tags, each eviction of a tag moves its version on.
+        :param tags: Tags
+        :return: Tuple of versions
+        """
+        with self._lock:
+            return tuple(self._versions.get(tag, 0) for tag in tags)
+
+    def set(self, key, body, etag, tags, ttl, versions):
+        """
+        Store an entry under the key, filed under each of the tags, unless one of the tags was
+        evicted since its versions were read.
+        :param key: Cache key
+        :param body: Response body
+        :param etag: ETag or None
+        :param tags: Tags the entry is evicted by
+        :param ttl: Seconds the entry stays valid
+        :param versions: Versions of the tags read before the response was built
+        :return: True when the entry was stored
+        """
+        with self._lock:
+            if tuple(self._versions.get(tag, 0) for tag in tags) != versions:
+                return False
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (body, etag, time.time() + ttl, tags)
+            for tag in tags:
+                self._keys_by_tag.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+            return True
+
+    def evict(self, tags):
+        """
+        Drop every entry filed under any of the tags and move their versions on.
+        :param tags: Tags
+        :return: Number of entries dropped
+        """
+        with self._lock:
+            keys = set()
+            for tag in tags:
+                keys.update(self._keys_by_tag.get(tag, ()))
+                self._versions[tag] = self._versions.get(tag, 0) + 1
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def clear(self):
+        """
+        Drop every entry.
+        :return:
+        """
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_tag.clear()
+            self._versions.clear()
+
+    def stats(self):
+        """
+        Number of entries and bytes held.
+        :return: dict
+        """
+        with self._lock:
+            return {
+                'backend': 'memory',
+                'entries': len(self._entries),
+                'maxSize': self.max_size,
+                'bytes': sum(len(entry[0]) for entry in self._entries.values())
+            }
+
+    def _remove(self, key):
+        _, _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._keys_by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_tag[tag]
+
+
+class SQLiteBackend:
+    """
+    Cache entries kept in a SQLite database, meant to live on a memory backed file system
+    such as /dev/shm. Every worker process on the host opens the same file, so an eviction
+    made by one worker is seen by all of them. Workers on other hosts do not see it, their
+    entries go stale for at most the cache TTL.
+    The database sits in a directory only the server user can enter and holds plain bodies and
+    ETags, nothing read back from it is ever executed. A failing database, such as one locked
+    for longer than the timeout, is treated as a miss and never fails the request.
+    """
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, body BLOB NOT NULL, etag TEXT, '
+        'expires_at REAL NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS ix_entries_expires_at ON entries (expires_at)',
+        'CREATE TABLE IF NOT EXISTS tags (tag TEXT NOT NULL, key TEXT NOT NULL, PRIMARY KEY (tag, key))',
+        'CREATE INDEX IF NOT EXISTS ix_tags_key ON tags (key)',
+        'CREATE TABLE IF NOT EXISTS versions (tag TEXT PRIMARY KEY, version INTEGER NOT NULL)',
+    )
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self._local = threading.local()
+        private_file(path)
+        with self._connection() as connection:
+            for statement in self.SCHEMA:
+                connection.execute(statement)
+
+    def _connection(self):
+        # sqlite3 connections must not be shared between threads, nor with worker processes forked later
+        if getattr(self._local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    def get(self, key):
+        """
+        Return the stored entry or None if it is missing, expired or cannot be read.
+        Hits only read, so concurrent hits never wait on each other.
+        :param key: Cache key
+        :return: (body, etag) or None
+        """
+        try:
+            row = self._connection().execute('SELECT body, etag FROM entries WHERE key = ? AND expires_at > ?',
+                                             (key, time.time())).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None:
+            return None
+        return bytes(row[0]), row[1]
+
+    def versions(self, tags):
+        """
+        Current versions of the tags, each eviction of a tag moves its version on.
+        :param tags: Tags
+        :return: Tuple of versions, None when they cannot be read
+        """
+        try:
+            return self._versions(self._connection(), tags)
+        except sqlite3.Error:
+            return None
+
+    def set(self, key, body, etag, tags, ttl, versions):
+        """
+        Store an entry under the key, filed under each of the tags, unless one of the tags was
+        evicted since its versions were read. Expired entries are dropped first, then the
+        entries closest to expiring while the cache is over its size.
+        :param key: Cache key
+        :param body: Response body
+        :param etag: ETag or None
+        :param tags: Tags the entry is evicted by
+        :param ttl: Seconds the entry stays valid
+        :param versions: Versions of the tags read before the response was built
+        :return: True when the entry was stored
+        """
+        if versions is None:
+            return False
+        now = time.time()
+        try:
+            with self._connection() as connection:
+                # Holds the write lock from the version check to the insert, evictions wait for it
+                connection.execute('BEGIN IMMEDIATE')
+                if self._versions(connection, tags) != versions:
+                    return False
+                connection.execute('INSERT OR REPLACE INTO entries (key, body, etag, expires_at) VALUES (?, ?, ?, ?)',
+                                   (key, sqlite3.Binary(body), etag, now + ttl))
+                connection.execute('DELETE FROM tags WHERE key = ?', (key,))
+                connection.executemany('INSERT INTO tags (tag, key) VALUES (?, ?)', [(tag, key) for tag in tags])
+                excess = connection.execute('SELECT count(*) FROM entries').fetchone()[0] - self.max_size
+                if excess > 0:
+                    keys = [row[0] for row in connection.execute(
+                        'SELECT key FROM entries ORDER BY expires_at LIMIT ?', (excess,))]
+                    self._remove(connection, keys)
+            return True
+        except sqlite3.Error:
+            return False
+
+    def evict(self, tags):
+        """
+        Drop every entry filed under any of the tags and move their versions on.
+        :param tags: Tags
+        :return: Number of entries dropped
+        """
+        tags = list(tags)
+        try:
+            with self._connection() as connection:
+                connection.executemany('INSERT OR IGNORE INTO versions (tag, version) VALUES (?, 0)',
+                                       [(tag,) for tag in tags])
+                connection.execute('UPDATE versions SET version = version + 1 WHERE tag IN ({})'.format(
+                    ', '.join('?' * len(tags))), tags)
+                keys = [row[0] for row in connection.execute(
+                    'SELECT DISTINCT key FROM tags WHERE tag IN ({})'.format(', '.join('?' * len(tags))), tags)]
+                self._remove(connection, keys)
+                return len(keys)
+        except sqlite3.Error:
+            return 0
+
+    def clear(self):
+        """
+        Drop every entry.
+        :return:
+        """
+        with self._connection() as connection:
+            connection.execute('DELETE FROM entries')
+            connection.execute('DELETE FROM tags')
+            connection.execute('DELETE FROM versions')
+
+    def stats(self):
+        """
+        Number of entries and bytes held, shared by all the worker processes.
+        :return: dict
+        """
+        with self._connection() as connection:
+            entries, size = connection.execute('SELECT count(*), coalesce(sum(length(body)), 0) FROM entries') \
+                .fetchone()
+        return {
+            'backend': 'sqlite',
+            'entries': entries,
+            'maxSize': self.max_size,
+            'bytes': size,
+            'fileBytes': os.path.getsize(self.path)
+        }
+
+    @staticmethod
+    def _versions(connection, tags):
+        versions = dict(connection.execute('SELECT tag, version FROM versions WHERE tag IN ({})'.format(
+            ', '.join('?' * len(tags))), list(tags)))
+        return tuple(versions.get(tag, 0) for tag in tags)
+
+    @staticmethod
+    def _remove(connection, keys):
+        connection.executemany('DELETE FROM entries WHERE key = ?', [(key,) for key in keys])
+        connection.executemany('DELETE FROM tags WHERE key = ?', [(key,) for key in keys])
+
+
+def private_file(path):
+    """
+    Make sure a file can only be read and written by the server user, in a directory no other
+    user can enter, creating both when they are missing. A directory or file another user owns
+    or can get into is refused, since it may have been planted.
+    :param path: File path
+    :return:
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    try:
+        os.mkdir(directory, 0o700)
+    except FileExistsError:
+        pass
+    check_private(directory, 0o700)
+    os.close(os.open(path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600))
+    check_private(path, 0o600)
+
+
+def check_private(path, mode):
+    """
+    Raise PermissionError unless the path is owned by this user and allows no more than mode.
+    :param path: Path
+    :param mode: Most permissive mode accepted
+    :return:
+    """
+    info = os.lstat(path)
+    if info.st_uid != os.getuid() or stat.S_IMODE(info.st_mode) & ~mode:
+        raise PermissionError('{} must be owned by this user with mode {:o} or less'.format(path, mode))
+
+
+class ResponseCache:
+    """
+    Cache of rendered list responses in front of a pluggable backend.
+    Entries are filed under tags naming the data they were built from and write paths evict
+    the tags they touch. Every eviction moves the versions of its tags on, a response is only
+    stored when the versions it was built under are still current, so a response read before
+    a write cannot be cached after the write evicted it.
+    Hit and miss counters are kept per process.
+    """
+
+    def __init__(self, backend, ttl):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return a cached (body, etag) pair or None.
+        :param key: Cache key
+        :return: tuple or None
+        """
+        if self.backend is None:
+            return None
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def versions(self, tags):
+        """
+        Versions of the tags, read before a response is built and handed back to set().
+        :param tags: Tags
+        :return: Versions or None
+        """
+        if self.backend is None:
+            return None
+        return self.backend.versions(list(tags))
+
+    def set(self, key, value, tags, versions):
+        """
+        Cache a (body, etag) pair, unless its tags were evicted since their versions were read.
+        :param key: Cache key
+        :param value: (body, etag)
+        :param tags: Tags the entry is evicted by
+        :param versions: Versions of the tags read before the response was built
+        :return:
+        """
+        if self.backend is not None:
+            body, etag = value
+            self.backend.set(key, body, etag, list(tags), self.ttl, versions)
+
+    def evict(self, *tags):
+        """
+        Drop the cached responses built from the tagged data.
+        :param tags: Tags
+        :return:
+        """
+        if self.backend is not None:
+            evicted = self.backend.evict(tags)
+            with self._lock:
+                self.evictions += evicted
+
+    def clear(self):
+        """
+        Drop every entry and reset the counters.
+        :return:
+        """
+        if self.backend is not None:
+            self.backend.clear()
+        with self._lock:
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """
+        Hit ratio of this process and memory held by the backend.
+        :return: dict
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hitRatio': self.hits / lookups if lookups else 0.0
+            }
+        if self.backend is None:
+            stats['backend'] = 'none'
+        else:
+            stats.update(self.backend.stats())
+        return stats
+
+
+def make_backend(config):
+    """
+    Build the backend named by RESPONSE_CACHE_BACKEND.
+    :param config: Application config
+    :return: Backend or None when caching is off
+    """
+    name = config['RESPONSE_CACHE_BACKEND']
+    if name == 'memory':
+        return MemoryBackend(config['RESPONSE_CACHE_SIZE'])
+    if name == 'sqlite':
+        return SQLiteBackend(config['RESPONSE_CACHE_PATH'], config['RESPONSE_CACHE_SIZE'])
+    if name == 'none':
+        return None
+    raise ValueError('Unknown response cache backend ' + name)
+
+
+response_cache = ResponseCache(make_backend(app.config), app.config['RESPONSE_CACHE_TTL'])
+
+
+def store_list_tag(user_id):
+    """
+    Tag of the cached store lists of a user.
+    :param user_id: User Id
+    :return: Tag
+    """
+    return 'stores:{}'.format(user_id)
+
+
+def item_list_tag(store_id):
+    """
+    Tag of the cached item lists of a store.
+    :param store_id: Store Id
+    :return: Tag
+    """
+    return 'items:{}'.format(int(store_id))
+
+
+def cached_response(tags):
+    """
+    Decorator serving a view's successful responses from the response cache. It goes under
+    token_required, entries are keyed by the user, the endpoint and the full request url, so
+    the page, cursor, search and count parameters each get their own entry.
+    The versions of the tags are read before the view runs, so a response built from data a
+    concurrent write has since changed and evicted is not stored. Evictions only reach the
+    workers of one host, see RESPONSE_CACHE_BACKEND.
+    :param tags: Function of the current user and the view arguments returning the entry tags
+    :return:
+    """
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(current_user, *args, **kwargs):
+            key = '{}:{}:{}'.format(current_user.id, request.endpoint, request.full_path)
+            cached = response_cache.get(key)
+            if cached is not None:
+                body, etag = cached
+                if etag is not None and request.if_none_match.contains_weak(etag):
+                    result = make_response('', 304)
+                else:
+                    result = make_response(body, 200, {'Content-Type': 'application/json'})
+                if etag is not None:
+                    result.set_etag(etag, weak=True)
+                return result
+            entry_tags = tags(current_user, *args, **kwargs)
+            versions = response_cache.versions(entry_tags)
+            result = make_response(f(current_user, *args, **kwargs))
+            if result.status_code == 200:
+                etag, _ = result.get_etag()
+                response_cache.set(key, (result.get_data(), etag), entry_tags, versions)
+            return result
+
+        return decorated_function
+
+    return decorator
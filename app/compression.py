@@ -0,0 +1,152 @@
+from flask import request
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Bodies worth compressing, images and archives are already compressed
+COMPRESSIBLE_MIMETYPES = frozenset((
+    'application/json', 'application/x-ndjson', 'application/javascript', 'application/xml',
+    'application/manifest+json', 'image/svg+xml', 'text/css', 'text/csv', 'text/html', 'text/javascript',
+    'text/plain', 'text/xml'
+))
+
+
+class GzipCoding:
+    """
+    gzip content coding built on zlib, always available.
+    """
+    name = 'gzip'
+    extension = '.gz'
+    level = 6
+
+    @staticmethod
+    def compress(data, level=None):
+        compressor = zlib.compressobj(level or GzipCoding.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush()
+
+    @staticmethod
+    def stream(chunks):
+        compressor = zlib.compressobj(GzipCoding.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+        yield compressor.flush()
+
+
+class BrotliCoding:
+    """
+    br content coding built on the optional brotli package.
+    """
+    name = 'br'
+    extension = '.br'
+    # Quality 5 compresses json better than gzip at a similar speed, 11 is kept for build time assets
+    level = 5
+
+    @staticmethod
+    def compress(data, level=None):
+        return brotli.compress(data, quality=level or BrotliCoding.level)
+
+    @staticmethod
+    def stream(chunks):
+        compressor = brotli.Compressor(quality=BrotliCoding.level)
+        for chunk in chunks:
+            compressed = compressor.process(chunk)
+            if compressed:
+                yield compressed
+        yield compressor.finish()
+
+
+class ZstdCoding:
+    """
+    zstd content coding built on the optional zstandard package.
+    """
+    name = 'zstd'
+    extension = '.zst'
+    level = 3
+
+    @staticmethod
+    def compress(data, level=None):
+        return zstandard.ZstdCompressor(level=level or ZstdCoding.level).compress(data)
+
+    @staticmethod
+    def stream(chunks):
+        compressor = zstandard.ZstdCompressor(level=ZstdCoding.level).compressobj()
+        for chunk in chunks:
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+        yield compressor.flush()
+
+
+# Codings the server offers, preferred first when the client rates several of them the same
+codings = [coding for coding, module in ((BrotliCoding, brotli), (ZstdCoding, zstandard)) if module is not None]
+codings.append(GzipCoding)
+
+
+def negotiate(offered=None):
+    """
+    Pick the content coding for the current request from its Accept-Encoding header.
+    :param offered: Codings to choose from, all the available ones when not set
+    :return: Coding class or None to send the body as it is
+    """
+    offered = codings if offered is None else offered
+    accepted = request.accept_encodings
+    name = accepted.best_match([coding.name for coding in offered])
+    if name is None or accepted[name] <= 0:
+        return None
+    return next(coding for coding in offered if coding.name == name)
+
+
+def compress_response(response, min_size):
+    """
+    Compress a response body with the coding the client prefers. Bodies smaller than min_size,
+    bodies that are not text and responses that already carry a Content-Encoding, such as
+    precompressed files, are left alone. Streamed bodies are compressed as they are produced.
+    :param response: Http Response
+    :param min_size: Smallest body worth compressing, in bytes
+    :return: Http Response
+    """
+    if response.status_code < 200 or response.status_code in (204, 206, 304) \
+            or 'Content-Encoding' in response.headers or response.direct_passthrough \
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES or request.method == 'HEAD':
+        return response
+    # The body depends on Accept-Encoding from here on, caches must keep the variants apart
+    response.vary.add('Accept-Encoding')
+    if not response.is_streamed and response.calculate_content_length() < min_size:
+        return response
+    coding = negotiate()
+    if coding is None:
+        return response
+    if response.is_streamed:
+        # The replaced iterable still has to be closed, it may hold a database cursor
+        if hasattr(response.response, 'close'):
+            response.call_on_close(response.response.close)
+        response.response = coding.stream(response.iter_encoded())
+        response.headers.pop('Content-Length', None)
+    else:
+        response.set_data(coding.compress(response.get_data()))
+    response.headers['Content-Encoding'] = coding.name
+    return response
+
+
+def init_compression(app):
+    """
+    Compress the responses of the application once they are built.
+    :param app: Flask application
+    :return:
+    """
+
+    @app.after_request
+    def compress(response):
+        if not app.config['COMPRESSION_ENABLED']:
+            return response
+        return compress_response(response, app.config['COMPRESSION_MIN_SIZE'])
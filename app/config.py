@@ -12,10 +12,56 @@ class BaseConfig:
     DEBUG = False
     SECRET_KEY = os.getenv('SECRET_KEY', 'adonis123')
     BCRYPT_HASH_PREFIX = 14
+    # Cost applied to new hashes, tune it per machine with manage.py calibrate-bcrypt
+    BCRYPT_LOG_ROUNDS = int(os.getenv('BCRYPT_LOG_ROUNDS', BCRYPT_HASH_PREFIX))
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    AUTH_TOKEN_EXPIRY_DAYS = 30
-    AUTH_TOKEN_EXPIRY_SECONDS = 3000
+    # Access tokens are not checked against any table, keep them short lived and rely on refresh tokens
+    AUTH_TOKEN_EXPIRY_DAYS = 0
+    AUTH_TOKEN_EXPIRY_SECONDS = 900
+    REFRESH_TOKEN_EXPIRY_DAYS = 30
     STORE_AND_ITEMS_PER_PAGE = 25
+    # Totals of unfiltered lists served to count=estimated requests
+    COUNT_CACHE_SIZE = 10000
+    COUNT_CACHE_TTL = 300
+    # Verified tokens are cached per process, a logout in another worker is honoured after at most the TTL
+    AUTH_TOKEN_CACHE_SIZE = 10000
+    AUTH_TOKEN_CACHE_TTL = 60
+    # The blacklist filter is per process too and picks up other workers' logouts when it is rebuilt
+    BLACKLIST_FILTER_CAPACITY = 100000
+    BLACKLIST_FILTER_ERROR_RATE = 0.001
+    BLACKLIST_FILTER_REBUILD_SECONDS = 60
+    # Expired blacklist rows are purged in the background when an interval is set, see manage.py purge_blacklist
+    BLACKLIST_PURGE_INTERVAL_SECONDS = int(os.getenv('BLACKLIST_PURGE_INTERVAL_SECONDS', 0))
+    BLACKLIST_PURGE_BATCH_SIZE = 1000
+    # bcrypt runs on a bounded pool, requests are answered with 503 once the queue is full
+    PASSWORD_HASHER_WORKERS = 4
+    PASSWORD_HASHER_QUEUE_SIZE = 16
+    PASSWORD_HASHER_TIMEOUT_SECONDS = 5
+    # Stats endpoints describe every user's traffic, they are answered with 404 unless enabled
+    STATS_ENDPOINTS_ENABLED = bool(int(os.getenv('STATS_ENDPOINTS_ENABLED', 0)))
+    # Rendered store and item lists: memory is per process and other workers see a write after at
+    # most the TTL, sqlite shares one cache file between the workers of a host, none turns it off.
+    # Evictions never reach other hosts, when more than one host serves the API a user can read
+    # their own stale list for up to the TTL, so keep it short or turn the cache off there.
+    # The sqlite file is kept in a directory private to the server user, created when missing.
+    RESPONSE_CACHE_BACKEND = os.getenv('RESPONSE_CACHE_BACKEND', 'memory')
+    RESPONSE_CACHE_PATH = os.getenv('RESPONSE_CACHE_PATH', '/dev/shm/store_api/response_cache.sqlite3')
+    RESPONSE_CACHE_SIZE = 5000
+    RESPONSE_CACHE_TTL = 30
+    # Most operations accepted by one POST /v1/storelists/bulk request
+    STORE_BULK_MAX_OPERATIONS = 500
+    # Item imports are read with bounded line reads and inserted and committed in chunks, only the
+    # first errors are reported
+    ITEM_IMPORT_CHUNK_SIZE = 1000
+    ITEM_IMPORT_MAX_ERRORS = 100
+    ITEM_IMPORT_MAX_LINE_BYTES = 65536
+    # Rows fetched per round trip from the server side cursor of an item export
+    ITEM_EXPORT_BATCH_SIZE = 1000
+    # Text responses are compressed with the best coding the client accepts, smaller bodies are sent as they are
+    COMPRESSION_ENABLED = True
+    COMPRESSION_MIN_SIZE = 1024
+    # Fingerprinted and precompressed docs assets written by manage.py build_docs_assets
+    DOCS_ASSETS_PATH = os.getenv('DOCS_ASSETS_PATH', os.path.join(base_dir, 'docs', 'build'))
 
 
 class DevelopmentConfig(BaseConfig):
@@ -25,9 +71,11 @@ class DevelopmentConfig(BaseConfig):
     DEBUG = True
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL', postgres_local_base + database_name)
     BCRYPT_HASH_PREFIX = 4
+    BCRYPT_LOG_ROUNDS = 4
     AUTH_TOKEN_EXPIRY_DAYS = 1
     AUTH_TOKEN_EXPIRY_SECONDS = 20
     STORE_AND_ITEMS_PER_PAGE = 4
+    STATS_ENDPOINTS_ENABLED = True
 
 
 class TestingConfig(BaseConfig):
@@ -38,10 +86,14 @@ class TestingConfig(BaseConfig):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL_TEST', postgres_local_base + database_name + "_test")
     BCRYPT_HASH_PREFIX = 4
+    BCRYPT_LOG_ROUNDS = 4
     AUTH_TOKEN_EXPIRY_DAYS = 0
     AUTH_TOKEN_EXPIRY_SECONDS = 3
     AUTH_TOKEN_EXPIRATION_TIME_DURING_TESTS = 5
+    REFRESH_TOKEN_EXPIRY_DAYS = 1
     STORE_AND_ITEMS_PER_PAGE = 3
+    ITEM_IMPORT_CHUNK_SIZE = 2
+    STATS_ENDPOINTS_ENABLED = True
 
 
 class ProductionConfig(BaseConfig):
@@ -51,6 +103,9 @@ class ProductionConfig(BaseConfig):
     DEBUG = True
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL', postgres_local_base + database_name)
     BCRYPT_HASH_PREFIX = 13
-    AUTH_TOKEN_EXPIRY_DAYS = 30
-    AUTH_TOKEN_EXPIRY_SECONDS = 20
+    BCRYPT_LOG_ROUNDS = int(os.getenv('BCRYPT_LOG_ROUNDS', BCRYPT_HASH_PREFIX))
+    AUTH_TOKEN_EXPIRY_DAYS = 0
+    AUTH_TOKEN_EXPIRY_SECONDS = 900
     STORE_AND_ITEMS_PER_PAGE = 10
+    RESPONSE_CACHE_BACKEND = os.getenv('RESPONSE_CACHE_BACKEND', 'sqlite')
+    RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', 300))
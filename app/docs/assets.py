@@ -0,0 +1,153 @@
+from app.compression import COMPRESSIBLE_MIMETYPES, GzipCoding, BrotliCoding, ZstdCoding, brotli, zstandard
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+
+# Static files are compressed once at build time, so the slowest and smallest settings are used
+BUILD_CODINGS = [(coding, level) for coding, level, module in (
+    (BrotliCoding, 11, brotli), (ZstdCoding, 19, zstandard), (GzipCoding, 9, True)) if module]
+
+# References to other static files by file extension, they are rewritten to the fingerprinted names
+REFERENCE_PATTERNS = {
+    '.css': re.compile(rb'(@import\s+|url\(\s*)([\'"]?)([^\'"()\s]+)(\2)'),
+    '.json': re.compile(rb'("src"\s*:\s*)(")([^"]+)(")'),
+    '.xml': re.compile(rb'(\bsrc=)(")([^"]+)(")'),
+}
+
+
+def fingerprinted_name(path, data):
+    """
+    Name of a file with the digest of its content before the extension, css/styles.css
+    becomes css/styles.0123456789ab.css.
+    :param path: Path relative to the static folder
+    :param data: File content
+    :return: Path
+    """
+    root, extension = os.path.splitext(path)
+    return '{}.{}{}'.format(root, hashlib.sha1(data).hexdigest()[:12], extension)
+
+
+def build_assets(source, target):
+    """
+    Copy the static files under fingerprinted names and write a precompressed variant next
+    to each text file for every available coding that makes it smaller. Files of earlier
+    builds are kept so pages cached by clients keep working.
+    :param source: Static folder
+    :param target: Build folder
+    :return: Manifest of the files built
+    """
+    paths = set()
+    for directory, _, names in os.walk(source):
+        for name in names:
+            paths.add(os.path.relpath(os.path.join(directory, name), source).replace(os.sep, '/'))
+    files = {}
+    for path in sorted(paths):
+        build_asset(source, target, path, paths, files)
+    manifest = {'files': files}
+    write_file(os.path.join(target, 'manifest.json'), json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    return manifest
+
+
+def build_asset(source, target, path, paths, files):
+    """
+    Build a static file after the files it references, so that its references point at their
+    fingerprinted names and its own fingerprint changes with theirs.
+    :param source: Static folder
+    :param target: Build folder
+    :param path: Path relative to the static folder
+    :param paths: Paths of every static file
+    :param files: Manifest entries built so far, the entry of the file is added to it
+    :return: Manifest entry or None while the file is being built
+    """
+    if path in files:
+        return files[path]
+    # A reference back to a file that is still being built is left as it is
+    files[path] = None
+    with open(os.path.join(source, path), 'rb') as static_file:
+        data = static_file.read()
+    pattern = REFERENCE_PATTERNS.get(os.path.splitext(path)[1])
+    if pattern is not None:
+        directory = posixpath.dirname(path)
+
+        def fingerprinted_reference(match):
+            reference = match.group(3).decode('utf-8')
+            referenced = posixpath.normpath(posixpath.join(directory, reference))
+            # Absolute urls and files missing from the static folder are not rewritten
+            if reference.startswith('/') or ':' in reference or referenced not in paths:
+                return match.group(0)
+            entry = build_asset(source, target, referenced, paths, files)
+            if entry is None:
+                return match.group(0)
+            built = posixpath.relpath(entry['path'], directory or '.').encode('utf-8')
+            return match.group(1) + match.group(2) + built + match.group(4)
+
+        data = pattern.sub(fingerprinted_reference, data)
+    built = fingerprinted_name(path, data)
+    mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    write_file(os.path.join(target, built), data)
+    encodings = []
+    if mimetype in COMPRESSIBLE_MIMETYPES:
+        for coding, level in BUILD_CODINGS:
+            compressed = coding.compress(data, level)
+            if len(compressed) < len(data):
+                write_file(os.path.join(target, built + coding.extension), compressed)
+                encodings.append(coding.name)
+    files[path] = {'path': built, 'mimetype': mimetype, 'encodings': encodings}
+    return files[path]
+
+
+def write_file(path, data):
+    """
+    Write a built file, creating its folders.
+    :param path: File path
+    :param data: bytes
+    :return:
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as built_file:
+        built_file.write(data)
+
+
+class AssetManifest:
+    """
+    Lookup of the fingerprinted docs assets listed in the manifest of the last build.
+    Without a build the manifest is empty and the docs use the plain static files.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.files = {}
+        self.built = {}
+        self.load()
+
+    def load(self):
+        """
+        Read the manifest written by build_assets.
+        :return:
+        """
+        try:
+            with open(os.path.join(self.folder, 'manifest.json')) as manifest_file:
+                self.files = json.load(manifest_file)['files']
+        except (OSError, ValueError, KeyError):
+            self.files = {}
+        self.built = {entry['path']: entry for entry in self.files.values()}
+
+    def url_path(self, filename):
+        """
+        Fingerprinted path of a static file.
+        :param filename: Path relative to the static folder
+        :return: Path or None when the file was not built
+        """
+        entry = self.files.get(filename)
+        return entry['path'] if entry else None
+
+    def entry(self, path):
+        """
+        Manifest entry of a fingerprinted path.
+        :param path: Fingerprinted path
+        :return: dict or None
+        """
+        return self.built.get(path)
@@ -1,7 +1,28 @@
-from flask import Blueprint, render_template as view
+from flask import Blueprint, abort, send_from_directory, url_for, render_template as view
+from app import app
+from app.compression import BrotliCoding, ZstdCoding, GzipCoding, negotiate
+from app.docs.assets import AssetManifest
 
 docs = Blueprint('docs', __name__, static_folder='static', template_folder='templates')
 
+assets = AssetManifest(app.config['DOCS_ASSETS_PATH'])
+
+# Fingerprinted files never change under the same name
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+@docs.app_template_global()
+def asset_url(filename):
+    """
+    Url of a docs static file, the fingerprinted one when the assets have been built.
+    :param filename: Path relative to the static folder
+    :return: Url
+    """
+    path = assets.url_path(filename)
+    if path is None:
+        return url_for('docs.static', filename=filename)
+    return url_for('docs.asset', filename=path)
+
 
 @docs.route('/')
 def index():
@@ -10,3 +31,26 @@ def index():
     :return:
     """
     return view('docs/home.html')
+
+
+@docs.route('/assets/<path:filename>')
+def asset(filename):
+    """
+    Serve a fingerprinted docs asset, precompressed with the best coding the client accepts.
+    :param filename: Fingerprinted path
+    :return: Http Response
+    """
+    entry = assets.entry(filename)
+    if entry is None:
+        abort(404)
+    # The variants were written at build time, so they are offered even without the compression packages
+    coding = negotiate([coding for coding in (BrotliCoding, ZstdCoding, GzipCoding)
+                        if coding.name in entry['encodings']])
+    response = send_from_directory(assets.folder, filename + (coding.extension if coding else ''),
+                                   mimetype=entry['mimetype'], conditional=True)
+    if coding is not None:
+        response.headers['Content-Encoding'] = coding.name
+    if entry['encodings']:
+        response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
@@ -0,0 +1,115 @@
+from flask import Response, abort, request
+import datetime
+import json
+import operator
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def default(value):
+    """
+    Encode the values the standard library json module does not know about.
+    Datetimes are written like datetime.isoformat(), which is also what orjson writes.
+    :param value: Value
+    :return: Json compatible value
+    """
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError('{!r} is not JSON serializable'.format(value))
+
+
+class StdlibEncoder:
+    """
+    Encoder built on the standard library json module.
+    """
+    name = 'json'
+
+    @staticmethod
+    def dumps(data):
+        return json.dumps(data, separators=(',', ':'), default=default).encode('utf-8')
+
+    @staticmethod
+    def loads(body):
+        if isinstance(body, bytes):
+            body = body.decode('utf-8')
+        return json.loads(body)
+
+
+class OrjsonEncoder:
+    """
+    Encoder built on orjson, which writes datetimes itself and returns bytes directly.
+    """
+    name = 'orjson'
+
+    @staticmethod
+    def dumps(data):
+        return orjson.dumps(data, default=default)
+
+    @staticmethod
+    def loads(body):
+        return orjson.loads(body)
+
+
+encoder = OrjsonEncoder if orjson is not None else StdlibEncoder
+
+
+def dumps(data):
+    """
+    Encode data as json with the active encoder.
+    :param data: Json compatible data, datetimes included
+    :return: bytes
+    """
+    return encoder.dumps(data)
+
+
+def loads(body):
+    """
+    Decode a json document with the active encoder.
+    :param body: bytes or str
+    :return: Decoded data
+    """
+    return encoder.loads(body)
+
+
+def json_response(data, status=200):
+    """
+    Make a json Http response, the replacement for flask.jsonify.
+    :param data: Json compatible data
+    :param status: Http status code
+    :return: Http Response
+    """
+    return Response(dumps(data), status=status, mimetype='application/json')
+
+
+def request_json():
+    """
+    Decode the json body of the current request, answering 400 when it is not valid json.
+    :return: Decoded body
+    """
+    try:
+        return loads(request.get_data(cache=True))
+    except ValueError:
+        abort(400)
+
+
+def row_serializer(fields):
+    """
+    Compile a serializer turning a model instance or a row into a dict. The attributes are
+    read by a single attrgetter, datetimes are left for the encoder to write.
+    :param fields: (key, attribute) pairs
+    :return: Function of a model instance or row returning a dict
+    """
+    keys = tuple(key for key, _ in fields)
+    getter = operator.attrgetter(*[attribute for _, attribute in fields])
+    if len(keys) == 1:
+        # attrgetter of a single attribute returns the value rather than a tuple
+        key, = keys
+        return lambda row: {key: getter(row)}
+
+    def serialize(row):
+        return dict(zip(keys, getter(row)))
+
+    return serialize
@@ -0,0 +1,36 @@
+from flask import make_response, request
+import hashlib
+
+
+def page_etag(rows, total=None):
+    """
+    Weak ETag of a store or item representation, worked out from the Id and modification time
+    of every row, the version of the items of every store row, the total and the request url
+    instead of the serialized body. Store and item writes set modified_at and item writes log a
+    new items version, so any change to what the page shows changes the tag.
+    :param rows: Stores or items shown
+    :param total: List total, None for single resources
+    :return: ETag value
+    """
+    digest = hashlib.sha1(request.full_path.encode('utf-8'))
+    digest.update(repr(total).encode('utf-8'))
+    for row in rows:
+        digest.update('{}:{}:{};'.format(row.id, row.modified_at.isoformat(),
+                                         getattr(row, 'item_version', None)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def conditional_response(etag, build):
+    """
+    Answer with 304 Not Modified and no body when the client already holds the representation,
+    otherwise build the response. Both carry the ETag.
+    :param etag: ETag value
+    :param build: Function returning the full response
+    :return: Http Response
+    """
+    if request.if_none_match.contains_weak(etag):
+        response = make_response('', 304)
+    else:
+        response = make_response(build())
+    response.set_etag(etag, weak=True)
+    return response
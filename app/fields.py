@@ -0,0 +1,76 @@
+from app.encoding import row_serializer
+from collections import OrderedDict
+import threading
+
+
+class InvalidFields(Exception):
+    """
+    Raised when the fields query parameter is empty or names a field the resource does not have.
+    """
+    pass
+
+
+class Fieldset:
+    """
+    Json fields of a resource and the model attributes they are read from.
+    A sparse fieldset selects the columns of the requested fields only, plus the required
+    columns the API reads itself to build ETags and cursors, and serializes the requested
+    fields only.
+    """
+
+    def __init__(self, fields, required):
+        self.fields = OrderedDict(fields)
+        self.required = tuple(required)
+        self.all = tuple(self.fields)
+        self._serializers = {}
+        self._lock = threading.Lock()
+
+    def parse(self, value):
+        """
+        Read a fields query parameter.
+        :param value: Comma separated json field names, None when the parameter was not sent
+        :return: Tuple of field names in the order of the full representation, None for every field
+        """
+        if value is None:
+            return None
+        names = set(name.strip() for name in value.split(','))
+        names.discard('')
+        if not names or not names.issubset(self.fields):
+            raise InvalidFields()
+        return tuple(name for name in self.all if name in names)
+
+    def columns(self, model, names):
+        """
+        Model columns to select for the fields, the required columns first.
+        :param model: Model class
+        :param names: Field names, None for every field
+        :return: List of columns
+        """
+        attributes = list(self.required)
+        for name in names or self.all:
+            if self.fields[name] not in attributes:
+                attributes.append(self.fields[name])
+        return [getattr(model, attribute) for attribute in attributes]
+
+    def serializer(self, names):
+        """
+        Serializer of the fields, compiled once per distinct set of fields.
+        :param names: Field names, None for every field
+        :return: Function of a model instance or row returning a dict
+        """
+        names = names or self.all
+        serialize = self._serializers.get(names)
+        if serialize is None:
+            with self._lock:
+                serialize = self._serializers.setdefault(
+                    names, row_serializer([(name, self.fields[name]) for name in names]))
+        return serialize
+
+
+def fields_param(names):
+    """
+    Value of the fields query parameter carried over to page urls.
+    :param names: Field names or None
+    :return: Comma separated names or None to leave the parameter out
+    """
+    return ','.join(names) if names else None
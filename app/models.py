@@ -1,6 +1,25 @@
-from app import app, db, bcrypt
+from app import app, db
+from app.auth.bloom import blacklist_filter
+from app.auth.hashing import password_hasher, hash_log_rounds
+from app.auth.cache import token_cache, version_cache
+from app.pagination import count_cache
+from app.search import install_item_search_ddl
+from app.fields import Fieldset
 import datetime
+import hashlib
 import jwt
+import secrets
+
+
+def digest(token):
+    """
+    Fixed length key under which a token is stored.
+    :param token: Token string or bytes
+    :return: Hex digest
+    """
+    if isinstance(token, bytes):
+        token = token.decode('utf-8')
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
 
 
 class User(db.Model):
@@ -13,13 +32,15 @@ class User(db.Model):
     email = db.Column(db.String(255), unique=True, nullable=False)
     password = db.Column(db.String(255), nullable=False)
     registered_on = db.Column(db.DateTime, nullable=False)
+    token_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     stores = db.relationship('Store', backref='store', lazy='dynamic')
 
     def __init__(self, email, password):
         self.email = email
-        self.password = bcrypt.generate_password_hash(password, app.config.get('BCRYPT_LOG_ROUNDS')) \
+        self.password = password_hasher.generate_password_hash(password, app.config['BCRYPT_LOG_ROUNDS']) \
             .decode('utf-8')
         self.registered_on = datetime.datetime.now()
+        self.token_version = 0
 
     def save(self):
         """
@@ -29,12 +50,22 @@ class User(db.Model):
         """
         db.session.add(self)
         db.session.commit()
-        return self.encode_auth_token(self.id)
 
-    def encode_auth_token(self, user_id):
+    def create_session(self):
+        """
+        Start a session for the user with a refresh token and a short lived access token.
+        :return: Access token and refresh token
+        """
+        refresh_token = RefreshToken(self.id)
+        refresh_token.save()
+        return self.encode_auth_token(self.id, refresh_token.id), refresh_token.token
+
+    def encode_auth_token(self, user_id, session_id=None):
         """
-        Encode the Auth token
+        Encode the Auth token.
+        Access tokens are verified by their signature only, so they are kept short lived.
         :param user_id: User's Id
+        :param session_id: Id of the refresh token the access token was issued for
         :return:
         """
         try:
@@ -43,7 +74,10 @@ class User(db.Model):
                                                                        seconds=app.config.get(
                                                                            'AUTH_TOKEN_EXPIRY_SECONDS')),
                 'iat': datetime.datetime.utcnow(),
-                'sub': user_id
+                'sub': user_id,
+                'typ': 'access',
+                'sid': session_id,
+                'ver': self.token_version
             }
             return jwt.encode(
                 payload,
@@ -60,17 +94,76 @@ class User(db.Model):
         :param token: Auth Token
         :return:
         """
+        payload = User.decode_auth_payload(token)
+        if isinstance(payload, str):
+            return payload
+        return payload['sub']
+
+    @staticmethod
+    def decode_auth_payload(token):
+        """
+        Verify the token and return its whole payload.
+        Access tokens of a session are only compared with the cached token version of their user,
+        other tokens are also checked against the blacklist, where logging them out puts them.
+        :param token: Auth Token
+        :return: Payload dict or an error message
+        """
         try:
             payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms='HS256')
+            if payload.get('ver', 0) != User.current_token_version(payload['sub']):
+                return 'Token was revoked, Please login In'
+            if payload.get('typ') == 'access' and payload.get('sid') is not None:
+                return payload
             is_token_blacklisted = BlackListToken.check_blacklist(token)
             if is_token_blacklisted:
                 return 'Token was Blacklisted, Please login In'
-            return payload['sub']
+            return payload
         except jwt.ExpiredSignatureError:
             return 'Signature expired, Please sign in again'
         except jwt.InvalidTokenError:
             return 'Invalid token. Please sign in again'
 
+    @staticmethod
+    def current_token_version(user_id):
+        """
+        Token version of a user, served from the version cache when possible.
+        :param user_id: User Id
+        :return: int or None when the user does not exist
+        """
+        version = version_cache.get(user_id)
+        if version is None:
+            version = db.session.query(User.token_version).filter_by(id=user_id).scalar()
+            if version is not None:
+                version_cache.set(user_id, version)
+        return version
+
+    def revoke_all_tokens(self):
+        """
+        Invalidate every token issued to the user so far and end all their sessions.
+        The caller commits.
+        :return:
+        """
+        self.token_version = User.token_version + 1
+        RefreshToken.query.filter_by(user_id=self.id, revoked_on=None) \
+            .update({'revoked_on': datetime.datetime.utcnow()}, synchronize_session=False)
+
+    def logout_everywhere(self):
+        """
+        Revoke all of the user's tokens and sessions.
+        :return:
+        """
+        self.revoke_all_tokens()
+        db.session.commit()
+        self.forget_tokens()
+
+    def forget_tokens(self):
+        """
+        Drop the user's tokens and token version from this process' caches.
+        :return:
+        """
+        version_cache.set(self.id, self.token_version)
+        token_cache.invalidate_user(self.id)
+
     @staticmethod
     def get_by_id(user_id):
         """
@@ -91,27 +184,50 @@ class User(db.Model):
 
     def reset_password(self, new_password):
         """
-        Update/reset the user password.
+        Update/reset the user password. Tokens issued before the reset stop working.
         :param new_password: New User Password
         :return:
         """
-        self.password = bcrypt.generate_password_hash(new_password, app.config.get('BCRYPT_LOG_ROUNDS')) \
+        self.password = password_hasher.generate_password_hash(new_password, app.config['BCRYPT_LOG_ROUNDS']) \
+            .decode('utf-8')
+        self.revoke_all_tokens()
+        db.session.commit()
+        self.forget_tokens()
+
+    def password_needs_rehash(self):
+        """
+        Check whether the stored hash was made with a different cost than the configured one.
+        :return: bool
+        """
+        return hash_log_rounds(self.password) != app.config['BCRYPT_LOG_ROUNDS']
+
+    def rehash_password(self, password):
+        """
+        Store a new hash of the already verified password at the configured cost.
+        :param password: Plain text password
+        :return:
+        """
+        self.password = password_hasher.generate_password_hash(password, app.config['BCRYPT_LOG_ROUNDS']) \
             .decode('utf-8')
         db.session.commit()
 
 
 class BlackListToken(db.Model):
     """
-    Table to store blacklisted/invalid auth tokens
+    Table to store blacklisted/invalid auth tokens.
+    Tokens are kept as a fixed length digest together with their expiry so that rows can be
+    purged once the token would be rejected anyway.
     """
     __tablename__ = 'blacklist_token'
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    token = db.Column(db.String(255), unique=True, nullable=False)
+    token_hash = db.Column(db.String(64), unique=True, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
     blacklisted_on = db.Column(db.DateTime, nullable=False)
 
     def __init__(self, token):
-        self.token = token
+        self.token_hash = digest(token)
+        self.expires_at = BlackListToken.token_expiry(token)
         self.blacklisted_on = datetime.datetime.now()
 
     def blacklist(self):
@@ -121,36 +237,282 @@ class BlackListToken(db.Model):
         """
         db.session.add(self)
         db.session.commit()
+        blacklist_filter.add(self.token_hash)
+
+    @staticmethod
+    def token_expiry(token):
+        """
+        Read the expiry of a token whose signature has already been verified.
+        :param token: Authorization token
+        :return: Naive UTC datetime
+        """
+        payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms='HS256', options={'verify_exp': False})
+        return datetime.datetime.utcfromtimestamp(payload['exp'])
 
     @staticmethod
     def check_blacklist(token):
         """
         Check to find out whether a token has already been blacklisted.
+        The database is only queried when the blacklist filter reports a possible hit.
         :param token: Authorization token
         :return:
         """
-        response = BlackListToken.query.filter_by(token=token).first()
+        token_hash = digest(token)
+        if not blacklist_filter.might_contain(token_hash):
+            return False
+        response = BlackListToken.query.filter_by(token_hash=token_hash).first()
+        blacklist_filter.record(response is not None)
         if response:
             return True
         return False
 
+    @staticmethod
+    def all_token_hashes():
+        """
+        Stream every blacklisted token digest, used to build the blacklist filter.
+        :return:
+        """
+        for row in db.session.query(BlackListToken.token_hash).yield_per(1000):
+            yield row.token_hash
+
+    @staticmethod
+    def purge_expired(batch_size):
+        """
+        Delete the blacklisted tokens that have expired, one batch per transaction.
+        :param batch_size: Number of rows deleted per batch
+        :return: Number of deleted rows
+        """
+        deleted = 0
+        now = datetime.datetime.utcnow()
+        while True:
+            ids = [row.id for row in db.session.query(BlackListToken.id)
+                   .filter(BlackListToken.expires_at < now)
+                   .limit(batch_size)]
+            if not ids:
+                return deleted
+            BlackListToken.query.filter(BlackListToken.id.in_(ids)).delete(synchronize_session=False)
+            db.session.commit()
+            deleted += len(ids)
+
+
+class RefreshToken(db.Model):
+    """
+    Revocable refresh tokens, one per login session.
+    Only a digest of the token is stored.
+    """
+    __tablename__ = 'refresh_tokens'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    token_hash = db.Column(db.String(64), unique=True, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    created_on = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    revoked_on = db.Column(db.DateTime, nullable=True)
+
+    def __init__(self, user_id):
+        self.token = secrets.token_urlsafe(32)
+        self.token_hash = digest(self.token)
+        self.user_id = user_id
+        self.created_on = datetime.datetime.utcnow()
+        self.expires_at = self.created_on + datetime.timedelta(days=app.config['REFRESH_TOKEN_EXPIRY_DAYS'])
+
+    def save(self):
+        """
+        Persist the refresh token in the database
+        :return:
+        """
+        db.session.add(self)
+        db.session.commit()
+
+    def rotate(self):
+        """
+        Revoke this refresh token and issue its replacement in the same transaction.
+        The revocation only applies while the token is still active, so of two concurrent
+        refreshes with the same token only one gets a replacement.
+        :return: New RefreshToken or None when the token was revoked in the meantime
+        """
+        revoked = RefreshToken.query.filter_by(id=self.id, revoked_on=None) \
+            .update({'revoked_on': datetime.datetime.utcnow()}, synchronize_session=False)
+        if revoked != 1:
+            db.session.rollback()
+            return None
+        replacement = RefreshToken(self.user_id)
+        db.session.add(replacement)
+        db.session.commit()
+        return replacement
+
+    @staticmethod
+    def get_active(token):
+        """
+        Find a refresh token that is neither revoked nor expired.
+        :param token: Refresh token
+        :return: RefreshToken or None
+        """
+        return RefreshToken.query.filter(RefreshToken.token_hash == digest(token),
+                                         RefreshToken.revoked_on.is_(None),
+                                         RefreshToken.expires_at > datetime.datetime.utcnow()).first()
+
+    @staticmethod
+    def revoke(session_id):
+        """
+        Revoke the refresh token of a session.
+        :param session_id: Refresh token Id
+        :return: False when the session had already ended
+        """
+        revoked = RefreshToken.query.filter_by(id=session_id, revoked_on=None) \
+            .update({'revoked_on': datetime.datetime.utcnow()}, synchronize_session=False)
+        db.session.commit()
+        return revoked > 0
+
+    @staticmethod
+    def purge_expired(batch_size):
+        """
+        Delete expired refresh tokens, one batch per transaction.
+        :param batch_size: Number of rows deleted per batch
+        :return: Number of deleted rows
+        """
+        deleted = 0
+        now = datetime.datetime.utcnow()
+        while True:
+            ids = [row.id for row in db.session.query(RefreshToken.id)
+                   .filter(RefreshToken.expires_at < now)
+                   .limit(batch_size)]
+            if not ids:
+                return deleted
+            RefreshToken.query.filter(RefreshToken.id.in_(ids)).delete(synchronize_session=False)
+            db.session.commit()
+            deleted += len(ids)
+
+
+class StoreItemChange(db.Model):
+    """
+    Append only log of item writes, one row per write with the number of items it added to the
+    store: 1 for an insert, -1 for a delete and 0 for an edit. Item writes insert a row here instead
+    of updating their store, so concurrent writers to one store never wait on the store row. The
+    rows are added to the stored count on read and folded into the store by Store.fold_item_changes.
+    """
+    __tablename__ = 'store_item_changes'
+    __table_args__ = (
+        db.Index('ix_store_item_changes_store_id_id', 'store_id', 'id'),
+        # Ids are never reused once folded rows are deleted, they version the items of a store
+        {'sqlite_autoincrement': True}
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    store_id = db.Column(db.Integer, nullable=False)
+    delta = db.Column(db.Integer, nullable=False)
+
+    @staticmethod
+    def record(store_id, delta):
+        """
+        Log an item write within the current transaction.
+        :param store_id: Store Id
+        :param delta: Number of items added, negative when items were removed
+        :return:
+        """
+        db.session.execute(StoreItemChange.__table__.insert().values(store_id=store_id, delta=delta))
+
+
+def pending_item_delta(store_id):
+    """
+    Items added to a store by the writes that are not folded into its item count yet.
+    :param store_id: Store Id column
+    :return: Scalar subquery
+    """
+    return db.select([db.func.coalesce(db.func.sum(StoreItemChange.delta), 0)]) \
+        .where(StoreItemChange.store_id == store_id).correlate_except(StoreItemChange.__table__).as_scalar()
+
+
+def latest_item_change(store_id):
+    """
+    Id of the newest write to the items of a store that is not folded yet.
+    :param store_id: Store Id column
+    :return: Scalar subquery, NULL when every write is folded
+    """
+    return db.select([db.func.max(StoreItemChange.id)]) \
+        .where(StoreItemChange.store_id == store_id).correlate_except(StoreItemChange.__table__).as_scalar()
+
+
+# Owner scoped writes that return the written row, each one statement on PostgreSQL. The data
+# modifying CTEs log the write for the store item count in the same statement.
+STORE_DELETE_RETURNING = db.text("""WITH deleted AS (
+    DELETE FROM stores WHERE id = :store_id AND user_id = :user_id RETURNING id
+), detached AS (
+    UPDATE storeitems SET store_id = NULL WHERE store_id IN (SELECT id FROM deleted)
+)
+SELECT id FROM deleted""")
+
+ITEM_INSERT_RETURNING = db.text("""WITH inserted AS (
+    INSERT INTO storeitems (name, description, store_id, create_at, modified_at)
+    SELECT :name, :description, stores.id, :now, :now FROM stores
+    WHERE stores.id = :store_id AND stores.user_id = :user_id
+    RETURNING id, name, description, store_id, create_at, modified_at
+), logged AS (
+    INSERT INTO store_item_changes (store_id, delta) SELECT store_id, 1 FROM inserted
+)
+SELECT * FROM inserted""")
+
+ITEM_UPDATE_RETURNING = db.text("""WITH updated AS (
+    UPDATE storeitems SET name = :name, description = coalesce(:description, storeitems.description),
+        modified_at = :now
+    FROM stores
+    WHERE storeitems.id = :item_id AND storeitems.store_id = :store_id
+        AND stores.id = storeitems.store_id AND stores.user_id = :user_id
+    RETURNING storeitems.id, storeitems.name, storeitems.description, storeitems.store_id,
+        storeitems.create_at, storeitems.modified_at
+), logged AS (
+    INSERT INTO store_item_changes (store_id, delta) SELECT store_id, 0 FROM updated
+)
+SELECT * FROM updated""")
+
+ITEM_DELETE_RETURNING = db.text("""WITH deleted AS (
+    DELETE FROM storeitems USING stores
+    WHERE storeitems.id = :item_id AND storeitems.store_id = :store_id
+        AND stores.id = storeitems.store_id AND stores.user_id = :user_id
+    RETURNING storeitems.store_id
+), logged AS (
+    INSERT INTO store_item_changes (store_id, delta) SELECT store_id, -1 FROM deleted
+)
+SELECT store_id FROM deleted""")
+
+
+def returning_writes():
+    """
+    Whether writes can go through the single statement RETURNING path.
+    :return: bool
+    """
+    return db.engine.dialect.name == 'postgresql'
+
 
 class Store(db.Model):
     """
     Class to represent the StoreList model
     """
     __tablename__ = 'stores'
+    __table_args__ = (
+        db.Index('ix_stores_user_id_name', 'user_id', 'name'),
+        db.Index('ix_stores_user_id_id', 'user_id', 'id'),
+        db.Index('ix_stores_user_id_create_at_id', 'user_id', 'create_at', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String(255), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     create_at = db.Column(db.DateTime, nullable=False)
     modified_at = db.Column(db.DateTime, nullable=False)
+    item_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    items_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     items = db.relationship('StoreItem', backref='item', lazy='dynamic')
+    # The item count with the writes that are not folded yet, and a version of the items that
+    # changes with every item write. Both are read without locking or updating the store row.
+    item_total = db.column_property(item_count + pending_item_delta(id), deferred=True)
+    item_version = db.column_property(db.func.coalesce(latest_item_change(id), items_version), deferred=True)
 
     def __init__(self, name, user_id):
         self.name = name
         self.user_id = user_id
+        self.item_count = 0
+        self.items_version = 0
         self.create_at = datetime.datetime.utcnow()
         self.modified_at = datetime.datetime.utcnow()
 
@@ -159,8 +521,10 @@ class Store(db.Model):
         Persist a store in the database
         :return:
         """
+        user_id = self.user_id
         db.session.add(self)
         db.session.commit()
+        count_cache.invalidate(('stores', user_id))
 
     def update(self, name):
         """
@@ -169,6 +533,7 @@ class Store(db.Model):
         :return:
         """
         self.name = name
+        self.modified_at = datetime.datetime.utcnow()
         db.session.commit()
 
     def delete(self):
@@ -176,20 +541,242 @@ class Store(db.Model):
         Delete a Store from the database
         :return:
         """
+        user_id = self.user_id
         db.session.delete(self)
         db.session.commit()
+        count_cache.invalidate(('stores', user_id))
+
+    @staticmethod
+    def get_user_store(user_id, store_id):
+        """
+        Find a store by Id among the stores owned by the user.
+        :param user_id: User Id
+        :param store_id: Store Id
+        :return: Store or None
+        """
+        return Store.query.filter_by(id=store_id, user_id=user_id).first()
+
+    @staticmethod
+    def rows(fields=None):
+        """
+        Read only query of the store columns the API shows. Rows are keyed tuples instead of
+        Store instances, so nothing goes through the identity map or change tracking.
+        :param fields: Json fields to select the columns of, all of them when not set
+        :return: Query
+        """
+        return db.session.query(*Store.fieldset.columns(Store, fields))
+
+    @staticmethod
+    def get_user_store_row(user_id, store_id, fields=None):
+        """
+        Read only row of a store owned by the user.
+        :param user_id: User Id
+        :param store_id: Store Id
+        :param fields: Json fields to select the columns of, all of them when not set
+        :return: Row or None
+        """
+        return Store.rows(fields).filter(Store.id == store_id, Store.user_id == user_id).first()
+
+    @staticmethod
+    def returned_columns():
+        """
+        Columns returned by store writes, the table columns and the item total.
+        :return: List of columns
+        """
+        stores = Store.__table__
+        return list(stores.c) + [(stores.c.item_count + pending_item_delta(stores.c.id)).label('item_total')]
+
+    @staticmethod
+    def create(name, user_id):
+        """
+        Create a store with one INSERT ... RETURNING and hand back the inserted row.
+        :param name: Name
+        :param user_id: User Id
+        :return: Row or Store with the store columns
+        """
+        if not returning_writes():
+            user_store = Store(name, user_id)
+            user_store.save()
+            return user_store
+        now = datetime.datetime.utcnow()
+        row = db.session.execute(Store.__table__.insert().values(
+            name=name, user_id=user_id, item_count=0, items_version=0, create_at=now, modified_at=now
+        ).returning(*Store.returned_columns())).first()
+        db.session.commit()
+        count_cache.invalidate(('stores', user_id))
+        return row
+
+    @staticmethod
+    def rename(user_id, store_id, name):
+        """
+        Rename one of the user's stores with one UPDATE ... RETURNING.
+        :param user_id: User Id
+        :param store_id: Store Id
+        :param name: New name
+        :return: Row or Store with the store columns, None when the user has no such store
+        """
+        if not returning_writes():
+            user_store = Store.get_user_store(user_id, store_id)
+            if user_store:
+                user_store.update(name)
+            return user_store
+        stores = Store.__table__
+        row = db.session.execute(stores.update().where(stores.c.id == store_id).where(stores.c.user_id == user_id)
+                                 .values(name=name, modified_at=datetime.datetime.utcnow())
+                                 .returning(*Store.returned_columns())).first()
+        db.session.commit()
+        return row
+
+    @staticmethod
+    def delete_owned(user_id, store_id):
+        """
+        Delete one of the user's stores with one statement, detaching its items.
+        :param user_id: User Id
+        :param store_id: Store Id
+        :return: True when the store was deleted
+        """
+        if not returning_writes():
+            user_store = Store.get_user_store(user_id, store_id)
+            if user_store:
+                user_store.delete()
+            return user_store is not None
+        row = db.session.execute(STORE_DELETE_RETURNING, {'store_id': store_id, 'user_id': user_id}).first()
+        db.session.commit()
+        if row is not None:
+            count_cache.invalidate(('stores', user_id))
+            count_cache.invalidate(('items', row.id))
+        return row is not None
+
+    @staticmethod
+    def owned_ids(user_id, store_ids):
+        """
+        Keep the Ids of the stores that exist and belong to the user.
+        :param user_id: User Id
+        :param store_ids: Store Ids
+        :return: set of Store Ids
+        """
+        if not store_ids:
+            return set()
+        rows = db.session.query(Store.id).filter(Store.user_id == user_id, Store.id.in_(store_ids))
+        return {row.id for row in rows}
+
+    @staticmethod
+    def bulk_write(user_id, names, renames, store_ids):
+        """
+        Create, rename and delete many of the user's stores in one transaction, with one
+        statement per kind of change.
+        :param user_id: User Id
+        :param names: Names of the stores to create
+        :param renames: dict of owned Store Id to new name
+        :param store_ids: Ids of owned stores to delete
+        :return: Ids of the created stores, in the order of the names
+        """
+        now = datetime.datetime.utcnow()
+        created = []
+        if names:
+            rows = [{'name': name, 'user_id': user_id, 'item_count': 0, 'items_version': 0, 'create_at': now,
+                     'modified_at': now} for name in names]
+            if db.engine.dialect.implicit_returning:
+                # One multi-row INSERT. RETURNING rows are not guaranteed to come back in VALUES order,
+                # but the serial Ids are drawn in VALUES order, so sorting them matches them to the names
+                result = db.session.execute(Store.__table__.insert().values(rows).returning(Store.__table__.c.id))
+                created = sorted(row[0] for row in result)
+            else:
+                stores = [Store(name, user_id) for name in names]
+                db.session.add_all(stores)
+                db.session.flush()
+                created = [store.id for store in stores]
+        if renames:
+            Store.query.filter(Store.user_id == user_id, Store.id.in_(list(renames))).update({
+                Store.name: db.case(renames, value=Store.id),
+                Store.modified_at: now
+            }, synchronize_session=False)
+        if store_ids:
+            # Items are detached like they are when a single store is deleted
+            StoreItem.query.filter(StoreItem.store_id.in_(store_ids)) \
+                .update({StoreItem.store_id: None}, synchronize_session=False)
+            Store.query.filter(Store.user_id == user_id, Store.id.in_(store_ids)).delete(synchronize_session=False)
+        db.session.commit()
+        count_cache.invalidate(('stores', user_id))
+        for store_id in store_ids:
+            count_cache.invalidate(('items', store_id))
+        return created
+
+    @staticmethod
+    def fold_item_changes(batch_size=1000):
+        """
+        Fold the logged item writes into the item count and items version of their stores, oldest
+        first, one transaction per batch. Item writes never update the store row themselves, so
+        this is the only writer of those columns and the log stays short when it runs regularly.
+        Writes to stores that were deleted are dropped.
+        :param batch_size: Logged writes per transaction
+        :return: Number of logged writes folded
+        """
+        last_id = db.session.query(db.func.max(StoreItemChange.id)).scalar() or 0
+        folded = 0
+        while True:
+            changes = db.session.query(StoreItemChange.id, StoreItemChange.store_id, StoreItemChange.delta) \
+                .filter(StoreItemChange.id <= last_id).order_by(StoreItemChange.id).limit(batch_size).all()
+            if not changes:
+                return folded
+            stores = {}
+            for change in changes:
+                delta, _ = stores.get(change.store_id, (0, 0))
+                stores[change.store_id] = (delta + change.delta, change.id)
+            for store_id, (delta, version) in stores.items():
+                Store.query.filter_by(id=store_id).update({
+                    Store.item_count: Store.item_count + delta,
+                    Store.items_version: version
+                }, synchronize_session=False)
+            # Exactly the rows read are deleted, a write logged meanwhile is folded by the next batch
+            StoreItemChange.query.filter(StoreItemChange.id.in_([change.id for change in changes])) \
+                .delete(synchronize_session=False)
+            db.session.commit()
+            folded += len(changes)
+
+    @staticmethod
+    def reconcile_item_counts(batch_size=1000):
+        """
+        Fold the logged item writes, then recount the items of every store and repair the counts
+        that drifted. Stores are recounted in Id ranges, one transaction per range.
+        :param batch_size: Stores per transaction
+        :return: Number of stores repaired
+        """
+        Store.fold_item_changes(batch_size)
+        counted = db.select([db.func.count(StoreItem.id)]).where(StoreItem.store_id == Store.id).as_scalar()
+        pending = pending_item_delta(Store.id)
+        last_id = db.session.query(db.func.max(Store.id)).scalar() or 0
+        repaired = 0
+        for start in range(0, last_id, batch_size):
+            repaired += Store.query.filter(Store.id > start, Store.id <= start + batch_size,
+                                           Store.item_count + pending != counted).update({
+                                               Store.item_count: counted - pending,
+                                               Store.modified_at: datetime.datetime.utcnow()
+                                           }, synchronize_session=False)
+            db.session.commit()
+        return repaired
 
     def json(self):
         """
         Json representation of the store model.
         :return:
         """
-        return {
-            'id': self.id,
-            'name': self.name,
-            'createdAt': self.create_at.isoformat(),
-            'modifiedAt': self.modified_at.isoformat()
-        }
+        return Store.row_json(self)
+
+    # Json fields of a store and the columns they come from. Sparse reads always select the Id,
+    # the creation time, the modification time and the version of the items, which ETags and
+    # cursors are built from.
+    fieldset = Fieldset((
+        ('id', 'id'),
+        ('name', 'name'),
+        ('createdAt', 'create_at'),
+        ('modifiedAt', 'modified_at'),
+        ('itemCount', 'item_total')
+    ), required=('id', 'create_at', 'modified_at', 'item_version'))
+
+    # Json representation of a store model or of a row with the store columns, the datetimes are
+    # written by the response encoder
+    row_json = staticmethod(fieldset.serializer(None))
 
 
 class StoreItem(db.Model):
@@ -215,11 +802,15 @@ class StoreItem(db.Model):
 
     def save(self):
         """
-        Persist Item into the database
+        Persist Item into the database and count it on its store
         :return:
         """
+        store_id = self.store_id
         db.session.add(self)
+        db.session.flush()
+        StoreItemChange.record(store_id, 1)
         db.session.commit()
+        count_cache.invalidate(('items', store_id))
 
     def update(self, name, description=None):
         """
@@ -231,26 +822,218 @@ class StoreItem(db.Model):
         self.name = name
         if description is not None:
             self.description = description
+        self.modified_at = datetime.datetime.utcnow()
+        db.session.flush()
+        # Stores embedding their items show the change too
+        StoreItemChange.record(self.store_id, 0)
         db.session.commit()
 
     def delete(self):
         """
-        Delete an item
+        Delete an item and uncount it from its store
         :return:
         """
+        store_id = self.store_id
         db.session.delete(self)
+        db.session.flush()
+        StoreItemChange.record(store_id, -1)
+        db.session.commit()
+        count_cache.invalidate(('items', store_id))
+
+    @staticmethod
+    def create(user_id, store_id, name, description):
+        """
+        Add an item to one of the user's stores and count it, with one statement.
+        :param user_id: User Id
+        :param store_id: Store Id
+        :param name: Name
+        :param description: Description
+        :return: Row or StoreItem with the item columns, None when the user has no such store
+        """
+        if not returning_writes():
+            store = Store.get_user_store(user_id, store_id)
+            if store is None:
+                return None
+            item = StoreItem(name, description, store.id)
+            item.save()
+            return item
+        row = db.session.execute(ITEM_INSERT_RETURNING, {
+            'name': name, 'description': description, 'store_id': store_id, 'user_id': user_id,
+            'now': datetime.datetime.utcnow()
+        }).first()
+        db.session.commit()
+        if row is not None:
+            count_cache.invalidate(('items', row.store_id))
+        return row
+
+    @staticmethod
+    def edit(user_id, store_id, item_id, name, description=None):
+        """
+        Update an item in one of the user's stores with one statement.
+        :param user_id: User Id
+        :param store_id: Store Id
+        :param item_id: Item Id
+        :param name: Name
+        :param description: Description, left as it is when None
+        :return: Row or StoreItem with the item columns, None when the user has no such item
+        """
+        if not returning_writes():
+            item = StoreItem.get_user_item(user_id, store_id, item_id)
+            if item:
+                item.update(name, description)
+            return item
+        row = db.session.execute(ITEM_UPDATE_RETURNING, {
+            'name': name, 'description': description, 'item_id': item_id, 'store_id': store_id,
+            'user_id': user_id, 'now': datetime.datetime.utcnow()
+        }).first()
         db.session.commit()
+        return row
+
+    @staticmethod
+    def delete_owned(user_id, store_id, item_id):
+        """
+        Delete an item from one of the user's stores and uncount it, with one statement.
+        :param user_id: User Id
+        :param store_id: Store Id
+        :param item_id: Item Id
+        :return: True when the item was deleted
+        """
+        if not returning_writes():
+            item = StoreItem.get_user_item(user_id, store_id, item_id)
+            if item:
+                item.delete()
+            return item is not None
+        row = db.session.execute(ITEM_DELETE_RETURNING, {
+            'item_id': item_id, 'store_id': store_id, 'user_id': user_id
+        }).first()
+        db.session.commit()
+        if row is not None:
+            count_cache.invalidate(('items', row.store_id))
+        return row is not None
+
+    @staticmethod
+    def bulk_insert(store_id, rows):
+        """
+        Insert a chunk of items into a store with one executemany and count them on the store,
+        all in one transaction.
+        :param store_id: Store Id
+        :param rows: List of dicts with name and description
+        :return:
+        """
+        now = datetime.datetime.utcnow()
+        db.session.execute(StoreItem.__table__.insert(), [
+            {'name': row['name'], 'description': row['description'], 'store_id': store_id,
+             'create_at': now, 'modified_at': now} for row in rows])
+        StoreItemChange.record(store_id, len(rows))
+        db.session.commit()
+        count_cache.invalidate(('items', store_id))
+
+    @staticmethod
+    def user_items(user_id, store_id):
+        """
+        Query for the items of a store, limited to stores owned by the user.
+        :param user_id: User Id
+        :param store_id: Store Id
+        :return: Query
+        """
+        return StoreItem.query.join(Store, Store.id == StoreItem.store_id) \
+            .filter(Store.user_id == user_id, StoreItem.store_id == store_id)
+
+    @staticmethod
+    def get_user_item(user_id, store_id, item_id):
+        """
+        Resolve an item in a store owned by the user with a single query.
+        :param user_id: User Id
+        :param store_id: Store Id
+        :param item_id: Item Id
+        :return: StoreItem or None
+        """
+        return StoreItem.user_items(user_id, store_id).filter(StoreItem.id == item_id).first()
+
+    @staticmethod
+    def rows(fields=None):
+        """
+        Read only query of the item columns the API shows, rows are keyed tuples instead of
+        StoreItem instances. The description is only read when its field is asked for.
+        :param fields: Json fields to select the columns of, all of them when not set
+        :return: Query
+        """
+        return db.session.query(*StoreItem.fieldset.columns(StoreItem, fields))
+
+    @staticmethod
+    def user_item_rows(user_id, store_id, fields=None):
+        """
+        Read only query of the items of a store, limited to stores owned by the user.
+        :param user_id: User Id
+        :param store_id: Store Id
+        :param fields: Json fields to select the columns of, all of them when not set
+        :return: Query
+        """
+        return StoreItem.rows(fields).join(Store, Store.id == StoreItem.store_id) \
+            .filter(Store.user_id == user_id, StoreItem.store_id == store_id)
+
+    @staticmethod
+    def get_user_item_row(user_id, store_id, item_id, fields=None):
+        """
+        Read only row of an item in a store owned by the user.
+        :param user_id: User Id
+        :param store_id: Store Id
+        :param item_id: Item Id
+        :param fields: Json fields to select the columns of, all of them when not set
+        :return: Row or None
+        """
+        return StoreItem.user_item_rows(user_id, store_id, fields).filter(StoreItem.id == item_id).first()
+
+    @staticmethod
+    def first_items(store_ids, limit, fields=None):
+        """
+        Load the newest items of several stores with one query, numbering the items of each
+        store with a window function and keeping the first ones.
+        :param store_ids: Store Ids
+        :param limit: Items kept per store
+        :param fields: Json fields to select the columns of, all of them when not set
+        :return: dict of Store Id to list of item rows
+        """
+        items = {store_id: [] for store_id in store_ids}
+        if not store_ids or limit <= 0:
+            return items
+        order = (StoreItem.create_at.desc(), StoreItem.id.desc())
+        ranked = db.session.query(
+            StoreItem.id.label('id'),
+            db.func.row_number().over(partition_by=StoreItem.store_id, order_by=order).label('position')
+        ).filter(StoreItem.store_id.in_(store_ids)).subquery()
+        query = StoreItem.rows(fields).join(ranked, ranked.c.id == StoreItem.id) \
+            .filter(ranked.c.position <= limit).order_by(StoreItem.store_id, ranked.c.position)
+        for item in query:
+            items[item.store_id].append(item)
+        return items
 
     def json(self):
         """
         Json representation of the model
         :return:
         """
-        return {
-            'id': self.id,
-            'name': self.name,
-            'description': self.description,
-            'storeId': self.store_id,
-            'createdAt': self.create_at.isoformat(),
-            'modifiedAt': self.modified_at.isoformat()
-        }
+        return StoreItem.row_json(self)
+
+    # Json fields of an item and the columns they come from. Sparse reads always select the Id,
+    # the Store Id that embedded items are grouped by and the modification time used by ETags.
+    fieldset = Fieldset((
+        ('id', 'id'),
+        ('name', 'name'),
+        ('description', 'description'),
+        ('storeId', 'store_id'),
+        ('createdAt', 'create_at'),
+        ('modifiedAt', 'modified_at')
+    ), required=('id', 'store_id', 'modified_at'))
+
+    # Json representation of an item model or of a row with the item columns, the datetimes are
+    # written by the response encoder
+    row_json = staticmethod(fieldset.serializer(None))
+
+
+# Item pages are read newest first and item cursors walk the Id backwards within a store
+db.Index('ix_storeitems_store_id_create_at_id', StoreItem.store_id, StoreItem.create_at.desc(), StoreItem.id)
+db.Index('ix_storeitems_store_id_id', StoreItem.store_id, StoreItem.id)
+
+blacklist_filter.loader = BlackListToken.all_token_hashes
+install_item_search_ddl(StoreItem.__table__)
@@ -0,0 +1,242 @@
+from app import app, db
+from collections import OrderedDict
+from itsdangerous import URLSafeSerializer, BadSignature
+from sqlalchemy import func
+import datetime
+import json
+import threading
+import time
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+serializer = URLSafeSerializer(app.config['SECRET_KEY'], salt='pagination-cursor')
+
+
+class InvalidCursor(Exception):
+    """
+    Raised when a pagination cursor was tampered with or does not belong to the list.
+    """
+    pass
+
+
+def encode_cursor(scope, values):
+    """
+    Make an opaque signed cursor pointing after the given sort key.
+    :param scope: Name of the list the cursor belongs to
+    :param values: Sort key of the last row returned
+    :return: Cursor string
+    """
+    return serializer.dumps([scope] + [encode_value(value) for value in values])
+
+
+def decode_cursor(scope, cursor):
+    """
+    Verify a cursor and return the sort key it points after.
+    :param scope: Name of the list the cursor must belong to
+    :param cursor: Cursor string
+    :return: List of sort key values
+    """
+    try:
+        data = serializer.loads(cursor)
+    except BadSignature:
+        raise InvalidCursor()
+    if not isinstance(data, list) or not data or data[0] != scope:
+        raise InvalidCursor()
+    return [decode_value(value) for value in data[1:]]
+
+
+def encode_value(value):
+    """
+    Datetimes are kept as integer microseconds so they round trip exactly.
+    """
+    if isinstance(value, datetime.datetime):
+        return {'t': (value - EPOCH) // datetime.timedelta(microseconds=1)}
+    return value
+
+
+def decode_value(value):
+    """
+    Reverse of encode_value.
+    """
+    if isinstance(value, dict):
+        return EPOCH + datetime.timedelta(microseconds=value['t'])
+    return value
+
+
+def keyset_page(query, per_page):
+    """
+    Fetch one page of an ordered query that is already positioned after the cursor.
+    One extra row is read to know whether there is a next page.
+    :param query: Ordered and filtered query
+    :param per_page: Page size
+    :return: Rows of the page and whether more rows follow
+    """
+    rows = query.limit(per_page + 1).all()
+    return rows[:per_page], len(rows) > per_page
+
+
+COUNT_STRATEGIES = ('exact', 'estimated', 'none')
+
+
+class InvalidCountStrategy(Exception):
+    """
+    Raised when the count query parameter is not one of COUNT_STRATEGIES.
+    """
+    pass
+
+
+class CountCache:
+    """
+    Per process cache of unfiltered list totals, kept for a bounded time because writes in
+    other worker processes do not reach it.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return the cached total or None.
+        :param key: List key
+        :return: int or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.time():
+                self._entries.pop(key, None)
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, total):
+        """
+        Cache the total of a list.
+        :param key: List key
+        :param total: Total
+        :return:
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (total, time.time() + self.ttl)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        """
+        Forget the total of a list after a create or delete.
+        :param key: List key
+        :return:
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """
+        Empty the cache.
+        :return:
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+count_cache = CountCache(app.config['COUNT_CACHE_SIZE'], app.config['COUNT_CACHE_TTL'])
+
+
+class Page:
+    """
+    One page of an offset paginated list.
+    """
+
+    def __init__(self, items, page, total, has_next):
+        self.items = items
+        self.page = page
+        self.total = total
+        self.has_prev = page > 1
+        self.has_next = has_next
+
+
+def count_strategy(value, default='exact'):
+    """
+    Validate the count query parameter.
+    :param value: Requested strategy or None for the default
+    :param default: Strategy used when none was requested
+    :return: Strategy name
+    """
+    if value is None:
+        return default
+    if value not in COUNT_STRATEGIES:
+        raise InvalidCountStrategy()
+    return value
+
+
+def count_rows(query, strategy, cache_key=None):
+    """
+    Count the rows of a list query with the requested strategy.
+    Estimated totals come from the cached total of an unfiltered list when there is one,
+    otherwise from the query planner on PostgreSQL.
+    :param query: Filtered, unpaginated query
+    :param strategy: exact, estimated or none
+    :param cache_key: Key of the cached total when the query is an unfiltered list
+    :return: Total or None
+    """
+    if strategy == 'none':
+        return None
+    if strategy == 'estimated':
+        if cache_key is not None:
+            total = count_cache.get(cache_key)
+            if total is None:
+                total = query.order_by(None).count()
+                count_cache.set(cache_key, total)
+            return total
+        if db.engine.dialect.name == 'postgresql':
+            return planner_estimate(query)
+    return query.order_by(None).count()
+
+
+def planner_estimate(query):
+    """
+    Ask PostgreSQL how many rows it expects the query to return, without running it.
+    :param query: Query
+    :return: int
+    """
+    compiled = query.order_by(None).statement.compile(dialect=db.engine.dialect)
+    plan = db.session.connection().execute('EXPLAIN (FORMAT JSON) ' + str(compiled), compiled.params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def offset_page(query, page, per_page, strategy, cache_key=None, count_query=None):
+    """
+    Fetch one page of an ordered query by offset.
+    An exact total is read with a window count in the same query as the page, a separate
+    count only runs when the page is empty or when a count query is given.
+    :param query: Ordered and filtered query
+    :param page: Page number, starting at 1
+    :param per_page: Page size
+    :param strategy: exact, estimated or none
+    :param cache_key: Key of the cached total when the query is an unfiltered list
+    :param count_query: Query counting the same rows, for page queries a window count cannot be added to
+    :return: Page
+    """
+    page = max(page, 1)
+    offset = (page - 1) * per_page
+    if strategy == 'exact' and count_query is None:
+        rows = query.add_columns(func.count().over().label('total')).limit(per_page).offset(offset).all()
+        if rows:
+            total = rows[0].total
+        else:
+            total = 0 if page == 1 else query.order_by(None).count()
+        # Single entity queries go back to the entity, rows of column queries keep the total as
+        # their last column
+        if len(query.column_descriptions) == 1:
+            items = [row[0] for row in rows]
+        else:
+            items = rows
+        return Page(items, page, total, offset + per_page < total)
+    rows = query.limit(per_page + 1).offset(offset).all()
+    total = count_rows(query if count_query is None else count_query, strategy, cache_key)
+    return Page(rows[:per_page], page, total, len(rows) > per_page)
@@ -0,0 +1,166 @@
+import html
+from app import db
+from sqlalchemy import DDL, event, func, literal, literal_column, or_, text
+from sqlalchemy.sql import table, column
+
+
+def contains_pattern(q):
+    """
+    LIKE pattern matching names that contain the search term.
+    Wildcards typed by the user are escaped so they match literally.
+    :param q: Search term
+    :return: Pattern to use with escape='\\'
+    """
+    term = q.lower().strip().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return '%' + term + '%'
+
+
+def name_contains(column, q):
+    """
+    Filter on a name column containing the search term.
+    On PostgreSQL the condition can use a pg_trgm GIN index on the column where one exists.
+    :param column: Name column
+    :param q: Search term
+    :return: SQL condition
+    """
+    return column.like(contains_pattern(q), escape='\\')
+
+
+# Matches are delimited with private use characters rather than markup. The highlighted text is
+# html escaped first and the delimiters are turned into <mark> tags afterwards, see highlight_html
+MARK_START = '\ue000'
+MARK_END = '\ue001'
+HEADLINE_OPTIONS = 'StartSel={}, StopSel={}, MaxWords=20, MinWords=5'.format(MARK_START, MARK_END)
+
+# PostgreSQL keeps a weighted tsvector of name and description in storeitems.search_vector
+POSTGRES_ITEM_SEARCH_DDL = (
+    "ALTER TABLE storeitems ADD COLUMN search_vector tsvector",
+    """CREATE OR REPLACE FUNCTION storeitems_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := setweight(to_tsvector('english', coalesce(NEW.name, '')), 'A') ||
+                         setweight(to_tsvector('english', coalesce(NEW.description, '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql""",
+    """CREATE TRIGGER storeitems_search_vector_trigger BEFORE INSERT OR UPDATE OF name, description
+ON storeitems FOR EACH ROW EXECUTE PROCEDURE storeitems_search_vector_update()""",
+    "CREATE INDEX ix_storeitems_search_vector ON storeitems USING gin (search_vector)",
+)
+
+# SQLite keeps an external content FTS5 table in step with storeitems through triggers
+SQLITE_ITEM_SEARCH_DDL = (
+    "CREATE VIRTUAL TABLE storeitems_fts USING fts5(name, description, content='storeitems', content_rowid='id')",
+    """CREATE TRIGGER storeitems_fts_insert AFTER INSERT ON storeitems BEGIN
+    INSERT INTO storeitems_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+END""",
+    """CREATE TRIGGER storeitems_fts_delete AFTER DELETE ON storeitems BEGIN
+    INSERT INTO storeitems_fts(storeitems_fts, rowid, name, description)
+    VALUES ('delete', old.id, old.name, old.description);
+END""",
+    """CREATE TRIGGER storeitems_fts_update AFTER UPDATE ON storeitems BEGIN
+    INSERT INTO storeitems_fts(storeitems_fts, rowid, name, description)
+    VALUES ('delete', old.id, old.name, old.description);
+    INSERT INTO storeitems_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+END""",
+)
+
+fts_table = table('storeitems_fts', column('rowid'))
+
+
+def install_item_search_ddl(items_table):
+    """
+    Create the full text search structures whenever the items table is created,
+    so that db.create_all() builds the same schema as the migrations.
+    :param items_table: storeitems Table
+    :return:
+    """
+    for statement in POSTGRES_ITEM_SEARCH_DDL:
+        event.listen(items_table, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+    for statement in SQLITE_ITEM_SEARCH_DDL:
+        event.listen(items_table, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+    event.listen(items_table, 'before_drop',
+                 DDL('DROP TABLE IF EXISTS storeitems_fts').execute_if(dialect='sqlite'))
+
+
+def fts5_match_expression(terms):
+    """
+    Quote every word so user input cannot be read as FTS5 query syntax.
+    :param terms: Search terms
+    :return: FTS5 MATCH expression
+    """
+    return ' '.join('"' + word.replace('"', '""') + '"' for word in terms.split())
+
+
+def ranked_item_search(query, item, terms):
+    """
+    Restrict an items query to full text matches of the terms in name and description, best first.
+    Each row carries the item, its relevance and the highlighted name and description.
+    :param query: Query on StoreItem
+    :param item: StoreItem model
+    :param terms: Search terms
+    :return: Query of (item, rank, name, description) rows
+    """
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        tsquery = func.plainto_tsquery('english', terms)
+        vector = literal_column('storeitems.search_vector')
+        rank = func.ts_rank(vector, tsquery)
+        return query.add_columns(
+            rank.label('rank'),
+            func.ts_headline('english', item.name, tsquery, HEADLINE_OPTIONS).label('name_highlight'),
+            func.ts_headline('english', func.coalesce(item.description, ''), tsquery,
+                             HEADLINE_OPTIONS).label('description_highlight')
+        ).filter(vector.op('@@')(tsquery)).order_by(rank.desc(), item.id.desc())
+    if dialect == 'sqlite':
+        # bm25 is lower for better matches, it is negated so that a higher rank is better everywhere
+        rank = literal_column('-bm25(storeitems_fts)')
+        return fts5_matches(query, item, terms).add_columns(
+            rank.label('rank'),
+            func.highlight(literal_column('storeitems_fts'), 0, MARK_START, MARK_END).label('name_highlight'),
+            func.snippet(literal_column('storeitems_fts'), 1, MARK_START, MARK_END, '...', 16)
+            .label('description_highlight')
+        ).order_by(rank.desc(), item.id.desc())
+    # Without a full text engine every word has to appear in the name or the description
+    for word in terms.split():
+        query = query.filter(or_(name_contains(item.name, word), name_contains(item.description, word)))
+    return query.add_columns(literal(0.0).label('rank'), item.name.label('name_highlight'),
+                             item.description.label('description_highlight')).order_by(item.id.desc())
+
+
+def highlight_html(highlighted):
+    """
+    Html of a highlighted name or description. The text is escaped before the match delimiters
+    become <mark> tags, so markup stored in an item is shown as text.
+    :param highlighted: Text with matches between MARK_START and MARK_END
+    :return: Html
+    """
+    if highlighted is None:
+        return None
+    return html.escape(highlighted).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>')
+
+
+def fts5_matches(query, item, terms):
+    """
+    Restrict an items query to the FTS5 matches of the terms.
+    :param query: Query on StoreItem
+    :param item: StoreItem model
+    :param terms: Search terms
+    :return: Query
+    """
+    return query.join(fts_table, fts_table.c.rowid == item.id) \
+        .filter(text('storeitems_fts MATCH :terms')).params(terms=fts5_match_expression(terms))
+
+
+def item_search_count_query(query, item, terms):
+    """
+    Query counting the full text matches on its own, for databases where the total cannot be read
+    with a window count in the page query. FTS5 auxiliary functions such as bm25 cannot run in the
+    same SELECT as count(*) OVER ().
+    :param query: Query on StoreItem
+    :param item: StoreItem model
+    :param terms: Search terms
+    :return: Query or None when the page query can carry the window count
+    """
+    if db.engine.dialect.name == 'sqlite':
+        return fts5_matches(query, item, terms)
+    return None
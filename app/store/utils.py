@@ -1,6 +1,40 @@
-from flask import make_response, jsonify, url_for
+from flask import url_for
+from werkzeug.http import http_date
+from app.encoding import json_response
 from app import app
-from app.models import Store
+from app.models import Store, StoreItem
+from app.search import name_contains
+from app.fields import fields_param
+from app.pagination import encode_cursor, decode_cursor, keyset_page, offset_page, count_rows, count_strategy
+from sqlalchemy import tuple_
+from collections import OrderedDict
+
+
+class InvalidInclude(Exception):
+    """
+    Raised when the include query parameter is not items or items:<limit>.
+    """
+    pass
+
+
+def included_items_limit(include):
+    """
+    Read the number of items to embed in each store from the include query parameter.
+    A bare items embeds a full items page, a larger limit is capped to the page size.
+    :param include: None, items or items:<limit>
+    :return: Items per store or None when items are not included
+    """
+    if include is None:
+        return None
+    per_page = app.config['STORE_AND_ITEMS_PER_PAGE']
+    name, _, limit = include.partition(':')
+    if name != 'items':
+        raise InvalidInclude()
+    if not limit:
+        return per_page
+    if not limit.isdigit():
+        raise InvalidInclude()
+    return min(int(limit), per_page)
 
 
 def response_for_user_store(user_store):
@@ -9,26 +43,27 @@ def response_for_user_store(user_store):
     :param user_store:
     :return:
     """
-    return make_response(jsonify({
+    return json_response({
         'status': 'success',
         'store': user_store
-    }))
+    })
 
 
 def response_for_created_store(user_store, status_code):
     """
     Method returning the response when a store has been successfully created.
     :param status_code:
-    :param user_store: Store
+    :param user_store: Store or row with the store columns
     :return: Http Response
     """
-    return make_response(jsonify({
+    return json_response({
         'status': 'success',
         'id': user_store.id,
         'name': user_store.name,
-        'createdAt': user_store.create_at,
-        'modifiedAt': user_store.modified_at
-    })), status_code
+        'createdAt': http_date(user_store.create_at),
+        'modifiedAt': http_date(user_store.modified_at),
+        'itemCount': user_store.item_total
+    }), status_code
 
 
 def response(status, message, code):
@@ -39,24 +74,56 @@ def response(status, message, code):
     :param code: Response status code
     :return: Http Response
     """
-    return make_response(jsonify({
+    return json_response({
         'status': status,
         'message': message
-    })), code
+    }), code
 
 
-def get_user_store_json_list(user_stores):
+def get_user_store_json_list(user_stores, item_limit=None, fields=None, item_fields=None):
     """
     Make json objects of the user stores and add them to a list.
-    :param user_stores: Store
+    When an item limit is set the first items of every store are embedded, loaded for
+    all the stores with a single query.
+    :param user_stores: Stores or store rows
+    :param item_limit: Items embedded per store, None to leave them out
+    :param fields: Store fields shown, all of them when not set
+    :param item_fields: Fields shown of the embedded items, all of them when not set
     :return:
     """
+    items = None
+    if item_limit is not None:
+        items = StoreItem.first_items([user_store.id for user_store in user_stores], item_limit, item_fields)
+    store_json = Store.fieldset.serializer(fields)
+    item_json = StoreItem.fieldset.serializer(item_fields)
     stores = []
     for user_store in user_stores:
-        stores.append(user_store.json())
+        store = store_json(user_store)
+        if items is not None:
+            store['items'] = [item_json(item) for item in items[user_store.id]]
+        stores.append(store)
     return stores
 
 
+def store_list_url(position, q, count, include, fields, item_fields):
+    """
+    Url of another page of the store list carrying over the query parameters of this one.
+    Parameters that were not sent are None and left out.
+    :param position: dict with the page number or the cursor of the page
+    :param q: Query parameter
+    :param count: Count strategy
+    :param include: Include parameter
+    :param fields: Store fields
+    :param item_fields: Fields of the embedded items
+    :return: Url
+    """
+    params = OrderedDict([('q', q or None)])
+    params.update(position)
+    params.update([('count', count), ('include', include), ('fields', fields_param(fields)),
+                   ('fields[items]', fields_param(item_fields))])
+    return url_for('store.storelist', _external=True, **params)
+
+
 def response_with_pagination(stores, previous, nex, count):
     """
     Make a http response for StoreList get requests.
@@ -66,43 +133,156 @@ def response_with_pagination(stores, previous, nex, count):
     :param stores: Store
     :return: Http Json response
     """
-    return make_response(jsonify({
+    return json_response({
         'status': 'success',
         'previous': previous,
         'next': nex,
         'count': count,
         'stores': stores
-    })), 200
+    }), 200
 
 
-def paginate_stores(user_id, page, q, user):
+def paginate_stores(user_id, page, q, count=None, include=None, fields=None, item_fields=None):
     """
-    Get a user by Id, then get hold of their stores and also paginate the results.
+    Get hold of the user's stores and also paginate the results.
     There is also an option to search for a store name if the query param is set.
     Generate previous and next pagination urls
     :param q: Query parameter
     :param user_id: User Id
-    :param user: Current User
     :param page: Page number
+    :param count: Count strategy, exact when not set
+    :param include: Include parameter carried over to the page urls
+    :param fields: Store fields to select, all of them when not set
+    :param item_fields: Fields of the embedded items carried over to the page urls
     :return: Pagination next url, previous url and the user stores.
     """
+    strategy = count_strategy(count)
+    query = Store.rows(fields).filter(Store.user_id == user_id)
+    cache_key = ('stores', user_id)
     if q:
-        pagination = Store.query.filter(Store.name.like("%" + q.lower().strip() + "%")).filter_by(user_id=user_id) \
-            .paginate(page=page, per_page=app.config['STORE_AND_ITEMS_PER_PAGE'], error_out=False)
-    else:
-        pagination = user.stores.paginate(page=page, per_page=app.config['STORE_AND_ITEMS_PER_PAGE'],
-                                           error_out=False)
+        query = query.filter(name_contains(Store.name, q))
+        cache_key = None
+    pagination = offset_page(query.order_by(Store.id), page, app.config['STORE_AND_ITEMS_PER_PAGE'], strategy,
+                             cache_key)
     previous = None
     if pagination.has_prev:
-        if q:
-            previous = url_for('store.storelist', q=q, page=page - 1, _external=True)
-        else:
-            previous = url_for('store.storelist', page=page - 1, _external=True)
+        previous = store_list_url({'page': page - 1}, q, count, include, fields, item_fields)
     nex = None
     if pagination.has_next:
-        if q:
-            nex = url_for('store.storelist', q=q, page=page + 1, _external=True)
-        else:
-            nex = url_for('store.storelist', page=page + 1, _external=True)
+        nex = store_list_url({'page': page + 1}, q, count, include, fields, item_fields)
     items = pagination.items
     return items, nex, pagination, previous
+
+
+def paginate_stores_by_cursor(user_id, cursor, q, count=None, include=None, fields=None, item_fields=None):
+    """
+    Get a page of the user's stores ordered by creation time, starting after the cursor.
+    The page is found through the (create_at, id) sort key so deep pages cost the same as the first.
+    :param user_id: User Id
+    :param cursor: Cursor from a previous page, empty for the first page
+    :param q: Query parameter
+    :param count: Count strategy, none when not set
+    :param include: Include parameter carried over to the page urls
+    :param fields: Store fields to select, all of them when not set
+    :param item_fields: Fields of the embedded items carried over to the page urls
+    :return: The user stores, the next page url and the total
+    """
+    strategy = count_strategy(count, 'none')
+    query = Store.rows(fields).filter(Store.user_id == user_id)
+    cache_key = ('stores', user_id)
+    if q:
+        query = query.filter(name_contains(Store.name, q))
+        cache_key = None
+    total = count_rows(query, strategy, cache_key)
+    if cursor:
+        create_at, store_id = decode_cursor('stores', cursor)
+        query = query.filter(tuple_(Store.create_at, Store.id) > tuple_(create_at, store_id))
+    stores, has_next = keyset_page(query.order_by(Store.create_at, Store.id),
+                                   app.config['STORE_AND_ITEMS_PER_PAGE'])
+    nex = None
+    if has_next:
+        last = stores[-1]
+        next_cursor = encode_cursor('stores', [last.create_at, last.id])
+        nex = store_list_url({'cursor': next_cursor}, q, count, include, fields, item_fields)
+    return stores, nex, total
+
+
+def store_id_of(operation):
+    """
+    Read the Store Id of a bulk operation.
+    :param operation: Operation
+    :return: int or None when it is missing or invalid
+    """
+    store_id = operation.get('id')
+    # Booleans are ints and floats would be truncated, only whole numbers and digit strings are Ids
+    if isinstance(store_id, int) and not isinstance(store_id, bool):
+        return store_id
+    if isinstance(store_id, str) and store_id.isdecimal():
+        return int(store_id)
+    return None
+
+
+def apply_bulk_operations(user_id, operations):
+    """
+    Validate a batch of create, update and delete operations on the user's stores and apply
+    the valid ones together. Operations run in order, so an update or delete of a store
+    deleted earlier in the batch fails.
+    :param user_id: User Id
+    :param operations: List of operations
+    :return: Result of every operation in order and the Ids of the stores deleted
+    """
+    owned = Store.owned_ids(user_id, [store_id_of(operation) for operation in operations
+                                      if isinstance(operation, dict) and store_id_of(operation) is not None])
+    results = []
+    names = []
+    created_results = []
+    renames = {}
+    deleted = []
+    for operation in operations:
+        op = operation.get('op') if isinstance(operation, dict) else None
+        if op == 'create':
+            name = operation.get('name')
+            if not name or not isinstance(name, str):
+                results.append({'op': op, 'status': 'failed', 'message': 'Missing name attribute'})
+                continue
+            result = {'op': op, 'status': 'success', 'name': name.lower()}
+            names.append(result['name'])
+            created_results.append(result)
+            results.append(result)
+        elif op in ('update', 'delete'):
+            store_id = store_id_of(operation)
+            if store_id is None:
+                results.append({'op': op, 'status': 'failed', 'message': 'Please provide a valid Store Id'})
+            elif store_id not in owned:
+                results.append({'op': op, 'id': store_id, 'status': 'failed',
+                                'message': 'The Store with Id {} does not exist'.format(store_id)})
+            elif op == 'update':
+                name = operation.get('name')
+                if not name or not isinstance(name, str):
+                    results.append({'op': op, 'id': store_id, 'status': 'failed',
+                                    'message': 'No attribute or value was specified, nothing was changed'})
+                    continue
+                renames[store_id] = name
+                results.append({'op': op, 'id': store_id, 'status': 'success', 'name': name})
+            else:
+                owned.discard(store_id)
+                renames.pop(store_id, None)
+                deleted.append(store_id)
+                results.append({'op': op, 'id': store_id, 'status': 'success'})
+        else:
+            results.append({'op': op, 'status': 'failed', 'message': 'Unknown operation, use create, update or delete'})
+    for result, store_id in zip(created_results, Store.bulk_write(user_id, names, renames, deleted)):
+        result['id'] = store_id
+    return results, deleted
+
+
+def response_for_bulk_operations(results):
+    """
+    Http response listing the result of every bulk operation.
+    :param results: Operation results
+    :return: Http Json response
+    """
+    return json_response({
+        'status': 'success',
+        'results': results
+    }), 200
@@ -1,8 +1,15 @@
 from flask import Blueprint, request, abort
+from app.encoding import request_json
 from app.auth.utils import token_required
 from app.store.utils import response, response_for_created_store, response_for_user_store, response_with_pagination, \
-    get_user_store_json_list, paginate_stores
-from app.models import User, Store
+    get_user_store_json_list, paginate_stores, paginate_stores_by_cursor, included_items_limit, InvalidInclude, \
+    apply_bulk_operations, response_for_bulk_operations
+from app.pagination import InvalidCursor, InvalidCountStrategy
+from app.fields import InvalidFields
+from app.etags import page_etag, conditional_response
+from app.cache import response_cache, cached_response, store_list_tag, item_list_tag
+from app.models import Store, StoreItem
+from app import app
 
 # Initialize blueprint
 store = Blueprint('store', __name__)
@@ -10,22 +17,47 @@ store = Blueprint('store', __name__)
 
 @store.route('/storelists/', methods=['GET'])
 @token_required
+@cached_response(lambda current_user: [store_list_tag(current_user.id)])
 def storelist(current_user):
     """
     Return all the stores owned by the user or limit them to 10.
-    Return an empty stores object if user has no stores
+    Return an empty stores object if user has no stores.
+    Sending a cursor parameter, empty for the first page, switches to cursor pagination.
+    The count parameter picks how the total is worked out: exact, estimated or none.
+    The include parameter, items or items:<limit>, embeds the first items of every store.
+    The fields parameter, such as id,name, limits the stores to the listed fields and the
+    fields[items] parameter does the same for the embedded items.
+    A 304 is returned without a body when the If-None-Match header holds the page ETag.
     :param current_user:
     :return:
     """
-    user = User.get_by_id(current_user.id)
     page = request.args.get('page', 1, type=int)
     q = request.args.get('q', None, type=str)
+    count = request.args.get('count', None, type=str)
+    include = request.args.get('include', None, type=str)
 
-    items, nex, pagination, previous = paginate_stores(current_user.id, page, q, user)
-
-    if items:
-        return response_with_pagination(get_user_store_json_list(items), previous, nex, pagination.total)
-    return response_with_pagination([], previous, nex, 0)
+    try:
+        item_limit = included_items_limit(include)
+        fields = Store.fieldset.parse(request.args.get('fields', None, type=str))
+        item_fields = StoreItem.fieldset.parse(request.args.get('fields[items]', None, type=str))
+        if 'cursor' in request.args:
+            stores, nex, total = paginate_stores_by_cursor(current_user.id, request.args['cursor'], q, count, include,
+                                                           fields, item_fields)
+            return conditional_response(page_etag(stores, total), lambda: response_with_pagination(
+                get_user_store_json_list(stores, item_limit, fields, item_fields), None, nex, total))
+        items, nex, pagination, previous = paginate_stores(current_user.id, page, q, count, include, fields,
+                                                           item_fields)
+    except InvalidCursor:
+        return response('failed', 'Invalid pagination cursor', 400)
+    except InvalidCountStrategy:
+        return response('failed', 'Invalid count option, use exact, estimated or none', 400)
+    except InvalidInclude:
+        return response('failed', 'Invalid include option, use items or items:<limit>', 400)
+    except InvalidFields:
+        return response('failed', 'Invalid fields option, list fields of the resource separated by commas', 400)
+
+    return conditional_response(page_etag(items, pagination.total), lambda: response_with_pagination(
+        get_user_store_json_list(items, item_limit, fields, item_fields), previous, nex, pagination.total))
 
 
 @store.route('/storelists/', methods=['POST'])
@@ -37,21 +69,47 @@ def create_storelist(current_user):
     :return:
     """
     if request.content_type == 'application/json':
-        data = request.get_json()
+        data = request_json()
         name = data.get('name')
         if name:
-            user_store = Store(name.lower(), current_user.id)
-            user_store.save()
+            user_store = Store.create(name.lower(), current_user.id)
+            response_cache.evict(store_list_tag(current_user.id))
             return response_for_created_store(user_store, 201)
         return response('failed', 'Missing name attribute', 400)
     return response('failed', 'Content-type must be json', 202)
 
 
+@store.route('/storelists/bulk', methods=['POST'])
+@token_required
+def bulk_storelists(current_user):
+    """
+    Create, rename and delete many stores in one request and one transaction.
+    The json payload holds a list of operations such as {"op": "create", "name": "Travel"},
+    {"op": "update", "id": 1, "name": "Adventure"} or {"op": "delete", "id": 2}.
+    :param current_user: Current User
+    :return: Result of each operation
+    """
+    if request.content_type != 'application/json':
+        return response('failed', 'Content-type must be json', 202)
+    data = request_json()
+    operations = data.get('operations') if isinstance(data, dict) else None
+    if not operations or not isinstance(operations, list):
+        return response('failed', 'Missing operations attribute', 400)
+    limit = app.config['STORE_BULK_MAX_OPERATIONS']
+    if len(operations) > limit:
+        return response('failed', 'A batch can hold at most {} operations'.format(limit), 400)
+    results, deleted = apply_bulk_operations(current_user.id, operations)
+    response_cache.evict(store_list_tag(current_user.id), *[item_list_tag(store_id) for store_id in deleted])
+    return response_for_bulk_operations(results)
+
+
 @store.route('/storelists/<store_id>', methods=['GET'])
 @token_required
 def get_store(current_user, store_id):
     """
     Return a user store with the supplied user Id.
+    The include parameter, items or items:<limit>, embeds the first items of the store.
+    The fields and fields[items] parameters limit the store and its items to the listed fields.
     :param current_user: User
     :param store_id: Store Id
     :return:
@@ -61,9 +119,18 @@ def get_store(current_user, store_id):
     except ValueError:
         return response('failed', 'Please provide a valid Store Id', 400)
     else:
-        user_store = User.get_by_id(current_user.id).stores.filter_by(id=store_id).first()
+        try:
+            item_limit = included_items_limit(request.args.get('include', None, type=str))
+            fields = Store.fieldset.parse(request.args.get('fields', None, type=str))
+            item_fields = StoreItem.fieldset.parse(request.args.get('fields[items]', None, type=str))
+        except InvalidInclude:
+            return response('failed', 'Invalid include option, use items or items:<limit>', 400)
+        except InvalidFields:
+            return response('failed', 'Invalid fields option, list fields of the resource separated by commas', 400)
+        user_store = Store.get_user_store_row(current_user.id, store_id, fields)
         if user_store:
-            return response_for_user_store(user_store.json())
+            return conditional_response(page_etag([user_store]), lambda: response_for_user_store(
+                get_user_store_json_list([user_store], item_limit, fields, item_fields)[0]))
         return response('failed', "Store not found", 404)
 
 
@@ -78,16 +145,16 @@ def edit_store(current_user, store_id):
     :return: Http Json response
     """
     if request.content_type == 'application/json':
-        data = request.get_json()
+        data = request_json()
         name = data.get('name')
         if name:
             try:
                 int(store_id)
             except ValueError:
                 return response('failed', 'Please provide a valid Store Id', 400)
-            user_store = User.get_by_id(current_user.id).stores.filter_by(id=store_id).first()
+            user_store = Store.rename(current_user.id, int(store_id), name)
             if user_store:
-                user_store.update(name)
+                response_cache.evict(store_list_tag(current_user.id), item_list_tag(user_store.id))
                 return response_for_created_store(user_store, 201)
             return response('failed', 'The Store with Id ' + store_id + ' does not exist', 404)
         return response('failed', 'No attribute or value was specified, nothing was changed', 400)
@@ -107,10 +174,9 @@ def delete_store(current_user, store_id):
         int(store_id)
     except ValueError:
         return response('failed', 'Please provide a valid Store Id', 400)
-    user_store = User.get_by_id(current_user.id).stores.filter_by(id=store_id).first()
-    if not user_store:
+    if not Store.delete_owned(current_user.id, int(store_id)):
         abort(404)
-    user_store.delete()
+    response_cache.evict(store_list_tag(current_user.id), item_list_tag(store_id))
     return response('success', 'Store Deleted successfully', 200)
 
 
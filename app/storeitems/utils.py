@@ -1,7 +1,15 @@
-from flask import jsonify, make_response, request, url_for
+from flask import request, url_for
+from app.encoding import json_response, dumps, loads
 from app import app
 from functools import wraps
-from app.models import User, StoreItem
+import csv
+import datetime
+import io
+import time
+from app.models import StoreItem
+from app.search import name_contains, ranked_item_search, item_search_count_query, highlight_html
+from app.fields import fields_param
+from app.pagination import encode_cursor, decode_cursor, keyset_page, offset_page, count_rows, count_strategy
 
 
 def store_required(f):
@@ -31,24 +39,25 @@ def response(status, message, status_code):
     :param status_code: Http response code
     :return:
     """
-    return make_response(jsonify({
+    return json_response({
         'status': status,
         'message': message
-    })), status_code
+    }), status_code
 
 
-def response_with_store_item(status, item, status_code):
+def response_with_store_item(status, item, status_code, fields=None):
     """
     Http response for response with a store item.
     :param status: Status Message
-    :param item: StoreItem
+    :param item: StoreItem or row with the item columns
     :param status_code: Http Status Code
+    :param fields: Item fields shown, all of them when not set
     :return:
     """
-    return make_response(jsonify({
+    return json_response({
         'status': status,
-        'item': item.json()
-    })), status_code
+        'item': StoreItem.fieldset.serializer(fields)(item)
+    }), status_code
 
 
 def response_with_pagination(items, previous, nex, count):
@@ -60,57 +69,361 @@ def response_with_pagination(items, previous, nex, count):
     :param count: Pagination total
     :return: Http Json response
     """
-    return make_response(jsonify({
+    return json_response({
         'status': 'success',
         'previous': previous,
         'next': nex,
         'count': count,
         'items': items
-    })), 200
+    }), 200
 
 
-def get_user_store(current_user, store_id):
+def get_paginated_items(user_id, store_id, page, q, count=None, fields=None):
     """
-    Query the user to find and return the store specified by the store Id
-    :param store_id: Store Id
-    :param current_user: User
-    :return:
-    """
-    user_store = User.get_by_id(current_user.id).stores.filter_by(id=store_id).first()
-    return user_store
-
-
-def get_paginated_items(store, store_id, page, q):
-    """
-    Get the items from the store and then paginate the results.
+    Get the items from the user's store and then paginate the results.
+    Ownership of the store is checked by the same query that loads the page.
     Items can also be search when the query parameter is set.
     Construct the previous and next urls.
     :param q: Query parameter
-    :param store: Store
+    :param user_id: User Id
     :param store_id: Store Id
     :param page: Page number
+    :param count: Count strategy, exact when not set
+    :param fields: Item fields to select, all of them when not set
     :return:
     """
-
+    strategy = count_strategy(count)
+    query = StoreItem.user_item_rows(user_id, store_id, fields)
+    cache_key = ('items', int(store_id))
     if q:
-        pagination = StoreItem.query.filter(StoreItem.name.like("%" + q.lower().strip() + "%")) \
-            .order_by(StoreItem.create_at.desc()) \
-            .filter_by(store_id=store_id) \
-            .paginate(page=page, per_page=app.config['STORE_AND_ITEMS_PER_PAGE'], error_out=False)
-    else:
-        pagination = store.items.order_by(StoreItem.create_at.desc()).paginate(page=page, per_page=app.config[
-            'STORE_AND_ITEMS_PER_PAGE'], error_out=False)
+        query = query.filter(name_contains(StoreItem.name, q))
+        cache_key = None
+    pagination = offset_page(query.order_by(StoreItem.create_at.desc()), page,
+                             app.config['STORE_AND_ITEMS_PER_PAGE'], strategy, cache_key)
 
     previous = None
     if pagination.has_prev:
         if q:
-            previous = url_for('items.get_items', q=q, store_id=store_id, page=page - 1, _external=True)
+            previous = url_for('items.get_items', q=q, store_id=store_id, page=page - 1, count=count,
+                               fields=fields_param(fields), _external=True)
         else:
-            previous = url_for('items.get_items', store_id=store_id, page=page - 1, _external=True)
+            previous = url_for('items.get_items', store_id=store_id, page=page - 1, count=count,
+                               fields=fields_param(fields), _external=True)
     nex = None
     if pagination.has_next:
         if q:
-            nex = url_for('items.get_items', q=q, store_id=store_id, page=page + 1, _external=True)
+            nex = url_for('items.get_items', q=q, store_id=store_id, page=page + 1, count=count,
+                          fields=fields_param(fields), _external=True)
         else:
-            nex = url_for('items.get_items', store_id=store_id, page=page + 1, _external=True)
+            nex = url_for('items.get_items', store_id=store_id, page=page + 1, count=count,
+                          fields=fields_param(fields), _external=True)
+    return pagination.items, nex, pagination, previous
+
+
+def get_items_by_cursor(user_id, store_id, cursor, q, count=None, fields=None):
+    """
+    Get a page of the items in the user's store, newest first, starting after the cursor.
+    Items are ordered by Id so deep pages cost the same as the first.
+    :param user_id: User Id
+    :param store_id: Store Id
+    :param cursor: Cursor from a previous page, empty for the first page
+    :param q: Query parameter
+    :param count: Count strategy, none when not set
+    :param fields: Item fields to select, all of them when not set
+    :return: The items, the next page url and the total
+    """
+    strategy = count_strategy(count, 'none')
+    query = StoreItem.user_item_rows(user_id, store_id, fields)
+    cache_key = ('items', int(store_id))
+    if q:
+        query = query.filter(name_contains(StoreItem.name, q))
+        cache_key = None
+    total = count_rows(query, strategy, cache_key)
+    if cursor:
+        item_id, = decode_cursor('items:' + str(store_id), cursor)
+        query = query.filter(StoreItem.id < item_id)
+    items, has_next = keyset_page(query.order_by(StoreItem.id.desc()), app.config['STORE_AND_ITEMS_PER_PAGE'])
+    nex = None
+    if has_next:
+        next_cursor = encode_cursor('items:' + str(store_id), [items[-1].id])
+        if q:
+            nex = url_for('items.get_items', q=q, store_id=store_id, cursor=next_cursor, count=count,
+                          fields=fields_param(fields), _external=True)
+        else:
+            nex = url_for('items.get_items', store_id=store_id, cursor=next_cursor, count=count,
+                          fields=fields_param(fields), _external=True)
+    return items, nex, total
+
+
+def search_items(user_id, store_id, terms, page, count=None, fields=None):
+    """
+    Full text search over the names and descriptions of the items in the user's store.
+    Results are ranked by relevance and paginated like the item list.
+    :param user_id: User Id
+    :param store_id: Store Id
+    :param terms: Search terms
+    :param page: Page number
+    :param count: Count strategy, exact when not set
+    :param fields: Item fields to select, all of them when not set
+    :return: Item rows with rank, name_highlight and description_highlight columns, next url, pagination
+    and previous url
+    """
+    strategy = count_strategy(count)
+    query = ranked_item_search(StoreItem.user_item_rows(user_id, store_id, fields), StoreItem, terms)
+    count_query = item_search_count_query(StoreItem.user_item_rows(user_id, store_id, fields), StoreItem, terms)
+    pagination = offset_page(query, page, app.config['STORE_AND_ITEMS_PER_PAGE'], strategy,
+                             count_query=count_query)
+    previous = None
+    if pagination.has_prev:
+        previous = url_for('items.get_items', search=terms, store_id=store_id, page=page - 1, count=count,
+                           fields=fields_param(fields), _external=True)
+    nex = None
+    if pagination.has_next:
+        nex = url_for('items.get_items', search=terms, store_id=store_id, page=page + 1, count=count,
+                      fields=fields_param(fields), _external=True)
     return pagination.items, nex, pagination, previous
+
+
+def get_search_result_json_list(rows, fields=None):
+    """
+    Json representation of full text search results. Highlights are only shown for the
+    name and description when they are among the fields.
+    :param rows: Item rows with rank, name_highlight and description_highlight columns
+    :param fields: Item fields shown, all of them when not set
+    :return:
+    """
+    item_json = StoreItem.fieldset.serializer(fields)
+    fields = fields or StoreItem.fieldset.all
+    results = []
+    for row in rows:
+        result = item_json(row)
+        result['rank'] = float(row.rank)
+        result['highlight'] = {}
+        if 'name' in fields:
+            result['highlight']['name'] = highlight_html(row.name_highlight)
+        if 'description' in fields:
+            result['highlight']['description'] = highlight_html(row.description_highlight)
+        results.append(result)
+    return results
+
+
+class ImportRowError(Exception):
+    """
+    Raised for an imported row that cannot become an item.
+    """
+    pass
+
+
+def import_row(data):
+    """
+    Validate one imported row.
+    :param data: Parsed row
+    :return: dict with the item name and description
+    """
+    if not isinstance(data, dict):
+        raise ImportRowError('Row must be an object')
+    name = data.get('name')
+    description = data.get('description') or None
+    if not name or not isinstance(name, str):
+        raise ImportRowError('No name or value attribute found')
+    if len(name) > 255:
+        raise ImportRowError('Name is longer than 255 characters')
+    if description is not None and not isinstance(description, str):
+        raise ImportRowError('Description must be a string')
+    return {'name': name.lower(), 'description': description}
+
+
+def bounded_lines(stream, limit):
+    """
+    Read a body line by line with bounded reads, so a line longer than the limit is never held
+    in memory whole. The rest of such a line is read and dropped.
+    :param stream: Request body stream
+    :param limit: Most bytes in a line, its newline aside
+    :return: Generator of lines, None in place of a line longer than the limit
+    """
+    while True:
+        line = stream.readline(limit + 1)
+        if not line:
+            return
+        if len(line) > limit and not line.endswith(b'\n'):
+            while line and not line.endswith(b'\n'):
+                line = stream.readline(limit + 1)
+            yield None
+        else:
+            yield line
+
+
+def line_too_long():
+    """
+    Row error of a line longer than ITEM_IMPORT_MAX_LINE_BYTES.
+    :return: ImportRowError
+    """
+    return ImportRowError('Line is longer than {} bytes'.format(app.config['ITEM_IMPORT_MAX_LINE_BYTES']))
+
+
+def ndjson_rows(stream):
+    """
+    Parse a newline delimited json body line by line as it is read.
+    :param stream: Request body stream
+    :return: Generator of (line number, row or ImportRowError)
+    """
+    for line_number, line in enumerate(bounded_lines(stream, app.config['ITEM_IMPORT_MAX_LINE_BYTES']), 1):
+        if line is None:
+            yield line_number, line_too_long()
+            continue
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield line_number, import_row(loads(line))
+        except ValueError:
+            yield line_number, ImportRowError('Invalid json')
+        except ImportRowError as error:
+            yield line_number, error
+
+
+def decoded_lines(stream):
+    """
+    Decoded lines of a csv body. A line longer than ITEM_IMPORT_MAX_LINE_BYTES may be part of a
+    quoted field, so it ends the import instead of being skipped.
+    :param stream: Request body stream
+    :return: Generator of lines
+    """
+    for line in bounded_lines(stream, app.config['ITEM_IMPORT_MAX_LINE_BYTES']):
+        if line is None:
+            raise line_too_long()
+        yield line.decode('utf-8')
+
+
+def csv_rows(stream):
+    """
+    Parse a csv body with a name,description header row as it is read.
+    :param stream: Request body stream
+    :return: Generator of (line number, row or ImportRowError)
+    """
+    reader = csv.DictReader(decoded_lines(stream))
+    try:
+        for data in reader:
+            try:
+                yield reader.line_num, import_row(data)
+            except ImportRowError as error:
+                yield reader.line_num, error
+    except (csv.Error, UnicodeDecodeError) as error:
+        yield reader.line_num, ImportRowError('Invalid csv: {}'.format(error))
+    except ImportRowError as error:
+        yield reader.line_num + 1, error
+
+
+def import_items(store_id, rows):
+    """
+    Insert parsed rows into a store in chunks, so only one chunk is ever held in memory.
+    :param store_id: Store Id
+    :param rows: Generator of (line number, row or ImportRowError)
+    :return: Import report
+    """
+    chunk_size = app.config['ITEM_IMPORT_CHUNK_SIZE']
+    max_errors = app.config['ITEM_IMPORT_MAX_ERRORS']
+    started = time.time()
+    imported = 0
+    failed = 0
+    errors = []
+    chunk = []
+    for line_number, row in rows:
+        if isinstance(row, ImportRowError):
+            failed += 1
+            if len(errors) < max_errors:
+                errors.append({'line': line_number, 'message': str(row)})
+            continue
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            StoreItem.bulk_insert(store_id, chunk)
+            imported += len(chunk)
+            chunk = []
+    if chunk:
+        StoreItem.bulk_insert(store_id, chunk)
+        imported += len(chunk)
+    seconds = time.time() - started
+    return {
+        'imported': imported,
+        'failed': failed,
+        'errors': errors,
+        'seconds': round(seconds, 3),
+        'rowsPerSecond': round(imported / seconds, 1) if seconds else float(imported)
+    }
+
+
+def export_rows(user_id, store_id, fields=None):
+    """
+    Read the items of the user's store from a server side cursor, a batch at a time,
+    as plain rows rather than model instances.
+    :param user_id: User Id
+    :param store_id: Store Id
+    :param fields: Item fields to select, all of them when not set
+    :return: Iterable of item rows
+    """
+    return StoreItem.user_item_rows(user_id, store_id, fields) \
+        .order_by(StoreItem.id) \
+        .execution_options(stream_results=True) \
+        .yield_per(app.config['ITEM_EXPORT_BATCH_SIZE'])
+
+
+def export_values(item_json):
+    """
+    Csv values of an exported item, datetimes written like datetime.isoformat() as the json encoder does.
+    :param item_json: dict made by the item serializer
+    :return: List of values
+    """
+    return [value.isoformat() if isinstance(value, datetime.datetime) else value for value in item_json.values()]
+
+
+def ndjson_lines(rows, fields=None):
+    """
+    One json object per item and line, with the keys of StoreItem.json() or the requested fields.
+    :param rows: Export rows
+    :param fields: Item fields written, all of them when not set
+    :return: Generator of encoded lines
+    """
+    item_json = StoreItem.fieldset.serializer(fields)
+    for row in rows:
+        yield dumps(item_json(row)) + b'\n'
+
+
+def csv_lines(rows, fields=None):
+    """
+    A header line followed by one csv line per item.
+    :param rows: Export rows
+    :param fields: Item fields written, all of them when not set
+    :return: Generator of encoded lines
+    """
+    item_json = StoreItem.fieldset.serializer(fields)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields or StoreItem.fieldset.all)
+    for row in rows:
+        writer.writerow(export_values(item_json(row)))
+        if buffer.tell() >= 65536:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def encoded_chunks(lines, size=65536):
+    """
+    Join lines into chunks of about size bytes so each write to the client carries many rows.
+    :param lines: Generator of bytes
+    :param size: Chunk size
+    :return: Generator of bytes
+    """
+    parts = []
+    buffered = 0
+    for line in lines:
+        parts.append(line)
+        buffered += len(line)
+        if buffered >= size:
+            yield b''.join(parts)
+            parts = []
+            buffered = 0
+    if parts:
+        yield b''.join(parts)
+
@@ -1,9 +1,15 @@
-from flask import Blueprint, request, abort
+from flask import Blueprint, Response, request, abort, stream_with_context
+from app.encoding import json_response, request_json
 from app.auth.utils import token_required
-from app.storeitems.utils import store_required, response, get_user_store, response_with_store_item, \
-    response_with_pagination, get_paginated_items
+from app.storeitems.utils import store_required, response, response_with_store_item, response_with_pagination, \
+    get_paginated_items, get_items_by_cursor, search_items, get_search_result_json_list, ndjson_rows, csv_rows, \
+    import_items, export_rows, ndjson_lines, csv_lines, encoded_chunks
+from app.pagination import InvalidCursor, InvalidCountStrategy
+from app.fields import InvalidFields
+from app.etags import page_etag, conditional_response
+from app.cache import response_cache, cached_response, store_list_tag, item_list_tag
 from sqlalchemy import exc
-from app.models import StoreItem
+from app.models import Store, StoreItem
 
 storeitems = Blueprint('items', __name__)
 
@@ -11,32 +17,64 @@ storeitems = Blueprint('items', __name__)
 @storeitems.route('/storelists/<store_id>/items/', methods=['GET'])
 @token_required
 @store_required
+@cached_response(lambda current_user, store_id: [item_list_tag(store_id)])
 def get_items(current_user, store_id):
     """
     A user`s items belonging to a Store specified by the store_id are returned if the Store Id
     is valid and belongs to the user.
     An empty item list is returned if the store has no items.
+    The search parameter runs a ranked full text search over item names and descriptions.
+    The fields parameter, such as id,name, limits the items to the listed fields and only
+    their columns are read.
+    A 304 is returned without a body when the If-None-Match header holds the page ETag.
     :param current_user: User
     :param store_id: Store Id
     :return: List of Items
     """
-    # Get the user Store
-    store = get_user_store(current_user, store_id)
-    if store is None:
-        return response('failed', 'Store not found', 404)
-
-    # Get items in the store
     page = request.args.get('page', 1, type=int)
     q = request.args.get('q', None, type=str)
-    items, nex, pagination, previous = get_paginated_items(store, store_id, page, q)
+    count = request.args.get('count', None, type=str)
+    search = request.args.get('search', None, type=str)
+
+    try:
+        fields = StoreItem.fieldset.parse(request.args.get('fields', None, type=str))
+        # Ranked full text search over names and descriptions
+        if search and search.strip():
+            rows, nex, pagination, previous = search_items(current_user.id, store_id, search.strip(), page, count,
+                                                           fields)
+            if not rows and Store.get_user_store_row(current_user.id, store_id) is None:
+                return response('failed', 'Store not found', 404)
+            return conditional_response(page_etag(rows, pagination.total),
+                                        lambda: response_with_pagination(get_search_result_json_list(rows, fields),
+                                                                         previous, nex, pagination.total))
+        # Cursor pagination when a cursor parameter is sent, empty for the first page
+        if 'cursor' in request.args:
+            previous = None
+            items, nex, total = get_items_by_cursor(current_user.id, store_id, request.args['cursor'], q, count,
+                                                    fields)
+        else:
+            items, nex, pagination, previous = get_paginated_items(current_user.id, store_id, page, q, count, fields)
+            total = pagination.total
+    except InvalidCursor:
+        return response('failed', 'Invalid pagination cursor', 400)
+    except InvalidCountStrategy:
+        return response('failed', 'Invalid count option, use exact, estimated or none', 400)
+    except InvalidFields:
+        return response('failed', 'Invalid fields option, list fields of the resource separated by commas', 400)
+
+    # An empty result needs telling apart from a Store the user does not own
+    if not items and Store.get_user_store_row(current_user.id, store_id) is None:
+        return response('failed', 'Store not found', 404)
 
     # Make a list of items
-    if items:
+    def items_response():
+        item_json = StoreItem.fieldset.serializer(fields)
         result = []
         for item in items:
-            result.append(item.json())
-        return response_with_pagination(result, previous, nex, pagination.total)
-    return response_with_pagination([], previous, nex, 0)
+            result.append(item_json(item))
+        return response_with_pagination(result, previous, nex, total)
+
+    return conditional_response(page_etag(items, total), items_response)
 
 
 @storeitems.route('/storelists/<store_id>/items/<item_id>/', methods=['GET'])
@@ -46,6 +84,7 @@ def get_item(current_user, store_id, item_id):
     """
     An item can be returned from the Store if the item and Store exist and below to the user.
     The Store and Item Ids must be valid.
+    The fields parameter limits the item to the listed fields.
     :param current_user: User
     :param store_id: Store Id
     :param item_id: Item Id
@@ -57,16 +96,18 @@ def get_item(current_user, store_id, item_id):
     except ValueError:
         return response('failed', 'Provide a valid item Id', 202)
 
-    # Get the user Store
-    store = get_user_store(current_user, store_id)
-    if store is None:
-        return response('failed', 'User has no Store with Id ' + store_id, 404)
+    try:
+        fields = StoreItem.fieldset.parse(request.args.get('fields', None, type=str))
+    except InvalidFields:
+        return response('failed', 'Invalid fields option, list fields of the resource separated by commas', 400)
 
-    # Delete the item from the store
-    item = store.items.filter_by(id=item_id).first()
+    # Get the item from the user Store
+    item = StoreItem.get_user_item_row(current_user.id, store_id, item_id, fields)
     if not item:
+        if Store.get_user_store_row(current_user.id, store_id) is None:
+            return response('failed', 'User has no Store with Id ' + store_id, 404)
         abort(404)
-    return response_with_store_item('success', item, 200)
+    return conditional_response(page_etag([item]), lambda: response_with_store_item('success', item, 200, fields))
 
 
 @storeitems.route('/storelists/<store_id>/items/', methods=['POST'])
@@ -82,20 +123,83 @@ def post(current_user, store_id):
     if not request.content_type == 'application/json':
         return response('failed', 'Content-type must be application/json', 401)
 
-    data = request.get_json()
+    data = request_json()
     item_name = data.get('name')
     if not item_name:
         return response('failed', 'No name or value attribute found', 401)
 
-    # Get the user Store
-    store = get_user_store(current_user, store_id)
+    # Save the Store Item into the user Store, the insert is scoped by the owner
+    item = StoreItem.create(current_user.id, int(store_id), item_name.lower(), data.get('description', None))
+    if item is None:
+        return response('failed', 'User has no Store with Id ' + store_id, 202)
+    # Item counts and embedded items show up in the store lists
+    response_cache.evict(item_list_tag(store_id), store_list_tag(current_user.id))
+    return response_with_store_item('success', item, 200)
+
+
+@storeitems.route('/storelists/<store_id>/items/import', methods=['POST'])
+@token_required
+@store_required
+def import_store_items(current_user, store_id):
+    """
+    Import items into a Store from an application/x-ndjson or text/csv body.
+    The body is parsed as it is read and inserted in chunks, rows that cannot be imported
+    are reported by line number.
+    :param current_user: User
+    :param store_id: Store Id
+    :return: Import report
+    """
+    if request.mimetype == 'application/x-ndjson':
+        parse = ndjson_rows
+    elif request.mimetype == 'text/csv':
+        parse = csv_rows
+    else:
+        return response('failed', 'Content-type must be application/x-ndjson or text/csv', 401)
+
+    store = Store.get_user_store(current_user.id, store_id)
     if store is None:
         return response('failed', 'User has no Store with Id ' + store_id, 202)
 
-    # Save the Store Item into the Database
-    item = StoreItem(item_name.lower(), data.get('description', None), store.id)
-    item.save()
-    return response_with_store_item('success', item, 200)
+    store_id = store.id
+    report = import_items(store_id, parse(request.stream))
+    response_cache.evict(item_list_tag(store_id), store_list_tag(current_user.id))
+    report['status'] = 'success'
+    return json_response(report), 200
+
+
+@storeitems.route('/storelists/<store_id>/items/export', methods=['GET'])
+@token_required
+@store_required
+def export_store_items(current_user, store_id):
+    """
+    Stream every item of a Store as ndjson or csv, picked with the format parameter.
+    Rows are read from a server side cursor and written out as they arrive, the compression
+    middleware compresses the stream when the client accepts it. The fields parameter limits
+    the columns exported.
+    :param current_user: User
+    :param store_id: Store Id
+    :return: Streamed Http Response
+    """
+    export_format = request.args.get('format', 'ndjson', type=str)
+    if export_format == 'ndjson':
+        lines, mimetype = ndjson_lines, 'application/x-ndjson'
+    elif export_format == 'csv':
+        lines, mimetype = csv_lines, 'text/csv'
+    else:
+        return response('failed', 'Invalid format, use ndjson or csv', 400)
+    try:
+        fields = StoreItem.fieldset.parse(request.args.get('fields', None, type=str))
+    except InvalidFields:
+        return response('failed', 'Invalid fields option, list fields of the resource separated by commas', 400)
+
+    if Store.get_user_store(current_user.id, store_id) is None:
+        return response('failed', 'User has no Store with Id ' + store_id, 404)
+
+    chunks = encoded_chunks(lines(export_rows(current_user.id, store_id, fields), fields))
+    headers = {
+        'Content-Disposition': 'attachment; filename=store-{}-items.{}'.format(int(store_id), export_format)
+    }
+    return Response(stream_with_context(chunks), mimetype=mimetype, headers=headers)
 
 
 @storeitems.route('/storelists/<store_id>/items/<item_id>/', methods=['PUT'])
@@ -119,29 +223,23 @@ def edit_item(current_user, store_id, item_id):
     except ValueError:
         return response('failed', 'Provide a valid item Id', 202)
 
-    # Get the user Store
-    store = get_user_store(current_user, store_id)
-    if store is None:
-        return response('failed', 'User has no Store with Id ' + store_id, 202)
-
-    # Get the item
-    item = store.items.filter_by(id=item_id).first()
-    if not item:
-        abort(404)
-
     # Check for Json data
-    request_json_data = request.get_json()
-    item_new_name = request_json_data.get('name')
-    item_new_description = request_json_data.get('description', None)
-
+    request_json_data = request_json()
     if not request_json_data:
         return response('failed', 'No attributes specified in the request', 401)
 
+    item_new_name = request_json_data.get('name')
+    item_new_description = request_json_data.get('description', None)
     if not item_new_name:
         return response('failed', 'No name or value attribute found', 401)
 
-    # Update the item record
-    item.update(item_new_name, item_new_description)
+    # Update the item record, the update is scoped by the owner
+    item = StoreItem.edit(current_user.id, int(store_id), int(item_id), item_new_name, item_new_description)
+    if not item:
+        if Store.get_user_store(current_user.id, store_id) is None:
+            return response('failed', 'User has no Store with Id ' + store_id, 202)
+        abort(404)
+    response_cache.evict(item_list_tag(store_id), store_list_tag(current_user.id))
     return response_with_store_item('success', item, 200)
 
 
@@ -162,16 +260,12 @@ def delete(current_user, store_id, item_id):
     except ValueError:
         return response('failed', 'Provide a valid item Id', 202)
 
-    # Get the user Store
-    store = get_user_store(current_user, store_id)
-    if store is None:
-        return response('failed', 'User has no Store with Id ' + store_id, 202)
-
-    # Delete the item from the store
-    item = store.items.filter_by(id=item_id).first()
-    if not item:
+    # Delete the item from the user Store
+    if not StoreItem.delete_owned(current_user.id, int(store_id), int(item_id)):
+        if Store.get_user_store(current_user.id, store_id) is None:
+            return response('failed', 'User has no Store with Id ' + store_id, 202)
         abort(404)
-    item.delete()
+    response_cache.evict(item_list_tag(store_id), store_list_tag(current_user.id))
     return response('success', 'Successfully deleted the item from store with Id ' + store_id, 200)
 
 
@@ -1,5 +1,11 @@
 from app import app
+from flask import abort
+from functools import wraps
+from app.auth.utils import token_required
+from app.cache import response_cache
+from app.auth.hashing import password_hasher
 from app.storeitems.utils import response
+from app.encoding import json_response
 
 
 @app.errorhandler(404)
@@ -30,3 +36,51 @@ def internal_server_error(e):
     :return:
     """
     return response('failed', 'Internal server error', 500)
+
+
+def stats_endpoint(f):
+    """
+    Answer with 404 unless the stats endpoints are enabled in the configuration.
+    :param f: View function
+    :return:
+    """
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not app.config['STATS_ENDPOINTS_ENABLED']:
+            abort(404)
+        return f(*args, **kwargs)
+
+    return decorated_function
+
+
+@app.route('/v1/hasher/stats', methods=['GET'])
+@stats_endpoint
+@token_required
+def hasher_stats(current_user):
+    """
+    Report the queue depth and hash latency of the password hashing pool in the worker
+    serving the request.
+    :param current_user: User
+    :return: Http Response
+    """
+    return json_response({
+        'status': 'success',
+        'passwordHasher': password_hasher.stats()
+    }), 200
+
+
+@app.route('/v1/cache/stats', methods=['GET'])
+@stats_endpoint
+@token_required
+def cache_stats(current_user):
+    """
+    Report the hit ratio of the response cache in the worker serving the request
+    and the memory the cache holds.
+    :param current_user: User
+    :return: Http Response
+    """
+    return json_response({
+        'status': 'success',
+        'responseCache': response_cache.stats()
+    }), 200
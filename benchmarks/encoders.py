@@ -0,0 +1,72 @@
+"""
+Serialization cost of an item list page with each response encoder, against the former
+jsonify of per item dicts with isoformat() calls. No database is needed:
+
+    python -m benchmarks.encoders --items 25 --repeat 2000
+"""
+from app.encoding import StdlibEncoder, OrjsonEncoder, orjson
+from app.models import StoreItem
+import argparse
+import datetime
+import json
+import timeit
+
+
+def make_items(count):
+    now = datetime.datetime.utcnow()
+    items = []
+    for n in range(count):
+        item = StoreItem('item {}'.format(n), 'Description of item {}'.format(n), 1)
+        item.id = n + 1
+        item.create_at = item.modified_at = now
+        items.append(item)
+    return items
+
+
+def isoformat_json(item):
+    """
+    The per item dict built before the encoder layer.
+    """
+    return {
+        'id': item.id,
+        'name': item.name,
+        'description': item.description,
+        'storeId': item.store_id,
+        'createdAt': item.create_at.isoformat(),
+        'modifiedAt': item.modified_at.isoformat()
+    }
+
+
+def page(items, serialize):
+    return {'status': 'success', 'previous': None, 'next': None, 'count': len(items),
+            'items': [serialize(item) for item in items]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=25, help='Items per page')
+    parser.add_argument('--repeat', type=int, default=2000, help='Pages encoded per measurement')
+    args = parser.parse_args()
+
+    items = make_items(args.items)
+    cases = [
+        ('isoformat dicts + json', lambda: json.dumps(page(items, isoformat_json)).encode('utf-8')),
+        ('serializer + stdlib', lambda: StdlibEncoder.dumps(page(items, StoreItem.row_json))),
+    ]
+    if orjson is not None:
+        cases.append(('serializer + orjson', lambda: OrjsonEncoder.dumps(page(items, StoreItem.row_json))))
+    body = StdlibEncoder.dumps(page(items, StoreItem.row_json))
+    cases.append(('parse with stdlib', lambda: StdlibEncoder.loads(body)))
+    if orjson is not None:
+        cases.append(('parse with orjson', lambda: OrjsonEncoder.loads(body)))
+    else:
+        print('orjson is not installed, only the standard library encoder is measured')
+
+    print('{:<26} {:>14}'.format('case', 'us per page'))
+    for name, case in cases:
+        seconds = min(timeit.repeat(case, number=args.repeat, repeat=3))
+        print('{:<26} {:>14.1f}'.format(name, seconds / args.repeat * 1e6))
+
+
+if __name__ == '__main__':
+    main()
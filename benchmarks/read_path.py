@@ -0,0 +1,72 @@
+"""
+Time and memory of reading a store's items as StoreItem instances against plain rows.
+Run against a disposable database, it inserts and deletes rows:
+
+    APP_SETTINGS=app.config.DevelopmentConfig python -m benchmarks.read_path --items 1000
+"""
+from app import db
+from app.models import User, Store, StoreItem
+from benchmarks.store_search import benchmark_user
+import argparse
+import datetime
+import time
+import tracemalloc
+
+
+def seed_store(user_id, size):
+    now = datetime.datetime.utcnow()
+    db.session.execute(Store.__table__.insert().values(name='read path', user_id=user_id, item_count=size,
+                                                       create_at=now, modified_at=now))
+    store_id = db.session.query(db.func.max(Store.id)).filter(Store.user_id == user_id).scalar()
+    db.session.execute(StoreItem.__table__.insert(), [
+        {'name': 'item {}'.format(n), 'description': 'Description of item {}'.format(n), 'store_id': store_id,
+         'create_at': now, 'modified_at': now} for n in range(size)])
+    db.session.commit()
+    return store_id
+
+
+def measure(read, repeat):
+    """
+    Best time of a read and the memory held by its result.
+    """
+    timings = []
+    for _ in range(repeat):
+        db.session.expunge_all()
+        started = time.time()
+        read()
+        timings.append((time.time() - started) * 1000)
+    db.session.expunge_all()
+    tracemalloc.start()
+    rows = read()
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return min(timings), held / max(len(rows), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=1000, help='Items in the store')
+    parser.add_argument('--repeat', type=int, default=20, help='Reads timed per path')
+    args = parser.parse_args()
+
+    user_id = benchmark_user()
+    store_id = seed_store(user_id, args.items)
+    paths = [
+        ('StoreItem instances', lambda: [StoreItem.row_json(item) for item in
+                                         StoreItem.user_items(user_id, store_id).all()]),
+        ('item rows', lambda: [StoreItem.row_json(row) for row in StoreItem.user_item_rows(user_id, store_id).all()]),
+    ]
+    print('{:<22} {:>12} {:>16}'.format('path', 'best ms', 'bytes per row'))
+    try:
+        for name, read in paths:
+            milliseconds, per_row = measure(read, args.repeat)
+            print('{:<22} {:>12.2f} {:>16.0f}'.format(name, milliseconds, per_row))
+    finally:
+        StoreItem.query.filter_by(store_id=store_id).delete(synchronize_session=False)
+        Store.query.filter_by(id=store_id).delete(synchronize_session=False)
+        User.query.filter_by(id=user_id).delete(synchronize_session=False)
+        db.session.commit()
+
+
+if __name__ == '__main__':
+    main()
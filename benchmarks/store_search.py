@@ -0,0 +1,99 @@
+"""
+Store name search latency against table size, with and without the search indexes.
+
+Run against a disposable database, it inserts and deletes rows:
+
+    APP_SETTINGS=app.config.DevelopmentConfig python -m benchmarks.store_search --sizes 1000,10000,100000
+"""
+from app import db
+from app.models import User, Store
+from app.search import name_contains
+import argparse
+import datetime
+import random
+import string
+import time
+
+BENCHMARK_EMAIL = 'store-search-benchmark@storemail.com'
+SEARCH_INDEXES = ('ix_stores_name_trgm', 'ix_stores_user_id_name')
+
+
+def random_name():
+    return ''.join(random.choice(string.ascii_lowercase) for _ in range(random.randint(6, 20)))
+
+
+def benchmark_user():
+    user = User.get_by_email(BENCHMARK_EMAIL)
+    if user is None:
+        db.session.execute(User.__table__.insert().values(
+            email=BENCHMARK_EMAIL, password='not-a-password-hash', registered_on=datetime.datetime.now(),
+            token_version=0))
+        db.session.commit()
+        user = User.get_by_email(BENCHMARK_EMAIL)
+    return user.id
+
+
+def grow_stores(user_id, size, batch_size=5000):
+    current = Store.query.filter_by(user_id=user_id).count()
+    while current < size:
+        now = datetime.datetime.utcnow()
+        rows = [{'name': random_name(), 'user_id': user_id, 'create_at': now, 'modified_at': now}
+                for _ in range(min(batch_size, size - current))]
+        db.session.execute(Store.__table__.insert(), rows)
+        db.session.commit()
+        current += len(rows)
+
+
+def time_searches(user_id, terms):
+    timings = []
+    for term in terms:
+        started = time.time()
+        Store.query.filter_by(user_id=user_id).filter(name_contains(Store.name, term)).limit(25).all()
+        timings.append((time.time() - started) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2], timings[int(len(timings) * 0.95) - 1]
+
+
+def time_without_indexes(user_id, terms):
+    """
+    Drop the search indexes inside a transaction, measure, then roll the drop back.
+    """
+    for index in SEARCH_INDEXES:
+        db.session.execute('DROP INDEX IF EXISTS ' + index)
+    try:
+        return time_searches(user_id, terms)
+    finally:
+        db.session.rollback()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000,10000,100000', help='Comma separated store counts')
+    parser.add_argument('--queries', type=int, default=50, help='Searches timed per size')
+    args = parser.parse_args()
+
+    user_id = benchmark_user()
+    # Indexes can only be dropped and restored by a rollback where DDL is transactional
+    transactional_ddl = db.engine.dialect.name == 'postgresql'
+    print('{:>10} {:>16} {:>16} {:>16} {:>16}'.format('stores', 'before p50 ms', 'before p95 ms',
+                                                      'after p50 ms', 'after p95 ms'))
+    try:
+        for size in [int(size) for size in args.sizes.split(',')]:
+            grow_stores(user_id, size)
+            if transactional_ddl:
+                db.session.execute('ANALYZE stores')
+                db.session.commit()
+            terms = [''.join(random.choice(string.ascii_lowercase) for _ in range(3)) for _ in range(args.queries)]
+            before = ['n/a', 'n/a']
+            if transactional_ddl:
+                before = ['{:.2f}'.format(value) for value in time_without_indexes(user_id, terms)]
+            after = ['{:.2f}'.format(value) for value in time_searches(user_id, terms)]
+            print('{:>10} {:>16} {:>16} {:>16} {:>16}'.format(size, *(before + after)))
+    finally:
+        Store.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+        User.query.filter_by(id=user_id).delete(synchronize_session=False)
+        db.session.commit()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,9 @@
-from flask_script import Manager
+from flask_script import Manager, Command, Option
 from flask_migrate import Migrate, MigrateCommand
 from app import app, db, models
-from app.models import User, Store, StoreItem
+from app.models import User, Store, StoreItem, BlackListToken, RefreshToken
+from app.auth.hashing import calibrate_log_rounds
+from app.docs.assets import build_assets
 import unittest
 import coverage
 import os
@@ -45,6 +47,84 @@ def test():
     return 1
 
 
+@manager.option('-b', '--batch-size', dest='batch_size', type=int, default=1000,
+                help='Number of rows deleted per transaction')
+def purge_blacklist(batch_size):
+    """
+    Delete blacklisted tokens that have already expired
+    :param batch_size: Rows deleted per transaction
+    :return:
+    """
+    deleted = BlackListToken.purge_expired(batch_size)
+    print('Deleted {} expired blacklisted tokens'.format(deleted))
+
+
+@manager.option('-b', '--batch-size', dest='batch_size', type=int, default=1000,
+                help='Number of rows deleted per transaction')
+def purge_refresh_tokens(batch_size):
+    """
+    Delete refresh tokens that have already expired
+    :param batch_size: Rows deleted per transaction
+    :return:
+    """
+    deleted = RefreshToken.purge_expired(batch_size)
+    print('Deleted {} expired refresh tokens'.format(deleted))
+
+
+@manager.option('-b', '--batch-size', dest='batch_size', type=int, default=1000,
+                help='Number of logged item writes folded per transaction')
+def fold_item_changes(batch_size):
+    """
+    Fold the logged item writes into the item counts of their stores, run it regularly to keep the log short
+    :param batch_size: Logged item writes folded per transaction
+    :return:
+    """
+    folded = Store.fold_item_changes(batch_size)
+    print('Folded {} item writes into the store item counts'.format(folded))
+
+
+@manager.option('-b', '--batch-size', dest='batch_size', type=int, default=1000,
+                help='Number of stores recounted per transaction')
+def reconcile_item_counts(batch_size):
+    """
+    Recount the items of every store and repair drifted item counts
+    :param batch_size: Stores recounted per transaction
+    :return:
+    """
+    repaired = Store.reconcile_item_counts(batch_size)
+    print('Repaired the item count of {} stores'.format(repaired))
+
+
+@manager.command
+def build_docs_assets():
+    """
+    Write the docs static files under fingerprinted names, with precompressed variants,
+    into DOCS_ASSETS_PATH
+    :return:
+    """
+    manifest = build_assets(os.path.join(app.root_path, 'docs', 'static'), app.config['DOCS_ASSETS_PATH'])
+    print('Built {} docs assets into {}'.format(len(manifest['files']), app.config['DOCS_ASSETS_PATH']))
+
+
+class CalibrateBcrypt(Command):
+    """
+    Benchmark bcrypt and recommend the BCRYPT_LOG_ROUNDS hitting a target verify latency
+    """
+    option_list = (
+        Option('-t', '--target', dest='target_ms', type=int, default=100,
+               help='Target password verification latency in milliseconds'),
+    )
+
+    def run(self, target_ms):
+        rounds, timings = calibrate_log_rounds(target_ms)
+        for cost, milliseconds in timings:
+            print('{:>2} rounds: {:8.1f} ms'.format(cost, milliseconds))
+        print('Set BCRYPT_LOG_ROUNDS={} to verify passwords in about {} ms or less'.format(rounds, target_ms))
+
+
+manager.add_command('calibrate-bcrypt', CalibrateBcrypt())
+
+
 @manager.command
 def dummy():
     # Create a user if they do not exist.
@@ -61,10 +141,9 @@ def dummy():
     for stor in range(1000):
         # Add items to the store
         stor = Store.query.filter_by(id=randint(1, Store.query.count() - 1)).first()
-        item = StoreItem(faker.name.company_name(), faker.lorem_ipsum.word(), buckt.id)
-        db.session.add(item)
+        item = StoreItem(faker.name.company_name(), faker.lorem_ipsum.word(), stor.id)
         try:
-            db.session.commit()
+            item.save()
         except IntegrityError:
             db.session.rollback()
 
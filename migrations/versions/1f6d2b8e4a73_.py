@@ -0,0 +1,29 @@
+"""trigram and owner indexes for store name search
+
+Revision ID: 1f6d2b8e4a73
+Revises: c52a7e93b1f0
+Create Date: 2026-10-18 11:20:05.642871
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '1f6d2b8e4a73'
+down_revision = 'c52a7e93b1f0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_stores_user_id_name', 'stores', ['user_id', 'name'], unique=False)
+    if op.get_bind().dialect.name == 'postgresql':
+        # Lets name LIKE '%q%' use an index instead of scanning every store
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        op.execute('CREATE INDEX ix_stores_name_trgm ON stores USING gin (name gin_trgm_ops)')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('DROP INDEX IF EXISTS ix_stores_name_trgm')
+    op.drop_index('ix_stores_user_id_name', table_name='stores')
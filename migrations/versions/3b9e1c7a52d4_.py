@@ -0,0 +1,77 @@
+"""store blacklisted tokens as digests with their expiry
+
+Revision ID: 3b9e1c7a52d4
+Revises: f7ccc6d5d66d
+Create Date: 2026-10-18 09:12:41.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import base64
+import datetime
+import hashlib
+import json
+
+
+# revision identifiers, used by Alembic.
+revision = '3b9e1c7a52d4'
+down_revision = 'f7ccc6d5d66d'
+branch_labels = None
+depends_on = None
+
+blacklist_token = sa.table(
+    'blacklist_token',
+    sa.column('id', sa.Integer),
+    sa.column('token', sa.String),
+    sa.column('token_hash', sa.String),
+    sa.column('expires_at', sa.DateTime),
+    sa.column('blacklisted_on', sa.DateTime)
+)
+
+
+def token_expiry(token, blacklisted_on):
+    """
+    Read the exp claim without verifying the token, it was verified when it was blacklisted.
+    Fall back to the longest token lifetime when the payload cannot be read.
+    """
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        return datetime.datetime.utcfromtimestamp(json.loads(base64.urlsafe_b64decode(payload))['exp'])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return blacklisted_on + datetime.timedelta(days=31)
+
+
+def upgrade():
+    op.add_column('blacklist_token', sa.Column('token_hash', sa.String(length=64), nullable=True))
+    op.add_column('blacklist_token', sa.Column('expires_at', sa.DateTime(), nullable=True))
+
+    connection = op.get_bind()
+    rows = connection.execute(sa.select([blacklist_token.c.id, blacklist_token.c.token,
+                                         blacklist_token.c.blacklisted_on])).fetchall()
+    for row in rows:
+        connection.execute(
+            blacklist_token.update()
+            .where(blacklist_token.c.id == row.id)
+            .values(token_hash=hashlib.sha256(row.token.encode('utf-8')).hexdigest(),
+                    expires_at=token_expiry(row.token, row.blacklisted_on))
+        )
+
+    op.alter_column('blacklist_token', 'token_hash', nullable=False)
+    op.alter_column('blacklist_token', 'expires_at', nullable=False)
+    op.drop_constraint('blacklist_token_token_key', 'blacklist_token', type_='unique')
+    op.drop_column('blacklist_token', 'token')
+    op.create_unique_constraint('blacklist_token_token_hash_key', 'blacklist_token', ['token_hash'])
+    op.create_index(op.f('ix_blacklist_token_expires_at'), 'blacklist_token', ['expires_at'], unique=False)
+
+
+def downgrade():
+    # The raw tokens cannot be recovered, the digests take their place
+    op.add_column('blacklist_token', sa.Column('token', sa.String(length=255), nullable=True))
+    op.execute(blacklist_token.update().values(token=blacklist_token.c.token_hash))
+    op.alter_column('blacklist_token', 'token', nullable=False)
+    op.drop_index(op.f('ix_blacklist_token_expires_at'), table_name='blacklist_token')
+    op.drop_constraint('blacklist_token_token_hash_key', 'blacklist_token', type_='unique')
+    op.drop_column('blacklist_token', 'expires_at')
+    op.drop_column('blacklist_token', 'token_hash')
+    op.create_unique_constraint('blacklist_token_token_key', 'blacklist_token', ['token'])
@@ -0,0 +1,31 @@
+"""owner and sort indexes on stores and storeitems
+
+Revision ID: 5e8a1d3c7b92
+Revises: 9a2c4e6f8b10
+Create Date: 2026-10-18 12:41:17.208364
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e8a1d3c7b92'
+down_revision = '9a2c4e6f8b10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_stores_user_id_id', 'stores', ['user_id', 'id'], unique=False)
+    op.create_index('ix_stores_user_id_create_at_id', 'stores', ['user_id', 'create_at', 'id'], unique=False)
+    op.create_index('ix_storeitems_store_id_create_at_id', 'storeitems',
+                    ['store_id', sa.text('create_at DESC'), 'id'], unique=False)
+    op.create_index('ix_storeitems_store_id_id', 'storeitems', ['store_id', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_storeitems_store_id_id', table_name='storeitems')
+    op.drop_index('ix_storeitems_store_id_create_at_id', table_name='storeitems')
+    op.drop_index('ix_stores_user_id_create_at_id', table_name='stores')
+    op.drop_index('ix_stores_user_id_id', table_name='stores')
@@ -0,0 +1,74 @@
+"""full text search over item names and descriptions
+
+Revision ID: 9a2c4e6f8b10
+Revises: 1f6d2b8e4a73
+Create Date: 2026-10-18 12:03:44.905712
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '9a2c4e6f8b10'
+down_revision = '1f6d2b8e4a73'
+branch_labels = None
+depends_on = None
+
+# The statements are copied from app.search as they were at this revision, so later changes
+# to the application cannot change what this migration does
+POSTGRES_ITEM_SEARCH_DDL = (
+    "ALTER TABLE storeitems ADD COLUMN search_vector tsvector",
+    """CREATE OR REPLACE FUNCTION storeitems_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := setweight(to_tsvector('english', coalesce(NEW.name, '')), 'A') ||
+                         setweight(to_tsvector('english', coalesce(NEW.description, '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql""",
+    """CREATE TRIGGER storeitems_search_vector_trigger BEFORE INSERT OR UPDATE OF name, description
+ON storeitems FOR EACH ROW EXECUTE PROCEDURE storeitems_search_vector_update()""",
+    "CREATE INDEX ix_storeitems_search_vector ON storeitems USING gin (search_vector)",
+)
+
+SQLITE_ITEM_SEARCH_DDL = (
+    "CREATE VIRTUAL TABLE storeitems_fts USING fts5(name, description, content='storeitems', content_rowid='id')",
+    """CREATE TRIGGER storeitems_fts_insert AFTER INSERT ON storeitems BEGIN
+    INSERT INTO storeitems_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+END""",
+    """CREATE TRIGGER storeitems_fts_delete AFTER DELETE ON storeitems BEGIN
+    INSERT INTO storeitems_fts(storeitems_fts, rowid, name, description)
+    VALUES ('delete', old.id, old.name, old.description);
+END""",
+    """CREATE TRIGGER storeitems_fts_update AFTER UPDATE ON storeitems BEGIN
+    INSERT INTO storeitems_fts(storeitems_fts, rowid, name, description)
+    VALUES ('delete', old.id, old.name, old.description);
+    INSERT INTO storeitems_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+END""",
+)
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        for statement in POSTGRES_ITEM_SEARCH_DDL:
+            op.execute(statement)
+        op.execute("UPDATE storeitems SET search_vector = "
+                   "setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+                   "setweight(to_tsvector('english', coalesce(description, '')), 'B')")
+    elif dialect == 'sqlite':
+        for statement in SQLITE_ITEM_SEARCH_DDL:
+            op.execute(statement)
+        op.execute("INSERT INTO storeitems_fts(storeitems_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute('DROP INDEX IF EXISTS ix_storeitems_search_vector')
+        op.execute('DROP TRIGGER IF EXISTS storeitems_search_vector_trigger ON storeitems')
+        op.execute('DROP FUNCTION IF EXISTS storeitems_search_vector_update()')
+        op.execute('ALTER TABLE storeitems DROP COLUMN search_vector')
+    elif dialect == 'sqlite':
+        for trigger in ('storeitems_fts_insert', 'storeitems_fts_delete', 'storeitems_fts_update'):
+            op.execute('DROP TRIGGER IF EXISTS ' + trigger)
+        op.execute('DROP TABLE IF EXISTS storeitems_fts')
@@ -0,0 +1,25 @@
+"""denormalized item count on stores
+
+Revision ID: b7d3f0e96a15
+Revises: 5e8a1d3c7b92
+Create Date: 2026-10-18 13:05:52.471930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d3f0e96a15'
+down_revision = '5e8a1d3c7b92'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('stores', sa.Column('item_count', sa.Integer(), nullable=False, server_default='0'))
+    op.execute('UPDATE stores SET item_count = (SELECT count(*) FROM storeitems WHERE storeitems.store_id = stores.id)')
+
+
+def downgrade():
+    op.drop_column('stores', 'item_count')
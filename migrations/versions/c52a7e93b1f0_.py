@@ -0,0 +1,24 @@
+"""user token version
+
+Revision ID: c52a7e93b1f0
+Revises: 8d41f0a6c2e9
+Create Date: 2026-10-18 10:41:53.118260
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c52a7e93b1f0'
+down_revision = '8d41f0a6c2e9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('token_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    op.drop_column('users', 'token_version')
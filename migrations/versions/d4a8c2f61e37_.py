@@ -0,0 +1,37 @@
+"""append only log of item writes for the store item count
+
+Revision ID: d4a8c2f61e37
+Revises: b7d3f0e96a15
+Create Date: 2026-10-18 21:14:37.208519
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4a8c2f61e37'
+down_revision = 'b7d3f0e96a15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('store_item_changes',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('store_id', sa.Integer(), nullable=False),
+    sa.Column('delta', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sqlite_autoincrement=True
+    )
+    op.create_index('ix_store_item_changes_store_id_id', 'store_item_changes', ['store_id', 'id'], unique=False)
+    op.add_column('stores', sa.Column('items_version', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    # Fold the logged writes back into the stored counts before the log is dropped
+    op.execute('UPDATE stores SET item_count = item_count + (SELECT coalesce(sum(delta), 0) FROM store_item_changes '
+               'WHERE store_item_changes.store_id = stores.id)')
+    op.drop_column('stores', 'items_version')
+    op.drop_index('ix_store_item_changes_store_id_id', table_name='store_item_changes')
+    op.drop_table('store_item_changes')
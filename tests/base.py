@@ -1,5 +1,10 @@
 from app import app, db
+from app.auth.cache import token_cache, version_cache
+from app.auth.bloom import blacklist_filter
+from app.pagination import count_cache
+from app.cache import response_cache
 from flask_testing import TestCase
+from flask_sqlalchemy import get_debug_queries
 import json
 
 
@@ -27,6 +32,19 @@ class BaseTestCase(TestCase):
         """
         db.session.remove()
         db.drop_all()
+        token_cache.clear()
+        version_cache.clear()
+        blacklist_filter.reset()
+        count_cache.clear()
+        response_cache.clear()
+
+    @staticmethod
+    def query_count():
+        """
+        Number of queries recorded so far, requests made inside the same client block add up
+        :return: int
+        """
+        return len(get_debug_queries())
 
     def register_user(self, email, password):
         """
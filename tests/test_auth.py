@@ -1,8 +1,15 @@
 from tests.base import BaseTestCase
-from app.models import User
-from app import db
+from app.models import User, RefreshToken
+from app.auth.cache import token_cache, version_cache
+from app.auth.bloom import blacklist_filter, BloomFilter, BlacklistFilter
+from app.auth.hashing import password_hasher, HasherBusy, hash_log_rounds
+from unittest import mock
+from app import app, db, bcrypt
 import unittest
+import datetime
 import json
+import jwt
+import threading
 import time
 
 
@@ -252,14 +259,15 @@ class TestAuthBluePrint(BaseTestCase):
 
     def test_token_required_method_blacklisted_authorization_token(self):
         """
-        Test that the token being used to access a user resource was blacklisted
+        Test that the token being used to access a user resource was blacklisted.
+        Only tokens issued before access tokens existed go through the blacklist.
         :return:
         """
         with self.client:
             # Register and login a user
-            json_response = self.register_and_login_in_user()
+            self.register_and_login_in_user()
             # Logout a user
-            token = json_response['auth_token']
+            token = self.legacy_token()
             self.logout_user(token)
             # Send a Get request to storelists endpoint
             response = self.client.get(
@@ -288,6 +296,295 @@ class TestAuthBluePrint(BaseTestCase):
             self.assertTrue(data['status'] == 'failed')
             self.assertTrue(data['message'] == 'Signature expired, Please sign in again')
 
+    def test_verified_token_is_served_from_the_cache(self):
+        """
+        Test that a second request with the same token is answered from the token cache
+        :return:
+        """
+        with self.client:
+            token = self.register_and_login_in_user()['auth_token']
+            for _ in range(2):
+                response = self.client.get('v1/storelists/', headers=dict(Authorization='Bearer ' + token))
+                self.assertEqual(response.status_code, 200)
+            stats = token_cache.stats()
+            self.assertEqual(stats['misses'], 1)
+            self.assertEqual(stats['hits'], 1)
+
+    def test_logout_invalidates_a_cached_token(self):
+        """
+        Test that a token cached by an earlier request is rejected after logout
+        :return:
+        """
+        with self.client:
+            self.register_and_login_in_user()
+            token = self.legacy_token()
+            response = self.client.get('v1/storelists/', headers=dict(Authorization='Bearer ' + token))
+            self.assertEqual(response.status_code, 200)
+            self.logout_user(token)
+            response = self.client.get('v1/storelists/', headers=dict(Authorization='Bearer ' + token))
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 401)
+            self.assertTrue(data['message'] == 'Token was Blacklisted, Please login In')
+
+    def test_valid_token_is_not_looked_up_in_the_blacklist_table(self):
+        """
+        Test that the blacklist filter answers for tokens that were never blacklisted
+        :return:
+        """
+        with self.client:
+            self.register_and_login_in_user()
+            token = self.legacy_token()
+            response = self.client.get('v1/storelists/', headers=dict(Authorization='Bearer ' + token))
+            self.assertEqual(response.status_code, 200)
+            stats = blacklist_filter.stats()
+            self.assertEqual(stats['lookups'], 1)
+            self.assertEqual(stats['positives'], 0)
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        """
+        Test that every key added to the bloom filter is reported as present
+        :return:
+        """
+        bloom = BloomFilter(1000, 0.01)
+        keys = ['token-' + str(i) for i in range(1000)]
+        for key in keys:
+            bloom.add(key)
+        self.assertTrue(all(key in bloom for key in keys))
+        self.assertLess(bloom.estimated_false_positive_rate(), 0.02)
+
+    def test_stale_blacklist_filter_is_rebuilt_by_one_thread(self):
+        """
+        Test that lookups keep using the current filter while another thread reloads the table
+        :return:
+        """
+        bloom = BlacklistFilter(10, 0.01, 0)
+        bloom.loader = lambda: ['revoked']
+        self.assertTrue(bloom.might_contain('revoked'))
+        loading = threading.Event()
+        release = threading.Event()
+        loads = []
+
+        def slow_loader():
+            loads.append(1)
+            loading.set()
+            release.wait(5)
+            return ['revoked']
+
+        bloom.loader = slow_loader
+        rebuilding = threading.Thread(target=bloom.might_contain, args=('other',))
+        rebuilding.start()
+        self.assertTrue(loading.wait(5))
+        self.assertTrue(bloom.might_contain('revoked'))
+        release.set()
+        rebuilding.join(5)
+        self.assertEqual(len(loads), 1)
+
+    def test_login_returns_503_when_the_password_hasher_is_saturated(self):
+        """
+        Test that a login is turned away instead of queued when the hashing pool is full
+        :return:
+        """
+        with self.client:
+            self.register_user('john@gmail.com', '123456')
+            with mock.patch.object(password_hasher, 'check_password_hash', side_effect=HasherBusy):
+                response = self.login_user('john@gmail.com', '123456')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 503)
+            self.assertTrue(data['status'] == 'failed')
+            self.assertTrue(data['message'] == 'The server is busy, please try again later')
+
+    def test_password_hasher_reports_latency(self):
+        """
+        Test that completed hashes are counted in the hasher metrics
+        :return:
+        """
+        completed = password_hasher.stats()['completed']
+        with self.client:
+            self.register_user('john@gmail.com', '123456')
+        stats = password_hasher.stats()
+        self.assertEqual(stats['completed'], completed + 1)
+        self.assertEqual(stats['queued'], 0)
+        self.assertTrue(stats['maxLatency'] > 0)
+        with self.client:
+            response = self.client.get('v1/hasher/stats', headers=dict(Authorization='Bearer ' + self.get_user_token()))
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(data['passwordHasher']['workers'], self.app.config['PASSWORD_HASHER_WORKERS'])
+
+    def test_password_is_rehashed_at_the_configured_cost_on_login(self):
+        """
+        Test that a password hashed at another cost is rehashed after a successful login
+        :return:
+        """
+        with self.client:
+            self.register_user('john@gmail.com', '123456')
+            user = User.get_by_email('john@gmail.com')
+            user.password = bcrypt.generate_password_hash('123456', 5).decode('utf-8')
+            db.session.commit()
+            response = self.login_user('john@gmail.com', '123456')
+            self.assertEqual(response.status_code, 200)
+            user = User.get_by_email('john@gmail.com')
+            self.assertEqual(hash_log_rounds(user.password), self.app.config['BCRYPT_LOG_ROUNDS'])
+            self.assertEqual(self.login_user('john@gmail.com', '123456').status_code, 200)
+
+    def test_access_token_is_not_checked_against_the_blacklist(self):
+        """
+        Test that access tokens are verified by their signature alone
+        :return:
+        """
+        with self.client:
+            token = self.register_and_login_in_user()['auth_token']
+            response = self.client.get('v1/storelists/', headers=dict(Authorization='Bearer ' + token))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(blacklist_filter.stats()['lookups'], 0)
+
+    def test_refresh_token_is_exchanged_for_new_tokens(self):
+        """
+        Test that a refresh token returns a working access token and is rotated
+        :return:
+        """
+        with self.client:
+            refresh_token = self.register_and_login_in_user()['refresh_token']
+            response = self.refresh(refresh_token)
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(data['status'] == 'success')
+            self.assertTrue(data['message'] == 'Successfully refreshed')
+            self.assertNotEqual(data['refresh_token'], refresh_token)
+            response = self.client.get('v1/storelists/', headers=dict(Authorization='Bearer ' + data['auth_token']))
+            self.assertEqual(response.status_code, 200)
+            # The old refresh token was revoked by the rotation
+            self.assertEqual(self.refresh(refresh_token).status_code, 401)
+
+    def test_refresh_token_is_rotated_once(self):
+        """
+        Test that a refresh token read by two refreshes at once is only replaced by the first
+        :return:
+        """
+        with self.client:
+            refresh_token = self.register_and_login_in_user()['refresh_token']
+            first = RefreshToken.get_active(refresh_token)
+            second = RefreshToken.get_active(refresh_token)
+            self.assertIsNotNone(first.rotate())
+            self.assertIsNone(second.rotate())
+            self.assertEqual(RefreshToken.query.filter(RefreshToken.revoked_on.is_(None)).count(), 1)
+
+    def test_access_token_without_a_session_is_refused_after_logout(self):
+        """
+        Test that an access token issued outside a session stops working once it is logged out
+        :return:
+        """
+        with self.client:
+            self.register_and_login_in_user()
+            user = User.get_by_email('john@gmail.com')
+            token = user.encode_auth_token(user.id)
+            self.assertEqual(self.logout_user(token).status_code, 200)
+            response = self.client.get('v1/storelists/', headers=dict(Authorization='Bearer ' + token))
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 401)
+            self.assertTrue(data['message'] == 'Token was Blacklisted, Please login In')
+
+    def test_refresh_token_is_revoked_on_logout(self):
+        """
+        Test that logging out ends the session the access token belongs to
+        :return:
+        """
+        with self.client:
+            login_data = self.register_and_login_in_user()
+            logout_response = self.logout_user(login_data['auth_token'])
+            self.assertEqual(logout_response.status_code, 200)
+            response = self.refresh(login_data['refresh_token'])
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 401)
+            self.assertTrue(data['status'] == 'failed')
+            self.assertTrue(data['message'] == 'Invalid or expired refresh token, Please sign in again')
+
+    def test_password_reset_revokes_existing_tokens(self):
+        """
+        Test that tokens issued before a password reset are rejected afterwards
+        :return:
+        """
+        with self.client:
+            login_data = self.register_and_login_in_user()
+            token = login_data['auth_token']
+            response = self.client.post(
+                'v1/auth/reset/password',
+                headers=dict(Authorization='Bearer ' + token),
+                content_type='application/json',
+                data=json.dumps(dict(oldPassword='123456', newPassword='098765',
+                                     passwordConfirmation='098765')))
+            self.assertEqual(response.status_code, 200)
+            response = self.client.get('v1/storelists/', headers=dict(Authorization='Bearer ' + token))
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 401)
+            self.assertTrue(data['message'] == 'Token was revoked, Please login In')
+            self.assertEqual(self.refresh(login_data['refresh_token']).status_code, 401)
+
+    def test_cached_token_is_refused_once_its_version_is_revoked(self):
+        """
+        Test that a token cached by this process is refused as soon as the process sees a newer
+        token version, as it does when another worker revokes the tokens
+        :return:
+        """
+        with self.client:
+            token = self.register_and_login_in_user()['auth_token']
+            response = self.client.get('v1/storelists/', headers=dict(Authorization='Bearer ' + token))
+            self.assertEqual(response.status_code, 200)
+            user = User.get_by_email('john@gmail.com')
+            user_id, version = user.id, user.token_version + 1
+            User.query.filter_by(id=user_id).update({User.token_version: version})
+            db.session.commit()
+            version_cache.set(user_id, version)
+            response = self.client.get('v1/storelists/', headers=dict(Authorization='Bearer ' + token))
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 401)
+            self.assertTrue(data['message'] == 'Token was revoked, Please login In')
+
+    def test_logout_of_all_sessions(self):
+        """
+        Test that logging out everywhere revokes the tokens of every session
+        :return:
+        """
+        with self.client:
+            first_session = self.register_and_login_in_user()
+            second_session = json.loads(self.login_user('john@gmail.com', '123456').data.decode())
+            response = self.client.post(
+                'v1/auth/logout/all',
+                headers=dict(Authorization='Bearer ' + first_session['auth_token']))
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(data['message'] == 'Successfully logged out of all sessions')
+            for session in (first_session, second_session):
+                response = self.client.get('v1/storelists/',
+                                           headers=dict(Authorization='Bearer ' + session['auth_token']))
+                self.assertEqual(response.status_code, 401)
+                self.assertEqual(self.refresh(session['refresh_token']).status_code, 401)
+            # A new login still works
+            login_data = json.loads(self.login_user('john@gmail.com', '123456').data.decode())
+            response = self.client.get('v1/storelists/',
+                                       headers=dict(Authorization='Bearer ' + login_data['auth_token']))
+            self.assertEqual(response.status_code, 200)
+
+    def refresh(self, refresh_token):
+        """
+        Helper method to exchange a refresh token
+        :param refresh_token: Refresh token
+        :return:
+        """
+        return self.client.post(
+            'v1/auth/refresh',
+            content_type='application/json',
+            data=json.dumps(dict(refresh_token=refresh_token)))
+
+    def legacy_token(self):
+        """
+        Helper method to sign a token the way they were issued before access tokens, for user 1
+        :return:
+        """
+        now = datetime.datetime.utcnow()
+        payload = {'exp': now + datetime.timedelta(minutes=5), 'iat': now, 'sub': 1}
+        return jwt.encode(payload, app.config['SECRET_KEY'], algorithm='HS256').decode('utf-8')
+
     def register_and_login_in_user(self):
         """
         Helper method to sign up and login a user
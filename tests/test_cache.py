@@ -0,0 +1,57 @@
+from app.cache import MemoryBackend, SQLiteBackend
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+
+class TestResponseCacheBackends(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cache', 'responses.sqlite3')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def backends(self):
+        return [MemoryBackend(10), SQLiteBackend(self.path, 10)]
+
+    def test_entries_are_stored_as_plain_bodies_and_etags(self):
+        """
+        Test that an entry is read back as the body and ETag it was stored with
+        :return:
+        """
+        for backend in self.backends():
+            versions = backend.versions(['stores:1'])
+            self.assertTrue(backend.set('key', b'{"stores": []}', 'abc', ['stores:1'], 60, versions))
+            self.assertEqual(backend.get('key'), (b'{"stores": []}', 'abc'))
+
+    def test_response_built_before_an_eviction_is_not_stored(self):
+        """
+        Test that a response whose tags were evicted while it was built is not cached
+        :return:
+        """
+        for backend in self.backends():
+            versions = backend.versions(['stores:1', 'items:1'])
+            backend.evict(['items:1'])
+            self.assertFalse(backend.set('key', b'stale', None, ['stores:1', 'items:1'], 60, versions))
+            self.assertIsNone(backend.get('key'))
+            versions = backend.versions(['stores:1', 'items:1'])
+            self.assertTrue(backend.set('key', b'fresh', None, ['stores:1', 'items:1'], 60, versions))
+
+    def test_sqlite_file_is_private(self):
+        """
+        Test that the cache file is created private to the user and a shared directory is refused
+        :return:
+        """
+        SQLiteBackend(self.path, 10)
+        self.assertEqual(stat.S_IMODE(os.stat(os.path.dirname(self.path)).st_mode), 0o700)
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+        os.chmod(os.path.dirname(self.path), 0o777)
+        with self.assertRaises(PermissionError):
+            SQLiteBackend(self.path, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
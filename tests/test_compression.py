@@ -0,0 +1,81 @@
+from tests.base import BaseTestCase
+from app.docs.assets import build_assets
+from app.docs.views import assets
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestCompression(BaseTestCase):
+    def test_large_responses_are_compressed(self):
+        """
+        Test that a large body is gzipped for a client accepting gzip and sent as it is otherwise
+        :return:
+        """
+        with self.client:
+            response = self.client.get('/', headers={'Accept-Encoding': 'gzip'})
+            self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+            self.assertIn('Accept-Encoding', response.headers['Vary'])
+            self.assertIn(b'STORES API', gzip.decompress(response.data))
+            response = self.client.get('/')
+            self.assertNotIn('Content-Encoding', response.headers)
+            self.assertIn(b'STORES API', response.data)
+
+    def test_small_responses_are_not_compressed(self):
+        """
+        Test that bodies under COMPRESSION_MIN_SIZE are not compressed
+        :return:
+        """
+        with self.client:
+            response = self.client.get('/v1/missing', headers={'Accept-Encoding': 'gzip'})
+            self.assertEqual(response.status_code, 404)
+            self.assertNotIn('Content-Encoding', response.headers)
+
+    def test_docs_assets_are_fingerprinted_and_precompressed(self):
+        """
+        Test that built docs assets are served under their fingerprint with a precompressed
+        variant and immutable cache headers
+        :return:
+        """
+        folder = tempfile.mkdtemp()
+        previous = assets.folder
+        try:
+            manifest = build_assets(os.path.join(self.app.root_path, 'docs', 'static'), folder)
+            styles = manifest['files']['css/styles.css']
+            self.assertRegex(styles['path'], r'^css/styles\.[0-9a-f]{12}\.css$')
+            self.assertIn('gzip', styles['encodings'])
+            self.assertEqual(manifest['files']['favicon/favicon-16x16.png']['encodings'], [])
+            assets.folder = folder
+            assets.load()
+            with self.client:
+                response = self.client.get('/')
+                self.assertIn(styles['path'].encode(), response.data)
+                response = self.client.get('/assets/' + styles['path'], headers={'Accept-Encoding': 'gzip'})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+                self.assertIn('immutable', response.headers['Cache-Control'])
+                body = gzip.decompress(response.data)
+                response.close()
+                with open(os.path.join(folder, styles['path']), 'rb') as built:
+                    self.assertEqual(body, built.read())
+                # Imports point at the fingerprinted files, which are served next to the stylesheet
+                login = manifest['files']['css/login.css']['path']
+                self.assertIn("@import '{}';".format(login[len('css/'):]).encode(), body)
+                response = self.client.get('/assets/' + login)
+                self.assertEqual(response.status_code, 200)
+                response.close()
+                icons = manifest['files']['favicon/manifest.json']['path']
+                with open(os.path.join(folder, icons)) as built:
+                    self.assertEqual(json.load(built)['icons'][0]['src'],
+                                     manifest['files']['favicon/android-chrome-96x96.png']['path'][len('favicon/'):])
+        finally:
+            assets.folder = previous
+            assets.load()
+            shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+    unittest.main()
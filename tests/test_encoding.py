@@ -0,0 +1,36 @@
+from app.encoding import StdlibEncoder, OrjsonEncoder, orjson
+from app.models import StoreItem
+import datetime
+import unittest
+
+
+class TestEncoding(unittest.TestCase):
+    def item(self):
+        item = StoreItem('food', 'Enjoying the good life', 1)
+        item.id = 1
+        item.create_at = item.modified_at = datetime.datetime(2026, 10, 18, 9, 30, 0, 120000)
+        return item
+
+    def test_items_are_serialized_with_isoformat_datetimes(self):
+        """
+        Test that the compiled item serializer and the encoder write the same json as before
+        :return:
+        """
+        data = StdlibEncoder.loads(StdlibEncoder.dumps(StoreItem.row_json(self.item())))
+        self.assertEqual(data, {'id': 1, 'name': 'food', 'description': 'Enjoying the good life', 'storeId': 1,
+                                'createdAt': '2026-10-18T09:30:00.120000',
+                                'modifiedAt': '2026-10-18T09:30:00.120000'})
+
+    @unittest.skipIf(orjson is None, 'orjson is not installed')
+    def test_encoders_agree(self):
+        """
+        Test that orjson writes the same document as the standard library encoder
+        :return:
+        """
+        data = {'items': [StoreItem.row_json(self.item())], 'count': 1, 'next': None}
+        self.assertEqual(OrjsonEncoder.loads(OrjsonEncoder.dumps(data)),
+                         StdlibEncoder.loads(StdlibEncoder.dumps(data)))
+
+
+if __name__ == '__main__':
+    unittest.main()
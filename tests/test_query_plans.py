@@ -0,0 +1,178 @@
+from tests.base import BaseTestCase
+from app import db
+from app.models import User, Store, StoreItem
+from app.pagination import encode_cursor
+from app.store.utils import paginate_stores, paginate_stores_by_cursor, get_user_store_json_list
+from app.storeitems.utils import get_paginated_items, get_items_by_cursor, search_items, export_rows
+from sqlalchemy import event
+import datetime
+import json
+import unittest
+
+SEED_USERS = 20
+SEED_STORES_PER_USER = 50
+SEED_ITEMS_PER_STORE = 20
+
+
+class TestQueryPlans(BaseTestCase):
+    """
+    Run the list, lookup, search and export helpers against a seeded dataset, EXPLAIN the queries
+    they send and fail when a plan scans a whole table or sorts rows. Sequential scans and sorts are switched off in the
+    planner, so one still shows up only when no index can serve the query.
+    """
+
+    def setUp(self):
+        super(TestQueryPlans, self).setUp()
+        if db.engine.dialect.name != 'postgresql':
+            self.skipTest('Query plans are checked on PostgreSQL')
+        self.seed()
+        db.session.execute('ANALYZE')
+        db.session.execute('SET enable_seqscan = off')
+        db.session.execute('SET enable_sort = off')
+
+    def tearDown(self):
+        # A failed EXPLAIN leaves the transaction aborted, the settings can only be reset after a rollback
+        db.session.rollback()
+        try:
+            db.session.execute('RESET enable_seqscan')
+            db.session.execute('RESET enable_sort')
+        finally:
+            super(TestQueryPlans, self).tearDown()
+
+    def seed(self):
+        """
+        Bulk insert users, each owning stores that hold items.
+        :return:
+        """
+        now = datetime.datetime.utcnow()
+        db.session.execute(User.__table__.insert(), [
+            {'email': 'user{}@storemail.com'.format(n), 'password': 'not-a-password-hash', 'registered_on': now,
+             'token_version': 0} for n in range(SEED_USERS)])
+        user_ids = [user.id for user in User.query.all()]
+        db.session.execute(Store.__table__.insert(), [
+            {'name': 'store{}'.format(n), 'user_id': user_id, 'create_at': now + datetime.timedelta(seconds=n),
+             'modified_at': now} for user_id in user_ids for n in range(SEED_STORES_PER_USER)])
+        store_ids = [store.id for store in Store.query.all()]
+        db.session.execute(StoreItem.__table__.insert(), [
+            {'name': 'item{}'.format(n), 'description': 'Seeded item', 'store_id': store_id,
+             'create_at': now + datetime.timedelta(seconds=n), 'modified_at': now}
+            for store_id in store_ids for n in range(SEED_ITEMS_PER_STORE)])
+        db.session.commit()
+        self.user_id = user_ids[0]
+        self.store = Store.query.filter_by(user_id=self.user_id).order_by(Store.id).first()
+
+    def plans(self, helper):
+        """
+        Run a helper inside a request and EXPLAIN every query it sent to the database, so the
+        plans checked are those of the statements the views really run.
+        :param helper: Function calling the helper
+        :return: Root plan nodes
+        """
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append((statement, parameters))
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            with self.app.test_request_context():
+                helper()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        self.assertTrue(statements, msg='The helper ran no query')
+        plans = []
+        for statement, parameters in statements:
+            plan = db.session.connection().execute('EXPLAIN (FORMAT JSON) ' + statement, parameters).scalar()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            plans.append(plan[0]['Plan'])
+        return plans
+
+    def assertIndexedPlans(self, helper, allowed=()):
+        """
+        Assert that no node of the plans of the queries a helper runs is a sequential scan or a sort.
+        :param helper: Function calling the helper
+        :param allowed: Node types tolerated for this helper
+        :return:
+        """
+        for plan in self.plans(helper):
+            nodes = [plan]
+            while nodes:
+                node = nodes.pop()
+                if node['Node Type'] not in allowed:
+                    self.assertNotIn(node['Node Type'], ('Seq Scan', 'Sort'),
+                                     msg='Unindexed plan: ' + json.dumps(plan, indent=2))
+                nodes.extend(node.get('Plans', []))
+
+    def test_store_ownership_lookup_uses_an_index(self):
+        """
+        Test that reading a single store of the user is served by an index
+        :return:
+        """
+        self.assertIndexedPlans(lambda: Store.get_user_store_row(self.user_id, self.store.id))
+
+    def test_store_page_uses_an_index(self):
+        """
+        Test that an offset page of the store list, with its window count, is served by an index
+        :return:
+        """
+        self.assertIndexedPlans(lambda: paginate_stores(self.user_id, 2, None))
+
+    def test_store_cursor_page_uses_an_index(self):
+        """
+        Test that a cursor page of the store list is served by an index
+        :return:
+        """
+        cursor = encode_cursor('stores', [self.store.create_at, self.store.id])
+        self.assertIndexedPlans(lambda: paginate_stores_by_cursor(self.user_id, cursor, None, 'exact'))
+
+    def test_embedded_items_do_not_scan_the_items(self):
+        """
+        Test that the first items embedded in a store page are found through an index. The rows kept
+        are numbered and sorted, so only sequential scans are looked for.
+        :return:
+        """
+        stores, _, _, _ = paginate_stores(self.user_id, 1, None)
+        self.assertIndexedPlans(lambda: get_user_store_json_list(stores, 3), allowed=('Sort',))
+
+    def test_item_ownership_lookup_uses_an_index(self):
+        """
+        Test that reading a single item of a store of the user is served by an index
+        :return:
+        """
+        item_id = StoreItem.query.filter_by(store_id=self.store.id).first().id
+        self.assertIndexedPlans(lambda: StoreItem.get_user_item_row(self.user_id, self.store.id, item_id))
+
+    def test_item_page_uses_an_index(self):
+        """
+        Test that an offset page of the item list, with its window count, is served by an index
+        :return:
+        """
+        self.assertIndexedPlans(lambda: get_paginated_items(self.user_id, self.store.id, 2, None))
+
+    def test_item_cursor_page_uses_an_index(self):
+        """
+        Test that a cursor page of the item list and its exact count are served by an index
+        :return:
+        """
+        cursor = encode_cursor('items:' + str(self.store.id), [10 ** 6])
+        self.assertIndexedPlans(lambda: get_items_by_cursor(self.user_id, self.store.id, cursor, None, 'exact'))
+
+    def test_item_search_does_not_scan_the_items(self):
+        """
+        Test that a full text search finds the items through the search index. Results are sorted by
+        relevance, so only sequential scans are looked for.
+        :return:
+        """
+        self.assertIndexedPlans(lambda: search_items(self.user_id, self.store.id, 'seeded', 1),
+                                allowed=('Sort',))
+
+    def test_item_export_uses_an_index(self):
+        """
+        Test that the export reads the items of the store in Id order through an index
+        :return:
+        """
+        self.assertIndexedPlans(lambda: list(export_rows(self.user_id, self.store.id)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,7 @@
 from tests.base import BaseTestCase
+from app import db
+from app.models import User, Store, StoreItem
+from app.store.utils import paginate_stores
 import unittest
 import json
 
@@ -365,5 +368,297 @@ class TestStoreBluePrint(BaseTestCase):
             self.assertEqual(response.status_code, 200)
 
 
+    def test_stores_are_paginated_with_a_cursor(self):
+        """
+        Test that cursor pagination walks through all the stores without a count
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            self.create_stores(token)
+            response = self.client.get('v1/storelists/?cursor=', headers=dict(Authorization='Bearer ' + token))
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([store['id'] for store in data['stores']], [1, 2, 3])
+            self.assertEqual(data['count'], None)
+            self.assertEqual(data['previous'], None)
+            self.assertTrue(data['next'].startswith('http://localhost/v1/storelists/?cursor='))
+            response = self.client.get(data['next'], headers=dict(Authorization='Bearer ' + token))
+            data = json.loads(response.data.decode())
+            self.assertEqual([store['id'] for store in data['stores']], [4, 5, 6])
+            self.assertEqual(data['next'], None)
+
+    def test_tampered_cursor_is_rejected(self):
+        """
+        Test that a cursor that was not issued by the api is refused
+        :return:
+        """
+        with self.client:
+            response = self.client.get('v1/storelists/?cursor=WyJzdG9yZXMiLDEwXQ.forged',
+                                       headers=dict(Authorization='Bearer ' + self.get_user_token()))
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 400)
+            self.assertTrue(data['status'] == 'failed')
+            self.assertTrue(data['message'] == 'Invalid pagination cursor')
+
+    def test_count_can_be_skipped_or_estimated(self):
+        """
+        Test the count option of the store list
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            self.create_stores(token)
+            response = self.client.get('v1/storelists/?count=none', headers=dict(Authorization='Bearer ' + token))
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(data['count'], None)
+            self.assertEqual(len(data['stores']), 3)
+            self.assertEqual(data['next'], 'http://localhost/v1/storelists/?page=2&count=none')
+            response = self.client.get('v1/storelists/?count=estimated', headers=dict(Authorization='Bearer ' + token))
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['count'], 6)
+            # The cached total is dropped when a store is created
+            self.create_store(token)
+            response = self.client.get('v1/storelists/?count=estimated', headers=dict(Authorization='Bearer ' + token))
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['count'], 7)
+
+    def test_invalid_count_option(self):
+        """
+        Test that an unknown count option is refused
+        :return:
+        """
+        with self.client:
+            response = self.client.get('v1/storelists/?count=some',
+                                       headers=dict(Authorization='Bearer ' + self.get_user_token()))
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 400)
+            self.assertTrue(data['message'] == 'Invalid count option, use exact, estimated or none')
+
+    def test_exact_count_is_read_with_the_page(self):
+        """
+        Test that the default exact count does not need a separate count query
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            self.create_stores(token)
+            queries = self.query_count()
+            response = self.client.get('v1/storelists/', headers=dict(Authorization='Bearer ' + token))
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['count'], 6)
+            self.assertEqual(self.query_count() - queries, 1)
+
+    def test_search_matches_wildcards_literally(self):
+        """
+        Test that LIKE wildcards in the search term do not match every store
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            self.create_stores(token)
+            response = self.client.get('v1/storelists/?q=%25', headers=dict(Authorization='Bearer ' + token))
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(data['count'], 0)
+
+    def test_items_are_embedded_with_one_query(self):
+        """
+        Test that include=items:<limit> embeds the newest items of every store with a single extra query
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            self.create_stores(token)
+            for store_id in (1, 1, 1, 2):
+                self.client.post('v1/storelists/{}/items/'.format(store_id), data=json.dumps(dict(name='food')),
+                                 content_type='application/json', headers=dict(Authorization='Bearer ' + token))
+            queries = self.query_count()
+            response = self.client.get('v1/storelists/?include=items:2', headers=dict(Authorization='Bearer ' + token))
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self.query_count() - queries, 2)
+            self.assertEqual([item['id'] for item in data['stores'][0]['items']], [3, 2])
+            self.assertEqual([item['id'] for item in data['stores'][1]['items']], [4])
+            self.assertEqual(data['stores'][2]['items'], [])
+            response = self.client.get('v1/storelists/1?include=items', headers=dict(Authorization='Bearer ' + token))
+            data = json.loads(response.data.decode())
+            self.assertEqual(len(data['store']['items']), 3)
+            response = self.client.get('v1/storelists/1?include=owner', headers=dict(Authorization='Bearer ' + token))
+            self.assertEqual(response.status_code, 400)
+
+    def test_unchanged_store_list_is_not_modified(self):
+        """
+        Test that a store list matching the If-None-Match ETag gets a 304 until a store is edited
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            self.create_stores(token)
+            response = self.client.get('v1/storelists/', headers=dict(Authorization='Bearer ' + token))
+            etag = response.headers['ETag']
+            self.assertTrue(etag.startswith('W/'))
+            response = self.client.get('v1/storelists/', headers={'Authorization': 'Bearer ' + token,
+                                                                  'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.data, b'')
+            self.client.put('v1/storelists/1', headers=dict(Authorization='Bearer ' + token),
+                            data=json.dumps(dict(name='Adventure')), content_type='application/json')
+            response = self.client.get('v1/storelists/', headers={'Authorization': 'Bearer ' + token,
+                                                                  'If-None-Match': etag})
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_store_list_is_served_from_the_response_cache(self):
+        """
+        Test that a repeated store list is read from the cache and a new store evicts it
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            self.create_stores(token)
+            self.client.get('v1/storelists/?page=2', headers=dict(Authorization='Bearer ' + token))
+            queries = self.query_count()
+            response = self.client.get('v1/storelists/?page=2', headers=dict(Authorization='Bearer ' + token))
+            data = json.loads(response.data.decode())
+            self.assertEqual(self.query_count() - queries, 0)
+            self.assertEqual(data['count'], 6)
+            self.create_store(token)
+            response = self.client.get('v1/storelists/?page=2', headers=dict(Authorization='Bearer ' + token))
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['count'], 7)
+            response = self.client.get('v1/cache/stats', headers=dict(Authorization='Bearer ' + token))
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['responseCache']['hits'], 1)
+            self.assertEqual(data['responseCache']['misses'], 2)
+            self.assertEqual(data['responseCache']['evictions'], 1)
+
+    def test_stats_endpoints_are_hidden_unless_enabled(self):
+        """
+        Test that the cache and hasher stats are not found when the stats endpoints are disabled
+        :return:
+        """
+        self.app.config['STATS_ENDPOINTS_ENABLED'] = False
+        try:
+            with self.client:
+                token = self.get_user_token()
+                for url in ('v1/cache/stats', 'v1/hasher/stats'):
+                    response = self.client.get(url, headers=dict(Authorization='Bearer ' + token))
+                    self.assertEqual(response.status_code, 404)
+        finally:
+            self.app.config['STATS_ENDPOINTS_ENABLED'] = True
+
+    def test_bulk_store_operations(self):
+        """
+        Test that a batch creates, renames and deletes stores and reports every operation
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            self.create_stores(token)
+            operations = [
+                {'op': 'create', 'name': 'Groceries'},
+                {'op': 'update', 'id': 1, 'name': 'Adventure'},
+                {'op': 'delete', 'id': 2},
+                {'op': 'delete', 'id': 2},
+                {'op': 'create'},
+                {'op': 'rename', 'id': 3}
+            ]
+            response = self.client.post('v1/storelists/bulk', data=json.dumps(dict(operations=operations)),
+                                        content_type='application/json',
+                                        headers=dict(Authorization='Bearer ' + token))
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([result['status'] for result in data['results']],
+                             ['success', 'success', 'success', 'failed', 'failed', 'failed'])
+            self.assertEqual(data['results'][0]['id'], 7)
+            response = self.client.get('v1/storelists/?page=1', headers=dict(Authorization='Bearer ' + token))
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['count'], 6)
+            self.assertEqual(data['stores'][0]['name'], 'Adventure')
+            self.assertEqual(data['stores'][1]['id'], 3)
+
+    def test_bulk_operations_reject_ids_that_are_not_whole_numbers(self):
+        """
+        Test that booleans and fractional Ids are not read as Store Ids, digit strings are
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            self.create_stores(token)
+            operations = [
+                {'op': 'delete', 'id': True},
+                {'op': 'delete', 'id': 2.7},
+                {'op': 'delete', 'id': '3'}
+            ]
+            response = self.client.post('v1/storelists/bulk', data=json.dumps(dict(operations=operations)),
+                                        content_type='application/json',
+                                        headers=dict(Authorization='Bearer ' + token))
+            data = json.loads(response.data.decode())
+            self.assertEqual([result['status'] for result in data['results']], ['failed', 'failed', 'success'])
+            self.assertEqual(data['results'][2]['id'], 3)
+
+    def test_store_reads_do_not_build_model_instances(self):
+        """
+        Test that store lists, their embedded items and store reads come back as plain rows, which
+        stay out of the identity map while the rows are still referenced
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            self.create_stores(token)
+            self.client.post('v1/storelists/1/items/', data=json.dumps(dict(name='food')),
+                             content_type='application/json', headers=dict(Authorization='Bearer ' + token))
+            user_id = db.session.query(User.id).scalar()
+            db.session.expunge_all()
+            with self.app.test_request_context():
+                stores, _, _, _ = paginate_stores(user_id, 1, None)
+            items = StoreItem.first_items([store.id for store in stores], 3)
+            store = Store.get_user_store_row(user_id, 1)
+            rows = list(stores) + [item for store_items in items.values() for item in store_items] + [store]
+            self.assertEqual(len(rows), len(stores) + 2)
+            for row in rows:
+                self.assertNotIsInstance(row, (Store, StoreItem))
+            self.assertEqual(len(db.session.identity_map), 0)
+            self.assertEqual(store.name, 'travel')
+
+    def test_stores_are_returned_with_sparse_fields(self):
+        """
+        Test that the fields and fields[items] parameters trim the stores and their embedded items
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            self.create_stores(token)
+            self.client.post('v1/storelists/1/items/', data=json.dumps(dict(name='food', description='Bread')),
+                             content_type='application/json', headers=dict(Authorization='Bearer ' + token))
+            response = self.client.get('v1/storelists/?fields=id,name&include=items&fields[items]=name',
+                                       headers=dict(Authorization='Bearer ' + token))
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(data['stores'][0], {'id': 1, 'name': 'travel', 'items': [{'name': 'food'}]})
+            self.assertIn('fields=id%2Cname', data['next'])
+            response = self.client.get('v1/storelists/1?fields=itemCount', headers=dict(Authorization='Bearer ' + token))
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['store'], {'itemCount': 1})
+            response = self.client.get('v1/storelists/?fields=', headers=dict(Authorization='Bearer ' + token))
+            self.assertEqual(response.status_code, 400)
+
+    def test_bulk_operations_are_limited(self):
+        """
+        Test that a batch larger than the configured limit is refused
+        :return:
+        """
+        with self.client:
+            operations = [{'op': 'create', 'name': 'Travel'}] * 501
+            response = self.client.post('v1/storelists/bulk', data=json.dumps(dict(operations=operations)),
+                                        content_type='application/json',
+                                        headers=dict(Authorization='Bearer ' + self.get_user_token()))
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(data['message'], 'A batch can hold at most 500 operations')
+
+
 if __name__ == '__main__':
     unittest.main()
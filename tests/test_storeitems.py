@@ -1,5 +1,10 @@
 from tests.base import BaseTestCase
+from flask_sqlalchemy import get_debug_queries
+from app import app, db
+from app.models import Store, ITEM_INSERT_RETURNING
 import unittest
+import datetime
+import gzip
 import json
 
 
@@ -361,6 +366,312 @@ class TestStoreItem(BaseTestCase):
             self.assertTrue(data['message'] == 'Successfully deleted the item from store with Id 1')
             self.assertEqual(response.status_code, 200)
 
+    def test_store_item_count_follows_item_writes(self):
+        """
+        Test that the store item count goes up and down with its items and drift can be repaired
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            self.create_store(token)
+            self.create_items(token)
+            self.client.delete('v1/storelists/1/items/1/', headers=dict(Authorization='Bearer ' + token))
+            response = self.client.get('v1/storelists/1', headers=dict(Authorization='Bearer ' + token))
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['store']['itemCount'], 5)
+            Store.query.filter_by(id=1).update({Store.item_count: 42})
+            db.session.commit()
+            self.assertEqual(Store.reconcile_item_counts(), 1)
+            self.assertEqual(Store.query.get(1).item_count, 5)
+
+    def test_item_writes_leave_the_store_row_alone(self):
+        """
+        Test that item writes only log a change for the store, which still shows the new count and
+        a new ETag, and that folding the log keeps both
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            self.create_store(token)
+            response = self.client.get('v1/storelists/1', headers=dict(Authorization='Bearer ' + token))
+            etag = response.headers['ETag']
+            modified_at = json.loads(response.data.decode())['store']['modifiedAt']
+            queries = self.query_count()
+            self.create_items(token)
+            self.client.put('v1/storelists/1/items/1/', data=json.dumps(dict(name='bread')),
+                            content_type='application/json', headers=dict(Authorization='Bearer ' + token))
+            statements = [query.statement for query in get_debug_queries()[queries:]]
+            self.assertFalse([statement for statement in statements if statement.startswith('UPDATE stores')])
+            response = self.client.get('v1/storelists/1', headers={'Authorization': 'Bearer ' + token,
+                                                                   'If-None-Match': etag})
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['store']['itemCount'], 6)
+            self.assertEqual(data['store']['modifiedAt'], modified_at)
+            etag = response.headers['ETag']
+            self.client.put('v1/storelists/1/items/2/', data=json.dumps(dict(name='milk')),
+                            content_type='application/json', headers=dict(Authorization='Bearer ' + token))
+            response = self.client.get('v1/storelists/1', headers={'Authorization': 'Bearer ' + token,
+                                                                   'If-None-Match': etag})
+            self.assertEqual(response.status_code, 200)
+            etag = response.headers['ETag']
+            self.assertEqual(Store.fold_item_changes(), 8)
+            self.assertEqual(Store.query.get(1).item_count, 6)
+            response = self.client.get('v1/storelists/1', headers={'Authorization': 'Bearer ' + token,
+                                                                   'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+
+    def test_concurrent_item_writes_to_a_store_do_not_wait(self):
+        """
+        Test that a transaction adding an item to a store does not hold up another one adding an item
+        to the same store until it commits
+        :return:
+        """
+        if db.engine.dialect.name != 'postgresql':
+            self.skipTest('Row locks are checked on PostgreSQL')
+        with self.client:
+            token = self.get_user_token()
+            self.create_store(token)
+            user_id = Store.query.get(1).user_id
+            db.session.commit()
+            first = db.engine.connect()
+            second = db.engine.connect()
+            try:
+                first_transaction = first.begin()
+                second_transaction = second.begin()
+                # Waiting on the first transaction's locks fails the second writer instead of blocking the test
+                second.execute('SET LOCAL lock_timeout = 1000')
+                for connection, name in ((first, 'bread'), (second, 'milk')):
+                    connection.execute(ITEM_INSERT_RETURNING, {
+                        'name': name, 'description': None, 'store_id': 1, 'user_id': user_id,
+                        'now': datetime.datetime.utcnow()
+                    })
+                second_transaction.commit()
+                first_transaction.commit()
+            finally:
+                first.close()
+                second.close()
+            response = self.client.get('v1/storelists/1', headers=dict(Authorization='Bearer ' + token))
+            self.assertEqual(json.loads(response.data.decode())['store']['itemCount'], 2)
+
+    def test_items_are_imported_from_ndjson(self):
+        """
+        Test that an NDJSON import inserts the valid rows in chunks and reports the invalid ones
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            self.create_store(token)
+            body = '\n'.join(['{"name": "Bread"}', '{"name": "Milk", "description": "Fresh"}', '{"description": "x"}',
+                              'not json', '{"name": "Eggs"}'])
+            response = self.client.post('v1/storelists/1/items/import', data=body,
+                                        content_type='application/x-ndjson',
+                                        headers=dict(Authorization='Bearer ' + token))
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(data['imported'], 3)
+            self.assertEqual(data['failed'], 2)
+            self.assertEqual([error['line'] for error in data['errors']], [3, 4])
+            self.assertEqual(db.session.query(Store.item_total).filter_by(id=1).scalar(), 3)
+
+    def test_items_are_imported_from_csv(self):
+        """
+        Test that a CSV import reads the header, keeps quoted multi-line descriptions and reports rows without a name
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            self.create_store(token)
+            body = 'name,description\r\nBread,"Baked\r\ntoday"\r\n,No name\r\nMilk,Fresh\r\n'
+            response = self.client.post('v1/storelists/1/items/import', data=body, content_type='text/csv',
+                                        headers=dict(Authorization='Bearer ' + token))
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(data['imported'], 2)
+            self.assertEqual(data['failed'], 1)
+            self.assertEqual(data['errors'], [{'line': 4, 'message': 'No name or value attribute found'}])
+            response = self.client.get('v1/storelists/1/items/', headers=dict(Authorization='Bearer ' + token))
+            items = json.loads(response.data.decode())['items']
+            self.assertEqual(sorted((item['name'], item['description']) for item in items),
+                             [('bread', 'Baked\r\ntoday'), ('milk', 'Fresh')])
+
+    def test_import_reports_lines_over_the_length_limit(self):
+        """
+        Test that an NDJSON line longer than the limit is reported without stopping the import
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            self.create_store(token)
+            long_line = '{"name": "' + 'x' * app.config['ITEM_IMPORT_MAX_LINE_BYTES'] + '"}'
+            body = '\n'.join(['{"name": "Bread"}', long_line, '{"name": "Eggs"}'])
+            response = self.client.post('v1/storelists/1/items/import', data=body,
+                                        content_type='application/x-ndjson',
+                                        headers=dict(Authorization='Bearer ' + token))
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['imported'], 2)
+            self.assertEqual(data['errors'], [{'line': 2, 'message': 'Line is longer than {} bytes'.format(
+                app.config['ITEM_IMPORT_MAX_LINE_BYTES'])}])
+
+    def test_items_are_exported_as_a_stream(self):
+        """
+        Test that an export streams every item as ndjson, gzipped when the client accepts it
+        :return:
+        """
+        # Streamed responses keep their request context until they are closed, so the requests are
+        # made outside a client block and every response is closed once it has been read
+        token = self.get_user_token()
+        self.create_store(token)
+        self.create_items(token)
+        response = self.client.get('v1/storelists/1/items/export',
+                                   headers=dict(Authorization='Bearer ' + token))
+        body = response.data
+        response.close()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        rows = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual([row['id'] for row in rows], [1, 2, 3, 4, 5, 6])
+        response = self.client.get('v1/storelists/1/items/export?format=csv',
+                                   headers={'Authorization': 'Bearer ' + token, 'Accept-Encoding': 'gzip'})
+        body = response.data
+        response.close()
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        lines = gzip.decompress(body).decode().splitlines()
+        self.assertEqual(lines[0], 'id,name,description,storeId,createdAt,modifiedAt')
+        self.assertEqual(len(lines), 7)
+
+    def test_item_writes_are_single_statements(self):
+        """
+        Test that creating, editing and deleting an item each run one owner scoped statement
+        :return:
+        """
+        if db.engine.dialect.name != 'postgresql':
+            self.skipTest('Single statement writes are used on PostgreSQL')
+        with self.client:
+            token = self.get_user_token()
+            self.create_store(token)
+            queries = self.query_count()
+            response = self.client.post('v1/storelists/1/items/', data=json.dumps(dict(name='food')),
+                                        content_type='application/json', headers=dict(Authorization='Bearer ' + token))
+            self.assertEqual(self.query_count() - queries, 1)
+            self.assertEqual(json.loads(response.data.decode())['item']['name'], 'food')
+            queries = self.query_count()
+            response = self.client.put('v1/storelists/1/items/1/', data=json.dumps(dict(name='bread')),
+                                       content_type='application/json', headers=dict(Authorization='Bearer ' + token))
+            self.assertEqual(self.query_count() - queries, 1)
+            self.assertEqual(json.loads(response.data.decode())['item']['name'], 'bread')
+            queries = self.query_count()
+            response = self.client.delete('v1/storelists/1/items/1/', headers=dict(Authorization='Bearer ' + token))
+            self.assertEqual(self.query_count() - queries, 1)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(db.session.query(Store.item_total).filter_by(id=1).scalar(), 0)
+
+    def test_item_is_resolved_with_a_single_query(self):
+        """
+        Test that the item, its store and the store's owner are resolved by one query
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            self.create_store(token)
+            self.create_item(token)
+            queries = self.query_count()
+            response = self.client.get(
+                'v1/storelists/1/items/1/',
+                headers=dict(Authorization='Bearer ' + token)
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self.query_count() - queries, 1)
+
+    def test_items_are_paginated_with_a_cursor(self):
+        """
+        Test that cursor pagination returns the newest items first and walks through all of them
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            self.create_store(token)
+            self.create_items(token)
+            response = self.client.get('v1/storelists/1/items/?cursor=', headers=dict(Authorization='Bearer ' + token))
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([item['id'] for item in data['items']], [6, 5, 4])
+            self.assertEqual(data['count'], None)
+            response = self.client.get(data['next'], headers=dict(Authorization='Bearer ' + token))
+            data = json.loads(response.data.decode())
+            self.assertEqual([item['id'] for item in data['items']], [3, 2, 1])
+            self.assertEqual(data['next'], None)
+
+    def test_items_are_ranked_by_full_text_search(self):
+        """
+        Test that a full text search matches item descriptions and highlights the matched words
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            self.create_store(token)
+            self.create_items(token)
+            response = self.client.get('v1/storelists/1/items/?search=life',
+                                       headers=dict(Authorization='Bearer ' + token))
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(data['count'], 6)
+            self.assertIn('rank', data['items'][0])
+            self.assertIn('<mark>life</mark>', data['items'][0]['highlight']['description'])
+            response = self.client.get('v1/storelists/1/items/?search=missing',
+                                       headers=dict(Authorization='Bearer ' + token))
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['items'], [])
+
+    def test_search_highlights_escape_item_markup(self):
+        """
+        Test that markup stored in an item is escaped in the highlights while the matches are marked
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            self.create_store(token)
+            self.client.post(
+                'v1/storelists/1/items/',
+                data=json.dumps(dict(name='bread <b>x</b>', description='<script>alert(1)</script> bread')),
+                content_type='application/json',
+                headers=dict(Authorization='Bearer ' + token)
+            )
+            response = self.client.get('v1/storelists/1/items/?search=bread',
+                                       headers=dict(Authorization='Bearer ' + token))
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            highlight = data['items'][0]['highlight']
+            self.assertIn('<mark>bread</mark>', highlight['name'])
+            self.assertIn('&lt;b&gt;x&lt;/b&gt;', highlight['name'])
+            self.assertNotIn('<b>', highlight['name'])
+            self.assertIn('<mark>bread</mark>', highlight['description'])
+            self.assertNotIn('<script>', highlight['description'])
+
+    def test_items_are_returned_with_sparse_fields(self):
+        """
+        Test that the fields parameter trims the items and leaves the description out of the query
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            self.create_store(token)
+            self.create_items(token)
+            response = self.client.get('v1/storelists/1/items/?fields=id,name',
+                                       headers=dict(Authorization='Bearer ' + token))
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(data['items'][0], {'id': 6, 'name': 'foodad'})
+            self.assertTrue(data['next'].endswith('page=2&fields=id%2Cname'))
+            self.assertNotIn('description', get_debug_queries()[-1].statement)
+            response = self.client.get('v1/storelists/1/items/1/?fields=description',
+                                       headers=dict(Authorization='Bearer ' + token))
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['item'], {'description': 'Enjoying the good life'})
+            response = self.client.get('v1/storelists/1/items/?fields=id,price',
+                                       headers=dict(Authorization='Bearer ' + token))
+            self.assertEqual(response.status_code, 400)
+
     def create_item(self, token):
         """
         Create an item into a store
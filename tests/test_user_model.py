@@ -1,7 +1,9 @@
-from app import db
+from app import app, db
 from tests.base import BaseTestCase
-from app.models import User
+from app.models import User, BlackListToken
+import datetime
 import unittest
+import jwt
 
 
 class TestUserModel(BaseTestCase):
@@ -48,5 +50,47 @@ class TestUserModel(BaseTestCase):
         return auth_token
 
 
+
+class TestBlackListTokenModel(BaseTestCase):
+    """
+    Test the blacklist keeps token digests and purges expired tokens
+    """
+
+    def test_blacklisted_token_is_stored_as_a_digest_with_its_expiry(self):
+        """
+        Test that the raw token is not stored and the expiry is read from the token
+        :return:
+        """
+        token = self.make_token(datetime.timedelta(hours=1))
+        BlackListToken(token).blacklist()
+        row = BlackListToken.query.first()
+        self.assertEqual(len(row.token_hash), 64)
+        self.assertNotEqual(row.token_hash, token)
+        self.assertTrue(row.expires_at > datetime.datetime.utcnow())
+        self.assertTrue(BlackListToken.check_blacklist(token))
+
+    def test_expired_tokens_are_purged(self):
+        """
+        Test that only expired tokens are deleted from the blacklist
+        :return:
+        """
+        for hours in (-3, -2, -1):
+            BlackListToken(self.make_token(datetime.timedelta(hours=hours))).blacklist()
+        live_token = self.make_token(datetime.timedelta(hours=1))
+        BlackListToken(live_token).blacklist()
+        self.assertEqual(BlackListToken.purge_expired(2), 3)
+        self.assertEqual(BlackListToken.query.count(), 1)
+        self.assertTrue(BlackListToken.check_blacklist(live_token))
+
+    def make_token(self, lifetime):
+        """
+        Helper method to sign a token expiring after the given lifetime
+        :param lifetime: timedelta
+        :return:
+        """
+        now = datetime.datetime.utcnow()
+        return jwt.encode({'exp': now + lifetime, 'iat': now, 'sub': 1}, app.config['SECRET_KEY'],
+                          algorithm='HS256').decode('utf-8')
+
 if __name__ == '__main__':
     unittest.main()